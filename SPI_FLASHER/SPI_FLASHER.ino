@@ -3,6 +3,266 @@
 
 #include <SPI.h>
 #define LED 2
+
+// Binary bulk read ('B'), see spi_tool.py:
+//   request:  'B' seq:u8 address:u32le length:u32le
+//   response: 0xA5 0x5A seq:u8 status:u8 address:u32le length:u32le data[length] crc32:u32le
+//   (the CRC32 covers everything after the sync bytes)
+// Requests can be pipelined, they queue in the serial RX buffer and are answered in order
+#define BULK_SYNC1 0xA5
+#define BULK_SYNC2 0x5A
+#define BULK_OK 0x00
+#define BULK_BAD_REQUEST 0x01
+#define BULK_BAD_CRC 0x02
+#define BULK_MAX_LENGTH 0x1000000UL // 16 MB, the largest 24-bit address space
+#define PROTOCOL_VERSION 3
+
+// Sector commands (protocol 2), each answered by 0xA5 0x5A status:u8 ...:
+//   'H' address:u32le count:u16le          -> ... count:u16le crc32[count]:u32le  (CRC32 of each 4 KB sector)
+//   'S' address:u32le                      -> (sector erase, answered once WIP clears)
+//   'G' address:u32le length:u16le data crc32:u32le -> (page program, answered once WIP clears)
+//   'K' address:u32le count:u16le          -> ... count:u16le bitmap[(count+7)/8]  (bit set = sector erased, protocol 3)
+#define SECTOR_SIZE 4096
+#define PAGE_SIZE 256
+
+uint32_t crc_table[256];
+byte bulk_buffer[256];
+
+void init_crc_table() {
+  // Standard reflected CRC-32 (zlib.crc32 on the host)
+  for (uint32_t i = 0; i < 256; i++) {
+    uint32_t c = i;
+    for (int k = 0; k < 8; k++) {
+      c = (c & 1) ? (0xEDB88320UL ^ (c >> 1)) : (c >> 1);
+    }
+    crc_table[i] = c;
+  }
+}
+
+uint32_t crc32_update(uint32_t crc, const byte *data, size_t length) {
+  for (size_t i = 0; i < length; i++) {
+    crc = crc_table[(crc ^ data[i]) & 0xFF] ^ (crc >> 8);
+  }
+  return crc;
+}
+
+void put_u32(byte *data, uint32_t value) {
+  data[0] = value & 0xFF;
+  data[1] = (value >> 8) & 0xFF;
+  data[2] = (value >> 16) & 0xFF;
+  data[3] = (value >> 24) & 0xFF;
+}
+
+void write_u32(uint32_t value) {
+  byte data[4];
+  put_u32(data, value);
+  Serial.write(data, 4);
+}
+
+uint32_t read_u32(const byte *data) {
+  return (uint32_t)data[0] | ((uint32_t)data[1] << 8) | ((uint32_t)data[2] << 16) | ((uint32_t)data[3] << 24);
+}
+
+uint16_t read_u16(const byte *data) {
+  return (uint16_t)data[0] | ((uint16_t)data[1] << 8);
+}
+
+void write_enable() {
+  digitalWrite(D8, LOW);
+  SPI.transfer(0x06); // Write Enable
+  digitalWrite(D8, HIGH);
+}
+
+void wait_while_busy() {
+  // Poll status register 1 until WIP (bit 0) clears instead of sleeping a worst-case time
+  digitalWrite(D8, LOW);
+  SPI.transfer(0x05); // Read Status Register-1
+  while (SPI.transfer(0x00) & 0x01) {
+    yield();
+  }
+  digitalWrite(D8, HIGH);
+}
+
+void send_status(byte status) {
+  Serial.write(BULK_SYNC1);
+  Serial.write(BULK_SYNC2);
+  Serial.write(status);
+}
+
+void hash_sectors() {
+  byte header[6];
+  if (Serial.readBytes(header, 6) != 6) {
+    return;
+  }
+  uint32_t address = read_u32(header);
+  uint16_t count = read_u16(header + 4);
+  if (address % SECTOR_SIZE != 0 || address + (uint32_t)count * SECTOR_SIZE > BULK_MAX_LENGTH) {
+    send_status(BULK_BAD_REQUEST);
+    return;
+  }
+
+  send_status(BULK_OK);
+  Serial.write(count & 0xFF);
+  Serial.write(count >> 8);
+  for (uint16_t i = 0; i < count; i++) {
+    uint32_t sector = address + (uint32_t)i * SECTOR_SIZE;
+    uint32_t crc = 0xFFFFFFFFUL;
+    digitalWrite(D8, LOW);
+    SPI.transfer(0x03); // Read command
+    SPI.transfer((sector >> 16) & 0xFF);
+    SPI.transfer((sector >> 8) & 0xFF);
+    SPI.transfer(sector & 0xFF);
+    for (int n = 0; n < SECTOR_SIZE; n += sizeof(bulk_buffer)) {
+      memset(bulk_buffer, 0, sizeof(bulk_buffer));
+      SPI.transfer(bulk_buffer, sizeof(bulk_buffer));
+      crc = crc32_update(crc, bulk_buffer, sizeof(bulk_buffer));
+    }
+    digitalWrite(D8, HIGH);
+    write_u32(crc ^ 0xFFFFFFFFUL);
+    yield();
+  }
+}
+
+void blank_check_sectors() {
+  byte header[6];
+  if (Serial.readBytes(header, 6) != 6) {
+    return;
+  }
+  uint32_t address = read_u32(header);
+  uint16_t count = read_u16(header + 4);
+  if (address % SECTOR_SIZE != 0 || address + (uint32_t)count * SECTOR_SIZE > BULK_MAX_LENGTH) {
+    send_status(BULK_BAD_REQUEST);
+    return;
+  }
+
+  send_status(BULK_OK);
+  Serial.write(count & 0xFF);
+  Serial.write(count >> 8);
+  byte bits = 0;
+  for (uint16_t i = 0; i < count; i++) {
+    uint32_t sector = address + (uint32_t)i * SECTOR_SIZE;
+    bool erased = true;
+    digitalWrite(D8, LOW);
+    SPI.transfer(0x03); // Read command
+    SPI.transfer((sector >> 16) & 0xFF);
+    SPI.transfer((sector >> 8) & 0xFF);
+    SPI.transfer(sector & 0xFF);
+    // Stop reading at the first programmed byte, raising CS ends the read
+    for (int n = 0; n < SECTOR_SIZE && erased; n += sizeof(bulk_buffer)) {
+      memset(bulk_buffer, 0, sizeof(bulk_buffer));
+      SPI.transfer(bulk_buffer, sizeof(bulk_buffer));
+      for (size_t k = 0; k < sizeof(bulk_buffer); k++) {
+        if (bulk_buffer[k] != 0xFF) {
+          erased = false;
+          break;
+        }
+      }
+    }
+    digitalWrite(D8, HIGH);
+    if (erased) {
+      bits |= 1 << (i % 8);
+    }
+    if (i % 8 == 7 || i == count - 1) {
+      Serial.write(bits);
+      bits = 0;
+    }
+    yield();
+  }
+}
+
+void erase_sector() {
+  byte header[4];
+  if (Serial.readBytes(header, 4) != 4) {
+    return;
+  }
+  uint32_t address = read_u32(header);
+  if (address % SECTOR_SIZE != 0 || address >= BULK_MAX_LENGTH) {
+    send_status(BULK_BAD_REQUEST);
+    return;
+  }
+
+  write_enable();
+  digitalWrite(D8, LOW);
+  SPI.transfer(0x20); // Sector Erase (4 KB)
+  SPI.transfer((address >> 16) & 0xFF);
+  SPI.transfer((address >> 8) & 0xFF);
+  SPI.transfer(address & 0xFF);
+  digitalWrite(D8, HIGH);
+  wait_while_busy();
+  send_status(BULK_OK);
+}
+
+void program_page() {
+  byte header[6];
+  if (Serial.readBytes(header, 6) != 6) {
+    return;
+  }
+  uint32_t address = read_u32(header);
+  uint16_t length = read_u16(header + 4);
+  byte crc_bytes[4];
+  bool valid = length > 0 && length <= PAGE_SIZE && (address % PAGE_SIZE) + length <= PAGE_SIZE;
+  if (!valid || Serial.readBytes(bulk_buffer, length) != length || Serial.readBytes(crc_bytes, 4) != 4) {
+    send_status(BULK_BAD_REQUEST);
+    return;
+  }
+  if ((crc32_update(0xFFFFFFFFUL, bulk_buffer, length) ^ 0xFFFFFFFFUL) != read_u32(crc_bytes)) {
+    send_status(BULK_BAD_CRC);
+    return;
+  }
+
+  write_enable();
+  digitalWrite(D8, LOW);
+  SPI.transfer(0x02); // Page Program
+  SPI.transfer((address >> 16) & 0xFF);
+  SPI.transfer((address >> 8) & 0xFF);
+  SPI.transfer(address & 0xFF);
+  for (int i = 0; i < length; i++) {
+    SPI.transfer(bulk_buffer[i]);
+  }
+  digitalWrite(D8, HIGH);
+  wait_while_busy();
+  send_status(BULK_OK);
+}
+
+void bulk_read() {
+  byte header[9];
+  if (Serial.readBytes(header, 9) != 9) {
+    return; // Truncated request, the host times out and retries
+  }
+  byte seq = header[0];
+  uint32_t address = read_u32(header + 1);
+  uint32_t length = read_u32(header + 5);
+  bool valid = length > 0 && length <= BULK_MAX_LENGTH && address < BULK_MAX_LENGTH;
+
+  byte response[12] = {BULK_SYNC1, BULK_SYNC2, seq, (byte)(valid ? BULK_OK : BULK_BAD_REQUEST)};
+  put_u32(response + 4, address);
+  put_u32(response + 8, valid ? length : 0);
+  Serial.write(response, 12);
+  uint32_t crc = crc32_update(0xFFFFFFFFUL, response + 2, 10);
+  if (!valid) {
+    write_u32(crc ^ 0xFFFFFFFFUL);
+    return;
+  }
+
+  // One continuous read command for the whole block, streamed out 256 bytes at a time
+  digitalWrite(D8, LOW);
+  SPI.transfer(0x03); // Read command
+  SPI.transfer((address >> 16) & 0xFF);
+  SPI.transfer((address >> 8) & 0xFF);
+  SPI.transfer(address & 0xFF);
+  while (length > 0) {
+    size_t n = length < sizeof(bulk_buffer) ? length : sizeof(bulk_buffer);
+    memset(bulk_buffer, 0, n);
+    SPI.transfer(bulk_buffer, n);
+    crc = crc32_update(crc, bulk_buffer, n);
+    Serial.write(bulk_buffer, n);
+    length -= n;
+    yield(); // Keep the watchdog fed on long blocks
+  }
+  digitalWrite(D8, HIGH);
+  write_u32(crc ^ 0xFFFFFFFFUL);
+}
+
 void setup() {
   Serial.begin(921600); // High baud rate for faster transfer
   SPI.begin();
@@ -11,6 +271,7 @@ void setup() {
   pinMode(D8, OUTPUT); // CS pin
   digitalWrite(D8, HIGH);
   pinMode(LED, OUTPUT);
+  init_crc_table();
   for (int i = 0; i < 8 ; i++){
     digitalWrite(LED, HIGH);
     //Serial.println("LED is on");
@@ -36,6 +297,19 @@ void loop() {
       Serial.write(manufacturer_id);
       Serial.write(memory_type);
       Serial.write(capacity);
+    } else if (command == 'P') { // Protocol probe, old sketches don't answer
+      Serial.write((const byte *)"SPIF", 4);
+      Serial.write(PROTOCOL_VERSION);
+    } else if (command == 'B') { // Binary bulk read
+      bulk_read();
+    } else if (command == 'H') { // CRC32 per sector
+      hash_sectors();
+    } else if (command == 'K') { // Erased sector bitmap
+      blank_check_sectors();
+    } else if (command == 'S') { // Sector erase
+      erase_sector();
+    } else if (command == 'G') { // Page program with CRC check
+      program_page();
     } else if (command == 'R') { // Read Data
       long address = Serial.parseInt();
       int length = Serial.parseInt();
@@ -51,6 +325,9 @@ void loop() {
     } else if (command == 'W') { // Write Data
       long address = Serial.parseInt();
       int length = Serial.parseInt();
+      if (Serial.peek() == ',') {
+        Serial.read(); // parseInt leaves the separator, it isn't part of the data
+      }
       byte buffer[length];
       Serial.readBytes(buffer, length);
 
@@ -67,6 +344,7 @@ void loop() {
         SPI.transfer(buffer[i]);
       }
       digitalWrite(D8, HIGH);
+      wait_while_busy();
     } else if (command == 'E') { // Erase Chip
       digitalWrite(D8, LOW);
       SPI.transfer(0x06); // Write Enable
@@ -75,8 +353,8 @@ void loop() {
       digitalWrite(D8, LOW);
       SPI.transfer(0xC7); // Chip Erase
       digitalWrite(D8, HIGH);
-      // Wait for erase to complete - this can take a while
-      delay(5000);
+      // Wait for erase to complete - this can take a while (tens of seconds on a GD25Q64)
+      wait_while_busy();
     }
   }
 }
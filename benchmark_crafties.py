@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Decoder Benchmark - synthetic corpus generator and throughput benchmark for decrypt_crafties
+Builds XOR-encrypted MP3 files laid out like the SD card (craftie/EN/<UUID>/<AUDIO_ID>.abc)
+with known keys, then times each stage of the decoder and checks key recovery accuracy
+
+Usage: python benchmark_crafties.py [--files N] [--size-kb KB] [--json results.json]
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import decrypt_crafties
+
+# MPEG 1 Layer III frame header template: 0xFF 0xFB, then bitrate/sample rate byte, then channel mode
+MPEG1_L3_BITRATES = [32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MPEG1_SAMPLE_RATES = [44100, 48000, 32000]
+
+def build_mp3_stream(rng, size, bitrate=128, sample_rate=44100, id3=False):
+    """Build a valid MPEG 1 Layer III frame stream of about size bytes (random payload)"""
+    bitrate_index = MPEG1_L3_BITRATES.index(bitrate) + 1
+    sample_rate_index = MPEG1_SAMPLE_RATES.index(sample_rate)
+    out = bytearray()
+
+    if id3:
+        # ID3v2.4 tag with a synchsafe size and zero padding
+        tag_size = rng.randrange(64, 2048)
+        out += b'ID3\x04\x00\x00' + bytes([(tag_size >> 21) & 0x7F, (tag_size >> 14) & 0x7F,
+                                           (tag_size >> 7) & 0x7F, tag_size & 0x7F])
+        out += bytes(tag_size)
+
+    # Padding bits follow the usual fractional-slot pattern
+    slot_remainder = 0
+    while len(out) < size:
+        slot_remainder += (144 * bitrate * 1000) % sample_rate
+        padding = 1 if slot_remainder >= sample_rate else 0
+        slot_remainder %= sample_rate
+
+        frame_length = 144 * bitrate * 1000 // sample_rate + padding
+        out += bytes([0xFF, 0xFB, (bitrate_index << 4) | (sample_rate_index << 2) | (padding << 1), 0x64])
+        out += rng.randbytes(frame_length - 4)
+
+    return bytes(out)
+
+def build_corpus(root, num_files=24, size_kb=512, id3_ratio=0.5, files_per_craftie=6, seed=1):
+    """Write an encrypted synthetic corpus under root, returns {relative path: key}"""
+    rng = random.Random(seed)
+    keys = {}
+
+    for i in range(num_files):
+        if i % files_per_craftie == 0:
+            uuid = f"0100000{rng.randrange(10**5):05d}"
+            folder = os.path.join(root, 'craftie', 'EN', uuid)
+            os.makedirs(folder, exist_ok=True)
+
+        audio_id = rng.randrange(1000, 99999)
+        size = int(size_kb * 1024 * rng.uniform(0.75, 1.25))
+        data = build_mp3_stream(rng, size, bitrate=rng.choice([64, 96, 128]), id3=rng.random() < id3_ratio)
+
+        key = rng.randrange(1, 256)
+        rel_path = os.path.join('craftie', 'EN', uuid, f"{audio_id}.abc")
+        with open(os.path.join(root, rel_path), 'wb') as f:
+            f.write(decrypt_crafties.apply_pure_xor(data, key))
+        keys[rel_path] = key
+
+    with open(os.path.join(root, 'keys.json'), 'w') as f:
+        json.dump(keys, f, indent=2)
+
+    return keys
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its children so far, in MB"""
+    if resource is None:
+        return None
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # bytes on macOS, KB on Linux
+    return max(self_rss, child_rss) / scale
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the decoder's progress output while timing"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def timed(name, func, total_bytes=0, count=0):
+    """Run func once, print and return a result dict with seconds, MB/s and items/s"""
+    start = time.perf_counter()
+    with quiet():
+        value = func()
+    elapsed = time.perf_counter() - start
+
+    result = {'name': name, 'seconds': elapsed, 'bytes': total_bytes, 'items': count}
+    line = f"  {name:32} {elapsed:8.3f}s"
+    if total_bytes:
+        result['mb_per_s'] = total_bytes / elapsed / 1e6 if elapsed else None
+        line += f"  {total_bytes / elapsed / 1e6 if elapsed else 0:9.1f} MB/s"
+    if count:
+        result['items_per_s'] = count / elapsed if elapsed else None
+        line += f"  {count / elapsed if elapsed else 0:9.1f} /s"
+    print(line)
+
+    return result, value
+
+def run_benchmark(root, keys, jobs=1):
+    """Time each decoder stage on the corpus, returns the results dict"""
+    paths = [os.path.join(root, rel_path) for rel_path in keys]
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    chunks = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            chunks.append(f.read(4096))
+
+    stages = []
+    print(f"\nCorpus: {len(paths)} files, {total_bytes / 1e6:.1f} MB")
+    print(f"XOR backend: {decrypt_crafties.XOR_BACKEND}, phase 1 scoring: {decrypt_crafties.SCORING_MODE}\n")
+
+    # apply_pure_xor over every file with its key
+    def xor_all():
+        for path in paths:
+            with open(path, 'rb') as f:
+                decrypt_crafties.apply_pure_xor(f.read(), 0x5A)
+    stages.append(timed('apply_pure_xor', xor_all, total_bytes, len(paths))[0])
+
+    # analyze_chunk_quality for all 256 keys of each first chunk (the brute force phase 1)
+    def chunk_quality_all():
+        for chunk in chunks:
+            for xor_key in range(256):
+                decrypt_crafties.analyze_chunk_quality(decrypt_crafties.apply_pure_xor(chunk, xor_key))
+    stages.append(timed('analyze_chunk_quality x256', chunk_quality_all,
+                        sum(len(c) for c in chunks) * 256, len(chunks) * 256)[0])
+
+    def score_all():
+        for chunk in chunks:
+            decrypt_crafties.score_all_keys(chunk)
+    stages.append(timed('score_all_keys', score_all, sum(len(c) for c in chunks), len(chunks))[0])
+
+    # discover_xor_key, with accuracy against the known keys
+    def discover_all():
+        found = {}
+        for rel_path in keys:
+            candidates = decrypt_crafties.discover_xor_key(os.path.join(root, rel_path))
+            found[rel_path] = (candidates[0][0], candidates[0][4].get('key_path')) if candidates else (None, None)
+        return found
+    result, found = timed('discover_xor_key', discover_all, total_bytes, len(paths))
+    stages.append(result)
+
+    correct = sum(1 for rel_path, key in keys.items() if found[rel_path][0] == key)
+    key_paths = {}
+    for key, key_path in found.values():
+        key_paths[key_path] = key_paths.get(key_path, 0) + 1
+
+    # decrypt_file with the known keys
+    output_dir = tempfile.mkdtemp(prefix='bench_out_')
+    def decrypt_all():
+        for i, (rel_path, key) in enumerate(keys.items()):
+            decrypt_crafties.decrypt_file(os.path.join(root, rel_path), os.path.join(output_dir, f"{i}.mp3"), key)
+    stages.append(timed('decrypt_file', decrypt_all, total_bytes, len(paths))[0])
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    # process_directory over each craftie folder (no key cache, fresh manifest)
+    folders = sorted({os.path.dirname(path) for path in paths})
+    def process_all():
+        for folder in folders:
+            # Every run skips what the manifest already has, so each benchmark run starts without one
+            manifest_path = os.path.join(folder, decrypt_crafties.MANIFEST_FILENAME)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            decrypt_crafties.process_directory(folder, jobs=jobs, key_cache_path='')
+    stages.append(timed(f'process_directory (jobs={jobs})', process_all, total_bytes, len(paths))[0])
+
+    print(f"\nKey recovery: {correct}/{len(keys)} correct ({correct / len(keys) * 100:.1f}%)")
+    for key_path, count in sorted(key_paths.items(), key=lambda item: str(item[0])):
+        print(f"  {key_path}: {count} files")
+
+    rss = peak_rss_mb()
+    if rss is not None:
+        print(f"Peak RSS: {rss:.1f} MB")
+
+    return {
+        'files': len(paths),
+        'bytes': total_bytes,
+        'xor_backend': decrypt_crafties.XOR_BACKEND,
+        'scoring': decrypt_crafties.SCORING_MODE,
+        'jobs': jobs,
+        'stages': stages,
+        'accuracy': correct / len(keys),
+        'key_paths': {str(k): v for k, v in key_paths.items()},
+        'peak_rss_mb': rss,
+    }
+
+def main():
+    """Build (or reuse) a synthetic corpus and benchmark the decoder on it"""
+
+    parser = argparse.ArgumentParser(description='Decoder benchmark with a synthetic encrypted corpus')
+    parser.add_argument('--corpus', help='Corpus directory (reused if it has keys.json, default: temporary)')
+    parser.add_argument('--files', type=int, default=24, help='Number of files to generate (default: 24)')
+    parser.add_argument('--size-kb', type=int, default=512, help='Average file size in KB (default: 512)')
+    parser.add_argument('--id3-ratio', type=float, default=0.5, help='Fraction of files with an ID3 tag (default: 0.5)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the corpus (default: 1)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Jobs for the process_directory stage (default: 1)')
+    parser.add_argument('--xor-backend', choices=['auto'] + decrypt_crafties.XOR_BACKENDS, default='auto',
+                        help='XOR implementation to benchmark (default: auto)')
+    parser.add_argument('--scoring', choices=decrypt_crafties.SCORING_MODES, default='histogram',
+                        help='Phase 1 scoring mode to benchmark (default: histogram)')
+    parser.add_argument('--json', help='Save results to this JSON file')
+
+    args = parser.parse_args()
+
+    decrypt_crafties.set_xor_backend(args.xor_backend)
+    decrypt_crafties.set_scoring_mode(args.scoring)
+
+    print("="*80)
+    print("DECODER BENCHMARK")
+    print("="*80)
+
+    temporary = args.corpus is None
+    root = args.corpus or tempfile.mkdtemp(prefix='bench_corpus_')
+    keys_path = os.path.join(root, 'keys.json')
+
+    try:
+        if os.path.exists(keys_path):
+            print(f"Reusing corpus: {root}")
+            with open(keys_path) as f:
+                keys = json.load(f)
+        else:
+            print(f"Building corpus: {root} ({args.files} files, ~{args.size_kb} KB each)")
+            keys = build_corpus(root, args.files, args.size_kb, args.id3_ratio, seed=args.seed)
+
+        results = run_benchmark(root, keys, args.jobs)
+    finally:
+        if temporary:
+            shutil.rmtree(root, ignore_errors=True)
+
+    results['timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    results['python'] = sys.version.split()[0]
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+SPI Tool Benchmark - spi_tool.py against the flash-chip emulator, legacy vs binary protocol
+Runs spi_emulator.py's FlashEmulator on a pty with a synthetic firmware-like image and times each
+spi_tool command by the emulator's clock (first command to last byte sent), so the 2 s board
+reset wait and Python startup don't count
+
+Usage: python benchmark_spi.py [--size-kb KB] [--protocols 0 3] [--json results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import spi_tool
+import spi_emulator
+
+SPI_TOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spi_tool.py')
+
+def build_image(rng, size, used_ratio=0.5):
+    """Firmware-like image: random data in used_ratio of the sectors, in runs, the rest erased"""
+    image = bytearray(b'\xFF' * size)
+    sectors = size // spi_tool.SECTOR_SIZE
+    sector = 0
+    while sector < sectors:
+        run = rng.randrange(1, 16)
+        if rng.random() < used_ratio:
+            start = sector * spi_tool.SECTOR_SIZE
+            end = min(sector + run, sectors) * spi_tool.SECTOR_SIZE
+            image[start:end] = rng.randbytes(end - start)
+        sector += run
+    return image
+
+def change_sectors(rng, image, count):
+    """Copy of image with count random sectors rewritten (like a small firmware/config update)"""
+    changed = bytearray(image)
+    sectors = len(image) // spi_tool.SECTOR_SIZE
+    for sector in rng.sample(range(sectors), min(count, sectors)):
+        start = sector * spi_tool.SECTOR_SIZE
+        changed[start:start + spi_tool.SECTOR_SIZE] = rng.randbytes(spi_tool.SECTOR_SIZE)
+    return changed
+
+def wait_idle(emulator, settle=0.3):
+    """Wait until the emulator has worked through everything the client sent"""
+    last = None
+    while True:
+        time.sleep(settle)
+        if emulator.idle and not emulator.link.rx and emulator.last_command == last:
+            return
+        last = emulator.last_command
+
+def run_command(emulator, path, args):
+    """Run one spi_tool command against the emulator, returns (stats, exit code)"""
+    wait_idle(emulator)
+    emulator.reset_stats()
+    process = subprocess.run([sys.executable, SPI_TOOL, path] + args,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wait_idle(emulator)
+    if process.returncode:
+        print(process.stderr, file=sys.stderr)
+    return emulator.stats(), process.returncode
+
+def timed(emulator, path, name, args, total_bytes, check):
+    """Run and check one command, print and return its result dict"""
+    stats, returncode = run_command(emulator, path, args)
+    elapsed = stats['active_seconds']
+    ok = returncode == 0 and check()
+
+    result = {
+        'name': name,
+        'protocol': emulator.protocol,
+        'seconds': elapsed,
+        'bytes': total_bytes,
+        'kb_per_s': total_bytes / elapsed / 1024 if elapsed else None,
+        'round_trips': stats['round_trips'],
+        'bytes_in': stats['bytes_in'],
+        'bytes_out': stats['bytes_out'],
+        'busy_seconds': stats['busy_seconds'],
+        'spi_seconds': stats['spi_seconds'],
+        'ok': ok,
+    }
+    print(f"  {name:20} {elapsed:8.2f}s  {result['kb_per_s'] or 0:8.1f} KB/s  {stats['round_trips']:7} commands  "
+          f"{stats['bytes_in'] + stats['bytes_out']:9} bytes on the wire  {'OK' if ok else 'FAILED'}")
+    return result
+
+def run_benchmark(emulator, path, workdir, image, update, protocol):
+    """Time id, dumps, erase and flashes at one protocol version, returns the result dicts"""
+    emulator.protocol = protocol
+    size = len(image)
+    size_kb = size // 1024
+    results = []
+
+    def device_is(expected):
+        return lambda: emulator.flash[:size] == expected
+
+    def file_is(filename, expected):
+        return lambda: spi_tool.read_image(filename)[:size] == expected
+
+    print(f"\nProtocol {protocol}{' (original I/R/W/E sketch)' if protocol == 0 else ''}:")
+    emulator.flash[:size] = image
+
+    results.append(timed(emulator, path, 'id', ['id'], 0, lambda: emulator.commands.get('I') == 1))
+
+    dump_path = os.path.join(workdir, f"dump{protocol}.bin")
+    results.append(timed(emulator, path, 'dump', ['dump', dump_path, str(size_kb)], size,
+                         file_is(dump_path, image)))
+
+    if protocol >= 1:
+        sparse_path = os.path.join(workdir, f"dump{protocol}.bin" + spi_tool.SPARSE_SUFFIX)
+        results.append(timed(emulator, path, 'dump sparse', ['dump', sparse_path, str(size_kb)], size,
+                             file_is(sparse_path, image)))
+
+    results.append(timed(emulator, path, 'erase', ['erase'], 0,
+                         lambda: emulator.flash.count(0xFF) == len(emulator.flash)))
+
+    # Page programming only clears bits, so each flash starts from an erased chip as after 'erase'
+    update_path = os.path.join(workdir, 'update.bin')
+    with open(update_path, 'wb') as f:
+        f.write(update)
+
+    emulator.flash[:size] = b'\xFF' * size
+    results.append(timed(emulator, path, 'flash full', ['flash', update_path, 'full'], size, device_is(update)))
+
+    # Differential flashing updates the old image in place, the original sketch has to start erased
+    emulator.flash[:size] = image if protocol >= 2 else b'\xFF' * size
+    name = 'flash update' if protocol >= 2 else 'flash update (full)'
+    results.append(timed(emulator, path, name, ['flash', update_path], size, device_is(update)))
+
+    return results
+
+def main():
+    """Benchmark spi_tool against the emulator at each protocol version"""
+
+    parser = argparse.ArgumentParser(description='spi_tool throughput benchmark on the flash-chip emulator')
+    parser.add_argument('--size-kb', type=int, default=512, help='Image size in KB (default: 512)')
+    parser.add_argument('--used', type=float, default=0.5, help='Fraction of non-erased sectors (default: 0.5)')
+    parser.add_argument('--changed', type=int, default=4, help='Sectors changed by the update image (default: 4)')
+    parser.add_argument('--protocols', type=int, nargs='+', default=[0, 3], choices=[0, 1, 2, 3],
+                        help='Sketch protocol versions to compare (default: 0 3)')
+    parser.add_argument('--baud', type=int, default=spi_tool.BAUD_RATE, help='Simulated baud rate (default: 921600)')
+    parser.add_argument('--spi-mhz', type=float, default=spi_emulator.DEFAULT_TIMINGS['spi_clock_hz'] / 1e6,
+                        help='Simulated SPI clock in MHz (default: 1, the ESP8266 default)')
+    # spi_tool gives 'erase' a fixed 6 s, the datasheet's 25 s would only make the run longer
+    parser.add_argument('--chip-erase-s', type=float, default=1.0,
+                        help='Simulated chip erase time in seconds (default: 1)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the images (default: 1)')
+    parser.add_argument('--json', help='Save results to this JSON file')
+
+    args = parser.parse_args()
+
+    print("="*80)
+    print("SPI TOOL BENCHMARK")
+    print("="*80)
+
+    rng = random.Random(args.seed)
+    size = args.size_kb // 4 * spi_tool.SECTOR_SIZE
+    image = build_image(rng, size, args.used)
+    update = change_sectors(rng, image, args.changed)
+
+    master, slave, path = spi_emulator.open_pty()
+    emulator = spi_emulator.FlashEmulator(spi_emulator.SerialLink(master, args.baud),
+                                          timings={'chip_erase': args.chip_erase_s, 'spi_clock_hz': args.spi_mhz * 1e6})
+    threading.Thread(target=emulator.run, daemon=True).start()
+
+    print(f"Emulator: {path}, {args.baud} baud, {args.spi_mhz:g} MHz SPI, {args.chip_erase_s:g} s chip erase")
+    print(f"Image: {size // 1024} KB, {image.count(0xFF) * 100 // size}% erased, update changes {args.changed} sectors")
+
+    workdir = tempfile.mkdtemp(prefix='bench_spi_')
+    results = []
+    try:
+        for protocol in args.protocols:
+            results += run_benchmark(emulator, path, workdir, image, update, protocol)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        os.close(master)
+        os.close(slave)
+
+    if len(args.protocols) > 1:
+        first, last = args.protocols[0], args.protocols[-1]
+        print(f"\nProtocol {last} vs {first}:")
+        baseline = {r['name'].split(' (')[0]: r for r in results if r['protocol'] == first}
+        for result in results:
+            base = baseline.get(result['name'].split(' (')[0])
+            if result['protocol'] == last and base and result['bytes'] and result['seconds']:
+                print(f"  {result['name']:20} {base['seconds'] / result['seconds']:6.1f}x faster, "
+                      f"{base['round_trips']} -> {result['round_trips']} commands")
+
+    output = {
+        'size': size,
+        'changed_sectors': args.changed,
+        'baud': args.baud,
+        'spi_clock_hz': args.spi_mhz * 1e6,
+        'chip_erase_seconds': args.chip_erase_s,
+        'results': results,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+    }
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"\nResults saved to: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Flash Audio Carver - find and extract MPEG audio embedded in NOR flash dumps
+Memory-maps a spi_tool.py dump and walks it once with MP3FrameWalker (plain and, optionally,
+XORed with discovered keys), so each run of chained frames becomes a segment with exact
+boundaries; segments are written out block by block straight from the map
+
+Usage: python carve_flash.py flash.bin [more dumps...] [-o carved] [--find-keys] [-j 4]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import decrypt_crafties
+
+CARVE_BLOCK_SIZE = 4096           # Walk granularity: one flash sector, so erased sectors are skipped whole
+CARVE_MIN_FRAMES = decrypt_crafties.FRAME_CHAIN_CONFIRM
+CARVE_MERGE_GAP = 2048            # Segments this close (a damaged frame or two) are one stream
+CARVE_KEY_WINDOW = 65536          # Window size for --find-keys
+ID3_LOOKBACK = 65536              # How far before a segment an ID3 tag may start
+
+class SegmentWalker(decrypt_crafties.MP3FrameWalker):
+    """MP3FrameWalker that records each unbroken run of chained frames as a segment"""
+
+    def __init__(self, xor_key=0, min_frames=CARVE_MIN_FRAMES):
+        super().__init__()
+        self.xor_key = xor_key
+        self.min_frames = min_frames
+        self.id3_checked = True   # A dump doesn't start with a tag, tags are looked for per segment
+        self.segment = None
+        self.segments = []
+
+    def commit(self, offset, header):
+        super().commit(offset, header)
+        if self.segment is None:
+            self.segment = {
+                'start': offset,
+                'key': self.xor_key,
+                'frames': 0,
+                'samples': 0,
+                'sample_rate': header['sample_rate'],
+                'version': header['version'],
+                'layer': header['layer'],
+            }
+        self.segment['frames'] += 1
+        self.segment['samples'] += header['samples']
+        self.segment['end'] = offset + header['frame_length']
+
+    def lose_sync(self):
+        self.close_segment()
+        super().lose_sync()
+
+    def drop_truncated_frame(self):
+        """Take the open segment's last frame back out if it runs past the bytes walked so far"""
+        if self.segment is not None and self.segment['end'] > self.size:
+            self.segment['frames'] -= 1
+            self.segment['end'] -= self.last_header['frame_length']
+            self.segment['samples'] -= self.last_header['samples']
+
+    def close_segment(self):
+        if self.segment is not None and self.segment['frames'] >= self.min_frames:
+            self.segments.append(self.segment)
+        self.segment = None
+
+    def skip(self, length):
+        """Pass over length bytes that can't hold audio (an erased sector), ending any segment"""
+        self.drop_truncated_frame()
+        self.close_segment()
+        self.pending = None
+        self.searching = True
+        self.chain = 0
+        self.size += length
+        self.buf.clear()
+        self.buf_start = self.pos = self.size
+
+    def finish(self):
+        """End of the dump: close the open segment, without a truncated last frame"""
+        self.drop_truncated_frame()
+        self.close_segment()
+
+def is_erased(block):
+    return block.count(0xFF) == len(block)
+
+def find_keys(data, window=CARVE_KEY_WINDOW):
+    """XOR keys (other than 0) of audio streams in the dump, by running discover_xor_key on each used window"""
+    keys = set()
+    for offset in range(0, len(data), window):
+        chunk = data[offset:offset + window]
+        if is_erased(chunk):
+            continue
+        candidates = decrypt_crafties.discover_xor_key_in_data(chunk)
+        if not candidates:
+            continue
+        xor_key, score, mp3_frames, size, analysis = candidates[0]
+        if xor_key and analysis.get('max_chain', 0) >= decrypt_crafties.FRAME_CHAIN_CONFIRM:
+            keys.add(xor_key)
+    return sorted(keys)
+
+def walk_segments(data, keys=(), min_frames=CARVE_MIN_FRAMES, block_size=CARVE_BLOCK_SIZE):
+    """Segments of chained frames in data, plain and XORed with each key, in one pass over data"""
+    walkers = [SegmentWalker(xor_key, min_frames) for xor_key in [0] + [k for k in keys if k]]
+
+    for offset in range(0, len(data), block_size):
+        block = data[offset:offset + block_size]
+        if is_erased(block):
+            for walker in walkers:
+                walker.skip(len(block))
+            continue
+        for walker in walkers:
+            walker.update(decrypt_crafties.apply_pure_xor(block, walker.xor_key) if walker.xor_key else block)
+
+    segments = []
+    for walker in walkers:
+        walker.finish()
+        segments += merge_segments(walker.segments)
+    segments.sort(key=lambda segment: segment['start'])
+
+    for segment in segments:
+        segment['id3_start'] = find_id3_start(data, segment['start'], segment['key'])
+        segment['duration'] = segment['samples'] / segment['sample_rate']
+        segment['bitrate_kbps'] = ((segment['end'] - segment['start']) * 8 / segment['duration'] / 1000
+                                   if segment['duration'] else 0.0)
+    return segments
+
+def merge_segments(segments, max_gap=CARVE_MERGE_GAP):
+    """Join segments of one stream that a damaged frame split apart"""
+    merged = []
+    for segment in segments:
+        previous = merged[-1] if merged else None
+        if (previous and segment['start'] - previous['end'] <= max_gap
+                and all(segment[field] == previous[field] for field in ('sample_rate', 'version', 'layer'))):
+            previous['end'] = segment['end']
+            previous['frames'] += segment['frames']
+            previous['samples'] += segment['samples']
+        else:
+            merged.append(segment)
+    return merged
+
+def find_id3_start(data, start, xor_key=0):
+    """Offset of an ID3v2 tag ending exactly at start (the stream's own tag), or None"""
+    lookback = max(start - ID3_LOOKBACK, 0)
+    region = data[lookback:start]
+    if xor_key:
+        region = decrypt_crafties.apply_pure_xor(region, xor_key)
+
+    i = region.rfind(b'ID3')
+    while i != -1:
+        head = region[i:i + 10]
+        if len(head) == 10 and head[3] in (2, 3, 4) and not any(b & 0x80 for b in head[6:10]):
+            tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+            if i + 10 + tag_size + (10 if head[5] & 0x10 else 0) == len(region):
+                return lookback + i
+        i = region.rfind(b'ID3', 0, i)
+    return None
+
+def segment_filename(dump_path, segment):
+    base = os.path.splitext(os.path.basename(dump_path))[0]
+    start = segment['id3_start'] if segment['id3_start'] is not None else segment['start']
+    suffix = f"_k{segment['key']:02X}" if segment['key'] else ''
+    return f"{base}_{start:06X}{suffix}.mp3"
+
+def write_segment(data, segment, output_path, block_size=decrypt_crafties.STREAM_BLOCK_SIZE):
+    """Write one segment (with its ID3 tag) block by block, decrypting if it was XORed"""
+    start = segment['id3_start'] if segment['id3_start'] is not None else segment['start']
+    with open(output_path, 'wb') as f:
+        for offset in range(start, segment['end'], block_size):
+            block = data[offset:min(offset + block_size, segment['end'])]
+            if segment['key']:
+                block = decrypt_crafties.apply_pure_xor(block, segment['key'])
+            f.write(block)
+
+def carve_dump(dump_path, output_dir=None, keys=(), discover_keys=False, min_frames=CARVE_MIN_FRAMES):
+    """Find (and with output_dir, extract) the audio segments of one dump, returns (segments, seconds)"""
+    start_time = time.time()
+
+    with decrypt_crafties.map_file(dump_path) as data:
+        keys = set(keys)
+        if discover_keys:
+            keys.update(find_keys(data))
+
+        segments = walk_segments(data, sorted(keys), min_frames)
+
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            for segment in segments:
+                segment['output'] = os.path.join(output_dir, segment_filename(dump_path, segment))
+                write_segment(data, segment, segment['output'])
+
+    return segments, time.time() - start_time
+
+def run_carve_worker(dump_path, output_dir, keys, discover_keys, min_frames):
+    """Process pool entry point - carve one dump, errors are returned instead of raised"""
+    try:
+        return carve_dump(dump_path, output_dir, keys, discover_keys, min_frames), None
+    except (OSError, ValueError) as e:
+        return None, str(e)
+
+def print_segments(dump_path, segments, elapsed):
+    print(f"\n{dump_path}: {len(segments)} audio segments ({elapsed:.1f}s)")
+    for segment in segments:
+        start = segment['id3_start'] if segment['id3_start'] is not None else segment['start']
+        key = f"key 0x{segment['key']:02X}" if segment['key'] else 'plain'
+        print(f"  0x{start:06X}-0x{segment['end']:06X} {segment['end'] - start:9} bytes  "
+              f"{segment['frames']:6} frames  {segment['duration']:7.1f}s  {segment['sample_rate']:5} Hz  "
+              f"{segment['bitrate_kbps']:5.0f} kbps  {key}{'  ID3' if segment['id3_start'] is not None else ''}"
+              f"{'  -> ' + segment['output'] if 'output' in segment else ''}")
+
+def main():
+    """Carve MPEG audio out of one or more flash dumps"""
+
+    parser = argparse.ArgumentParser(description='Find and extract MPEG audio in NOR flash dumps')
+    parser.add_argument('dumps', nargs='+', help='Flat flash dumps (spi_tool.py dump)')
+    parser.add_argument('-o', '--output-dir', help='Extract segments here (default: only list them)')
+    parser.add_argument('--key', type=lambda value: int(value, 0), action='append', default=[],
+                        help='Also look for audio XORed with this key (repeatable)')
+    parser.add_argument('--find-keys', action='store_true',
+                        help='Discover XOR keys of encrypted audio with discover_xor_key (slower)')
+    parser.add_argument('--min-frames', type=int, default=CARVE_MIN_FRAMES,
+                        help=f"Frames a segment needs to count as audio (default: {CARVE_MIN_FRAMES})")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Dumps to carve in parallel (default: 1)')
+    parser.add_argument('--json', help='Save the segment list to this JSON file')
+
+    args = parser.parse_args()
+
+    decrypt_crafties.set_output_mode('quiet')
+
+    print("="*80)
+    print("FLASH AUDIO CARVER")
+    print("="*80)
+
+    results = {}
+    work = (args.output_dir, args.key, args.find_keys, args.min_frames)
+
+    if args.jobs <= 1 or len(args.dumps) == 1:
+        for dump_path in args.dumps:
+            results[dump_path], error = run_carve_worker(dump_path, *work)
+            if error:
+                print(f"Error: {dump_path}: {error}", file=sys.stderr)
+                continue
+            print_segments(dump_path, *results[dump_path])
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=decrypt_crafties.init_batch_worker,
+                                 initargs=(decrypt_crafties.XOR_BACKEND, decrypt_crafties.SCORING_MODE,
+                                           'quiet')) as pool:
+            futures = {pool.submit(run_carve_worker, dump_path, *work): dump_path for dump_path in args.dumps}
+            for future in as_completed(futures):
+                dump_path = futures[future]
+                results[dump_path], error = future.result()
+                if error:
+                    print(f"Error: {dump_path}: {error}", file=sys.stderr)
+                    continue
+                print_segments(dump_path, *results[dump_path])
+
+    carved = {path: result[0] for path, result in results.items() if result}
+    total = sum(len(segments) for segments in carved.values())
+    print(f"\nFound {total} audio segments in {len(carved)} dumps")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(carved, f, indent=2)
+        print(f"Segment list saved to: {args.json}")
+
+if __name__ == "__main__":
+    main()
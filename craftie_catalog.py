@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Craftie Catalog - structured .form / record.txt parsing and an sqlite index of an SD card
+Indexes craftie UUID -> language -> ordered audio ids -> on-disk .abc path -> recovered XOR key,
+so "which crafties are missing audio" or "where is audio 26072" are index lookups, not directory walks
+
+Usage: python craftie_catalog.py build <sdcard_dir> [--db catalog.db] [--recover-keys]
+       python craftie_catalog.py missing | where <AUDIO_ID> | list [UUID]
+"""
+
+import os
+import re
+import json
+import sqlite3
+import argparse
+
+import decrypt_crafties
+
+CATALOG_FILENAME = 'catalog.db'
+
+# key=value / key: value fields of the text .form / record.txt layouts
+FIELD_ASSIGN = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)\s*[:=]\s*"?([^\s,;&"]*)')
+CRAFTIE_UUID_LENGTH = 12
+# Fallback for unnamed layouts: whole tokens between delimiters / control / high bytes,
+# so digits glued to letters (binary noise, hex, file names) are not taken as ids
+FALLBACK_TOKEN_SPLIT = re.compile(r'[^0-9A-Za-z_.\-]+')
+FALLBACK_ID_MIN_DIGITS = 3
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crafties (
+    uuid TEXT NOT NULL,
+    language TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    form_path TEXT,
+    record_path TEXT,
+    PRIMARY KEY (uuid, language)
+);
+CREATE TABLE IF NOT EXISTS audio (
+    uuid TEXT NOT NULL,
+    language TEXT NOT NULL,
+    position INTEGER,            -- order in the .form playlist, NULL for files the .form doesn't list
+    audio_id TEXT NOT NULL,
+    path TEXT,                   -- NULL when the .form lists the id but the .abc isn't on the card
+    size INTEGER,
+    fingerprint TEXT,
+    xor_key INTEGER
+);
+CREATE INDEX IF NOT EXISTS audio_by_id ON audio (audio_id);
+CREATE INDEX IF NOT EXISTS audio_by_craftie ON audio (uuid, language, position);
+CREATE INDEX IF NOT EXISTS audio_missing ON audio (path) WHERE path IS NULL;
+CREATE TABLE IF NOT EXISTS records (
+    uuid TEXT NOT NULL,
+    language TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT
+);
+"""
+
+def decode_text(data):
+    """Text of a .form / record.txt blob: UTF-8 if valid, else Latin-1, without NULs"""
+    if isinstance(data, str):
+        return data
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        text = data.decode('latin-1')
+    return text.replace('\x00', '\n')
+
+def json_audio_ids(obj, in_audio=False):
+    """Audio ids in a decoded JSON .form: values of *audio*id* keys, or ids inside *audio* lists"""
+    found = []
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            name = key.lower()
+            if 'audio' in name and 'id' in name and isinstance(value, (int, str)) and not isinstance(value, bool):
+                found.append(str(value))
+            elif in_audio and name == 'id' and isinstance(value, (int, str)) and not isinstance(value, bool):
+                found.append(str(value))
+            else:
+                found.extend(json_audio_ids(value, in_audio or 'audio' in name))
+    elif isinstance(obj, list):
+        for value in obj:
+            if in_audio and isinstance(value, (int, str)) and not isinstance(value, bool):
+                found.append(str(value))
+            else:
+                found.extend(json_audio_ids(value, in_audio))
+    return found
+
+def parse_form(data, craftie_uuid=None):
+    """Ordered, de-duplicated audio ids of a .form blob (bytes or str)
+
+    JSON forms are read by key name, text forms by their audio id fields (audio_id=2375).
+    Anything else (CSV, one id per line, binary) falls back to tokens that are entirely digits,
+    split on delimiters, control and high bytes; runs under 3 digits or glued to letters are
+    noise. The craftie's own UUID and 12+ digit runs (UUIDs, timestamps) are not audio ids.
+    """
+    text = decode_text(data).strip()
+    ids = []
+
+    if text[:1] in ('{', '['):
+        try:
+            ids = json_audio_ids(json.loads(text))
+        except ValueError:
+            ids = []
+
+    if not ids:
+        # Named fields first (audio_id=2375), else whole numeric tokens
+        named = [value for key, value in FIELD_ASSIGN.findall(text)
+                 if 'audio' in key.lower() and 'id' in key.lower() and value.isdigit()]
+        ids = named or [token for token in FALLBACK_TOKEN_SPLIT.split(text)
+                        if token.isdigit() and len(token) >= FALLBACK_ID_MIN_DIGITS]
+
+    audio_ids = []
+    for audio_id in ids:
+        audio_id = audio_id.strip()
+        if not audio_id.isdigit() or int(audio_id) == 0:
+            continue
+        if audio_id == craftie_uuid or len(audio_id) >= CRAFTIE_UUID_LENGTH:
+            continue
+        audio_id = str(int(audio_id))  # Same normalization as the .abc file names
+        if audio_id not in audio_ids:
+            audio_ids.append(audio_id)
+
+    return audio_ids
+
+def parse_record(data):
+    """Fields of a record.txt blob as an ordered list of (field, value)
+
+    JSON objects are flattened to dotted field names; text records are read as key=value /
+    key: value pairs, and a record without any is kept as numbered lines.
+    """
+    text = decode_text(data).strip()
+
+    if text[:1] == '{':
+        try:
+            fields = []
+
+            def flatten(obj, prefix):
+                if isinstance(obj, dict):
+                    for key, value in obj.items():
+                        flatten(value, f"{prefix}{key}.")
+                elif isinstance(obj, list):
+                    for i, value in enumerate(obj):
+                        flatten(value, f"{prefix}{i}.")
+                else:
+                    fields.append((prefix[:-1], str(obj)))
+
+            flatten(json.loads(text), '')
+            return fields
+        except ValueError:
+            pass
+
+    fields = FIELD_ASSIGN.findall(text)
+    if fields:
+        return fields
+    return [(f"line{i}", line.strip()) for i, line in enumerate(text.splitlines()) if line.strip()]
+
+def iter_craftie_folders(root):
+    """Yield (language, uuid, folder) for craftie/<LANG>/<UUID>/ and older craftie/<UUID>/ folders"""
+    craftie_root = os.path.join(root, 'craftie')
+    if not os.path.isdir(craftie_root):
+        craftie_root = root
+
+    with os.scandir(craftie_root) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if not entry.is_dir() or entry.name in decrypt_crafties.CARD_SKIP_DIRS:
+                continue
+            if entry.name.isdigit():
+                yield '', entry.name, entry.path
+                continue
+            with os.scandir(entry.path) as uuid_entries:
+                for uuid_entry in sorted(uuid_entries, key=lambda e: e.name):
+                    if uuid_entry.is_dir():
+                        yield entry.name, uuid_entry.name, uuid_entry.path
+
+def open_catalog(db_path):
+    """Open (creating if needed) a catalog database"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(CATALOG_SCHEMA)
+    return conn
+
+def build_catalog(conn, root, key_cache=None, recover_keys=False):
+    """(Re)index the card at root, returns (crafties, audio files, missing audio files)
+
+    Keys come from the key cache by file fingerprint; with recover_keys, files the cache
+    doesn't know are run through discover_xor_key (and the cache is updated).
+    """
+    crafties = files = missing = 0
+
+    with conn:
+        conn.execute("DELETE FROM crafties")
+        conn.execute("DELETE FROM audio")
+        conn.execute("DELETE FROM records")
+
+        for language, uuid, folder in iter_craftie_folders(root):
+            form_path = os.path.join(folder, f"{uuid}.form")
+            record_path = os.path.join(folder, 'record.txt')
+            form_path = form_path if os.path.exists(form_path) else None
+            record_path = record_path if os.path.exists(record_path) else None
+            conn.execute("INSERT OR REPLACE INTO crafties VALUES (?, ?, ?, ?, ?)",
+                         (uuid, language, folder, form_path, record_path))
+            crafties += 1
+
+            on_disk = {}
+            for name in os.listdir(folder):
+                audio_id, ext = os.path.splitext(name)
+                if ext.lower() == '.abc' and audio_id.isdigit():
+                    on_disk[str(int(audio_id))] = os.path.join(folder, name)
+
+            playlist = []
+            if form_path:
+                with open(form_path, 'rb') as f:
+                    playlist = parse_form(f.read(), uuid)
+
+            if record_path:
+                with open(record_path, 'rb') as f:
+                    conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?)",
+                                     [(uuid, language, field, value) for field, value in parse_record(f.read())])
+
+            # Files in playlist order, then any the .form doesn't mention
+            rows = [(position, audio_id) for position, audio_id in enumerate(playlist)]
+            rows += [(None, audio_id) for audio_id in sorted(on_disk, key=int) if audio_id not in playlist]
+
+            for position, audio_id in rows:
+                path = on_disk.get(audio_id)
+                size = fingerprint = xor_key = None
+                if path:
+                    size = os.path.getsize(path)
+                    fingerprint = decrypt_crafties.file_fingerprint(path)
+                    xor_key = lookup_key(path, fingerprint, key_cache, recover_keys)
+                    files += 1
+                else:
+                    missing += 1
+                conn.execute("INSERT INTO audio VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (uuid, language, position, audio_id, path, size, fingerprint, xor_key))
+
+    if key_cache is not None and recover_keys:
+        key_cache.save()
+
+    return crafties, files, missing
+
+def lookup_key(path, fingerprint, key_cache, recover_keys):
+    """Key of one .abc from the key cache, or recovered with discover_xor_key if allowed"""
+    folder = decrypt_crafties.craftie_folder(path)
+    if key_cache is not None and fingerprint in key_cache.files:
+        return key_cache.files[fingerprint]
+    if not recover_keys:
+        return None
+
+    hint_keys = key_cache.hint_keys(fingerprint, folder) if key_cache is not None else None
+    candidates = decrypt_crafties.discover_xor_key(path, hint_keys=hint_keys)
+    if not candidates:
+        return None
+    if key_cache is not None:
+        key_cache.store(fingerprint, folder, candidates[0][0])
+    return candidates[0][0]
+
+def find_audio(conn, audio_id):
+    """Rows (uuid, language, position, path, xor_key) for an audio id"""
+    return conn.execute("SELECT uuid, language, position, path, xor_key FROM audio WHERE audio_id = ? "
+                        "ORDER BY uuid, language", (str(int(audio_id)),)).fetchall()
+
+def missing_audio(conn):
+    """(uuid, language, [audio ids]) for every craftie whose .form lists audio that isn't on the card"""
+    result = {}
+    for uuid, language, audio_id in conn.execute(
+            "SELECT uuid, language, audio_id FROM audio WHERE path IS NULL ORDER BY uuid, language, position"):
+        result.setdefault((uuid, language), []).append(audio_id)
+    return [(uuid, language, ids) for (uuid, language), ids in result.items()]
+
+def craftie_playlist(conn, uuid, language=None):
+    """Rows (language, position, audio_id, path, xor_key) of one craftie in playlist order"""
+    query = "SELECT language, position, audio_id, path, xor_key FROM audio WHERE uuid = ?"
+    params = [uuid]
+    if language is not None:
+        query += " AND language = ?"
+        params.append(language)
+    query += " ORDER BY language, position IS NULL, position, CAST(audio_id AS INTEGER)"
+    return conn.execute(query, params).fetchall()
+
+def format_key(xor_key):
+    return f"0x{xor_key:02X}" if xor_key is not None else "?"
+
+def main():
+    """Build or query a card catalog"""
+
+    parser = argparse.ArgumentParser(description='Indexed catalog of crafties, audio ids, files and keys')
+    parser.add_argument('--db', default=CATALOG_FILENAME, help=f"Catalog database (default: {CATALOG_FILENAME})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Index an SD card (or mirror) tree')
+    build.add_argument('root', help='Card root (containing craftie/) or the craftie folder itself')
+    build.add_argument('--key-cache', help='Key cache to take keys from (default: key_cache.json in root, "" to disable)')
+    build.add_argument('--recover-keys', action='store_true', help='Recover keys the cache does not know (slower)')
+
+    commands.add_parser('missing', help='Crafties whose .form lists audio missing from the card')
+    where = commands.add_parser('where', help='Where an audio id is on the card')
+    where.add_argument('audio_id')
+    listing = commands.add_parser('list', help='List crafties, or the playlist of one')
+    listing.add_argument('uuid', nargs='?')
+
+    args = parser.parse_args()
+    conn = open_catalog(args.db)
+
+    if args.command == 'build':
+        if not os.path.isdir(args.root):
+            print(f"Error: '{args.root}' is not a directory!")
+            return
+        decrypt_crafties.set_output_mode('quiet')
+        key_cache = decrypt_crafties.open_key_cache(args.key_cache, args.root)
+        crafties, files, missing = build_catalog(conn, args.root, key_cache, args.recover_keys)
+        print(f"Catalog {args.db}: {crafties} crafties, {files} audio files, {missing} listed but missing")
+
+    elif args.command == 'missing':
+        rows = missing_audio(conn)
+        for uuid, language, audio_ids in rows:
+            print(f"  {language or '-':3} {uuid}: missing {len(audio_ids)} ({', '.join(audio_ids)})")
+        print(f"{len(rows)} crafties with missing audio")
+
+    elif args.command == 'where':
+        rows = find_audio(conn, args.audio_id)
+        if not rows:
+            print(f"Audio {args.audio_id} is not in the catalog")
+        for uuid, language, position, path, xor_key in rows:
+            where_text = path or 'NOT ON CARD'
+            print(f"  {language or '-':3} {uuid} #{position if position is not None else '-'}: "
+                  f"{where_text} (key {format_key(xor_key)})")
+
+    elif args.command == 'list':
+        if args.uuid:
+            for language, position, audio_id, path, xor_key in craftie_playlist(conn, args.uuid):
+                print(f"  {language or '-':3} #{position if position is not None else '-':>3} {audio_id:>8} "
+                      f"{'on card' if path else 'MISSING':8} key {format_key(xor_key)}")
+        else:
+            for uuid, language, count, present in conn.execute(
+                    "SELECT c.uuid, c.language, COUNT(a.audio_id), COUNT(a.path) FROM crafties c "
+                    "LEFT JOIN audio a ON a.uuid = c.uuid AND a.language = c.language "
+                    "GROUP BY c.uuid, c.language ORDER BY c.uuid, c.language"):
+                print(f"  {language or '-':3} {uuid}: {present}/{count} audio files on card")
+
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -11,52 +11,496 @@ import os
 import sys
 import argparse
 import time
-from collections import Counter
+import io
+import mmap
+import json
+import hashlib
+import contextlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-def apply_pure_xor(data, xor_key):
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# XOR backends: 'translate' uses bytes.translate with a precomputed table per key,
+# 'numpy' uses a vectorized uint8 XOR (only if numpy is installed)
+XOR_BACKENDS = ['translate', 'numpy']
+XOR_BACKEND = 'translate'
+
+# One 256-byte translate table per key, built once at import time
+XOR_TABLES = [bytes(b ^ key for b in range(256)) for key in range(256)]
+
+# Output: 'text' prints progress, 'quiet' only the final summary,
+# 'json' one NDJSON record per file plus a summary record
+OUTPUT_MODES = ['text', 'quiet', 'json']
+OUTPUT_MODE = 'text'
+
+# Phase 1 scoring: 'histogram' ranks all keys from one pass over the chunk,
+# 'brute' XORs the chunk with every key and runs analyze_chunk_quality on each
+SCORING_MODES = ['histogram', 'brute']
+SCORING_MODE = 'histogram'
+
+# Maps a byte to its top 3 bits (the part checked by the 0xE0 sync mask)
+HIGH_BITS_TABLE = bytes(b >> 5 for b in range(256))
+
+def set_xor_backend(name):
+    """Select the XOR backend ('auto', 'translate' or 'numpy')"""
+    global XOR_BACKEND
+    
+    if name == 'auto':
+        name = 'numpy' if np is not None else 'translate'
+    if name not in XOR_BACKENDS:
+        raise ValueError(f"Unknown XOR backend: {name}")
+    if name == 'numpy' and np is None:
+        raise ValueError("XOR backend 'numpy' requested but numpy is not installed")
+    
+    XOR_BACKEND = name
+    return name
+
+# MPEG audio frame header tables, indexed by the raw header bit fields
+# version bits: 0 = MPEG 2.5, 1 = reserved, 2 = MPEG 2, 3 = MPEG 1
+# layer bits: 1 = Layer III, 2 = Layer II, 3 = Layer I, 0 = reserved
+MPEG_BITRATES = {
+    (3, 3): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (3, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (3, 1): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 3): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 1): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MPEG_BITRATES[(0, 3)] = MPEG_BITRATES[(2, 3)]
+MPEG_BITRATES[(0, 2)] = MPEG_BITRATES[(2, 2)]
+MPEG_BITRATES[(0, 1)] = MPEG_BITRATES[(2, 1)]
+
+MPEG_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+# Extensions of encrypted files picked up by batch modes
+BATCH_EXTENSIONS = ['.abc', '.dat', '.bin', '.enc']
+
+# Key cache defaults: file name next to the output, max fingerprints kept, bytes hashed per file
+KEY_CACHE_FILENAME = 'key_cache.json'
+KEY_CACHE_MAX_ENTRIES = 10000
+FINGERPRINT_HEAD_SIZE = 65536
+
+# Block size for streaming decrypt and full-file analysis (bounds peak memory)
+STREAM_BLOCK_SIZE = 1 << 20
+
+# Phase 2 confirms a key once this many MPEG frames chain, decrypting this much at a time
+FRAME_CHAIN_CONFIRM = 32
+CONFIRM_BLOCK_SIZE = 65536
+CONFIRM_MAX_BYTES = 1 << 20
+
+# Sampled phase 2 (--show-alts): window size at start/middle/end, and the lead in
+# chained frames a key needs over the runner-up to win without sampling further
+SAMPLE_WINDOW_SIZE = 65536
+SAMPLE_WIN_MARGIN = 16
+
+# Batch manifest (one JSON line per processed file), kept next to the key cache
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+# SD card folders that never hold encrypted audio
+CARD_SKIP_DIRS = ['System Volume Information', 'logcat', 'delete', 'persistence_data']
+
+# Plaintexts that decrypted crafties (or other audio) start with; the one-byte MPEG
+# sync only derives a candidate key, check_known_plaintext then needs a chained frame
+KNOWN_HEADERS = [
+    ('ID3', b'ID3'),
+    ('MPEG', b'\xFF'),
+    ('RIFF', b'RIFF'),
+    ('OggS', b'OggS'),
+    ('fLaC', b'fLaC'),
+]
+
+def set_output_mode(name):
+    """Select the output mode ('text', 'quiet' or 'json')"""
+    global OUTPUT_MODE
+    
+    if name not in OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode: {name}")
+    
+    OUTPUT_MODE = name
+    return name
+
+def log(*args, **kwargs):
+    """Progress output, only printed in text mode"""
+    if OUTPUT_MODE == 'text':
+        print(*args, **kwargs)
+
+def log_error(*args, **kwargs):
+    """Errors and warnings: stdout in text mode, stderr otherwise so NDJSON stays clean"""
+    if OUTPUT_MODE == 'text':
+        print(*args, **kwargs)
+    else:
+        print(*args, file=sys.stderr, **kwargs)
+
+def emit_record(record):
+    """Write one NDJSON record in json mode"""
+    if OUTPUT_MODE == 'json':
+        print(json.dumps(record), flush=True)
+
+class PhaseTimer:
+    """Accumulates wall time per phase: lap(name) charges the time since the previous lap to name"""
+    
+    def __init__(self):
+        self.times = {}
+        self.last = time.perf_counter()
+    
+    def lap(self, name):
+        now = time.perf_counter()
+        self.times[name] = self.times.get(name, 0.0) + now - self.last
+        self.last = now
+
+def set_scoring_mode(name):
+    """Select the phase 1 scoring mode ('histogram' or 'brute')"""
+    global SCORING_MODE
+    
+    if name not in SCORING_MODES:
+        raise ValueError(f"Unknown scoring mode: {name}")
+    
+    SCORING_MODE = name
+    return name
+
+def apply_pure_xor(data, xor_key, backend=None):
     """Apply pure XOR - every single byte gets XORed"""
-    return bytes(b ^ xor_key for b in data)
+    backend = backend or XOR_BACKEND
+    
+    if backend == 'numpy':
+        arr = np.frombuffer(data, dtype=np.uint8) ^ np.uint8(xor_key)
+        return arr.tobytes()
+    
+    return bytes(data).translate(XOR_TABLES[xor_key])
 
-def analyze_audio_quality(data):
-    """Comprehensive audio quality analysis"""
-    if not data or len(data) < 10:
-        return 0, 0, {}
+def apply_pure_xor_inplace(buf, xor_key, backend=None):
+    """Apply pure XOR in place on a writable buffer (bytearray or memoryview)"""
+    backend = backend or XOR_BACKEND
     
-    analysis = {}
-    score = 0
+    if backend == 'numpy':
+        arr = np.frombuffer(buf, dtype=np.uint8)
+        arr ^= np.uint8(xor_key)
+        return buf
     
-    # 1. MP3 Sync Pattern Detection
-    mp3_syncs = 0
-    sync_positions = []
+    if isinstance(buf, bytearray):
+        buf[:] = buf.translate(XOR_TABLES[xor_key])
+    else:
+        buf[:] = bytes(buf).translate(XOR_TABLES[xor_key])
+    return buf
+
+def parse_mpeg_header(data, offset=0):
+    """Parse the MPEG audio frame header at offset, returns a dict or None if invalid"""
+    if offset + 4 > len(data):
+        return None
     
-    for i in range(len(data) - 1):
-        if data[i] == 0xFF and (data[i + 1] & 0xE0) == 0xE0:
-            mp3_syncs += 1
-            sync_positions.append(i)
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
     
-    analysis['mp3_syncs'] = mp3_syncs
-    analysis['sync_positions'] = sync_positions[:10]  # Store first 10 positions
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0x03
+    padding = (b2 >> 1) & 0x01
     
-    # Score based on MP3 syncs
-    if mp3_syncs > 0:
-        score += mp3_syncs * 20  # 20 points per sync
-        
-    # Bonus for syncs distributed throughout file (not clustered)
-    if mp3_syncs > 1 and len(sync_positions) > 1:
-        avg_distance = (sync_positions[-1] - sync_positions[0]) / (len(sync_positions) - 1)
-        if 100 < avg_distance < 5000:  # Reasonable frame spacing
-            score += 50
+    # Reserved values and free-format bitrate can't be chained
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
     
-    # 2. Valid MP3 Header at Start
-    if (len(data) >= 4 and 
-        data[0] == 0xFF and 
-        (data[1] & 0xE0) == 0xE0):
+    bitrate = MPEG_BITRATES[(version, layer)][bitrate_index]
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    
+    if layer == 3:  # Layer I
+        samples = 384
+        frame_length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    elif layer == 2 or version == 3:  # Layer II, or Layer III in MPEG 1
+        samples = 1152
+        frame_length = 144 * bitrate * 1000 // sample_rate + padding
+    else:  # Layer III in MPEG 2/2.5
+        samples = 576
+        frame_length = 72 * bitrate * 1000 // sample_rate + padding
+    
+    return {
+        'version': version,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'padding': padding,
+        'channel_mode': (b3 >> 6) & 0x03,
+        'frame_length': frame_length,
+        'samples': samples,
+    }
+
+def chained_frames_at(data, offset, xor_key):
+    """True if data decrypted with xor_key holds an MPEG frame at offset whose successor chains to it"""
+    header = parse_mpeg_header(apply_pure_xor(data[offset:offset + 4], xor_key))
+    if header is None:
+        return False
+    
+    next_offset = offset + header['frame_length']
+    next_header = parse_mpeg_header(apply_pure_xor(data[next_offset:next_offset + 4], xor_key))
+    if next_header is None:
+        return False
+    
+    return all(header[k] == next_header[k] for k in ('version', 'layer', 'sample_rate'))
+
+def check_known_plaintext(data, name, xor_key):
+    """Cheap structural check that data decrypted with xor_key really starts with the named format
+    
+    The ID3 and MPEG checks need two chained frames inside data; a header that
+    would fall past the end is a failure, not a pass.
+    """
+    head = apply_pure_xor(data[:64], xor_key)
+    
+    if name == 'ID3':
+        # Version 2-4, synchsafe size bytes, then chained MPEG audio right after the tag
+        if len(head) < 10 or head[3] not in (2, 3, 4) or head[4] == 0xFF or any(b & 0x80 for b in head[6:10]):
+            return False
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        audio_start = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+        return chained_frames_at(data, audio_start, xor_key)
+    
+    if name == 'MPEG':
+        # Two frames that chain: the second header sits exactly one frame length later
+        return chained_frames_at(data, 0, xor_key)
+    
+    if name == 'RIFF':
+        return head[8:12] == b'WAVE'
+    if name == 'OggS':
+        return len(head) > 5 and head[4] == 0
+    if name == 'fLaC':
+        return len(head) > 4 and (head[4] & 0x7F) == 0  # STREAMINFO comes first
+    
+    return False
+
+def known_plaintext_keys(data):
+    """Derive candidate keys from known header plaintexts, returns [(key, format)] that pass the check"""
+    if len(data) < 4:
+        return []
+    
+    confirmed = []
+    for name, plaintext in KNOWN_HEADERS:
+        xor_key = data[0] ^ plaintext[0]
+        if apply_pure_xor(data[:len(plaintext)], xor_key) != plaintext:
+            continue
+        if check_known_plaintext(data, name, xor_key):
+            confirmed.append((xor_key, name))
+    
+    return confirmed
+
+class MP3FrameWalker:
+    """Walks MPEG audio frames in a stream by jumping from header to header
+    
+    Feed data in order with update(). A frame only counts once the next header
+    follows exactly one frame length later with the same version, layer and
+    sample rate; on a broken chain the walker resyncs on the next 0xFF. With
+    stop_after set, the walk ends (done = True) once that many frames chain.
+    """
+    
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+        self.buf = bytearray()
+        self.buf_start = 0          # Stream offset of buf[0]
+        self.size = 0
+        self.pos = 0                # Next expected header, or where the sync search resumes
+        self.searching = True
+        self.id3_checked = False
+        self.pending = None         # (offset, header) of a first frame not confirmed yet
+        self.last_header = None
+        self.chain = 0
+        self.max_chain = 0
+        self.resyncs = 0
+        self.frames = 0
+        self.samples = 0
+        self.duration = 0.0
+        self.audio_bytes = 0
+        self.frame_offsets = []     # First 10 frame offsets
+        self.first_header = None
+        self.done = False
+    
+    def update(self, block):
+        """Feed the next block of (decrypted) data"""
+        self.size += len(block)
+        if self.done or not block:
+            return
+        self.buf += block
         
-        score += 200  # Big bonus for valid start
-        analysis['valid_header'] = True
+        # Audio starts after an ID3v2 tag
+        if not self.id3_checked:
+            if len(self.buf) < 10:
+                return
+            self.id3_checked = True
+            head = self.buf[:10]
+            if head[:3] == b'ID3' and head[3] in (2, 3, 4) and not any(b & 0x80 for b in head[6:10]):
+                tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+                self.pos = 10 + tag_size + (10 if head[5] & 0x10 else 0)
         
-        # Extract MP3 frame info
-        try:
+        self.walk()
+        
+        # Keep only what a resync could still need
+        keep_from = self.pending[0] + 1 if self.pending else self.pos
+        drop = min(keep_from - self.buf_start, len(self.buf))
+        if drop > 0:
+            del self.buf[:drop]
+            self.buf_start += drop
+    
+    def walk(self):
+        buf = self.buf
+        base = self.buf_start
+        
+        while not self.done:
+            rel = self.pos - base
+            if rel + 4 > len(buf):
+                return
+            
+            if self.searching:
+                i = buf.find(b'\xFF', rel)
+                if i == -1:
+                    self.pos = base + len(buf)
+                    return
+                self.pos = base + i
+                if i + 4 > len(buf):
+                    return
+                header = parse_mpeg_header(buf, i)
+                if header is None:
+                    self.pos += 1
+                    continue
+                
+                # Candidate first frame, confirmed only if the next one chains
+                self.pending = (self.pos, header)
+                self.last_header = header
+                self.chain = 1
+                self.searching = False
+                self.pos += header['frame_length']
+                continue
+            
+            header = parse_mpeg_header(buf, rel)
+            if header is None or any(header[field] != self.last_header[field]
+                                     for field in ('version', 'layer', 'sample_rate')):
+                self.lose_sync()
+                continue
+            
+            if self.pending:
+                self.commit(*self.pending)
+                self.pending = None
+            self.commit(self.pos, header)
+            self.last_header = header
+            self.chain += 1
+            self.max_chain = max(self.max_chain, self.chain)
+            self.pos += header['frame_length']
+            
+            if self.stop_after and self.chain >= self.stop_after:
+                self.done = True
+    
+    def lose_sync(self):
+        if self.pending:
+            # The candidate was a false sync, search again right after it
+            self.pos = self.pending[0] + 1
+            self.pending = None
+        else:
+            self.resyncs += 1
+        self.chain = 0
+        self.searching = True
+    
+    def commit(self, offset, header):
+        self.frames += 1
+        self.samples += header['samples']
+        self.duration += header['samples'] / header['sample_rate']
+        self.audio_bytes += header['frame_length']
+        if len(self.frame_offsets) < 10:
+            self.frame_offsets.append(offset)
+        if self.first_header is None:
+            self.first_header = header
+    
+    def result(self):
+        """Return frame statistics as a dict"""
+        info = {
+            'frames': self.frames,
+            'duration': self.duration,
+            'bitrate_kbps': self.audio_bytes * 8 / self.duration / 1000 if self.duration else 0,
+            'avg_frame_length': self.audio_bytes / self.frames if self.frames else 0,
+            'max_chain': self.max_chain,
+            'resyncs': self.resyncs,
+            'frame_offsets': self.frame_offsets,
+        }
+        if self.first_header:
+            info['sample_rate'] = self.first_header['sample_rate']
+        return info
+
+def validate_mp3_frames(data, stop_after=None):
+    """Walk the MPEG frames of decrypted data, returns frame count, duration, bitrate etc."""
+    walker = MP3FrameWalker(stop_after)
+    walker.update(data)
+    return walker.result()
+
+class AudioStreamAnalyzer:
+    """Incremental audio quality analysis: feed decrypted blocks in order, then call result()
+    
+    Frames are found with MP3FrameWalker; besides that only the first bytes are
+    kept, so memory does not grow with the file size.
+    """
+    
+    def __init__(self, stop_after=None):
+        self.size = 0
+        self.head = bytearray()
+        self.walker = MP3FrameWalker(stop_after)
+    
+    @property
+    def done(self):
+        return self.walker.done
+    
+    def update(self, block):
+        """Feed the next block of decrypted data"""
+        if not block:
+            return
+        block = bytes(block)
+        
+        if len(self.head) < 1000:
+            self.head += block[:1000 - len(self.head)]
+        
+        self.walker.update(block)
+        self.size += len(block)
+    
+    def result(self, file_size=None):
+        """Return (score, mp3_frames, analysis); file_size overrides the fed size after an early stop"""
+        data = self.head
+        if self.size < 10:
+            return 0, 0, {}
+        
+        analysis = {}
+        score = 0
+        
+        # 1. Chained MP3 frames
+        frame_info = self.walker.result()
+        mp3_frames = frame_info['frames']
+        analysis['mp3_frames'] = mp3_frames
+        analysis['frame_positions'] = frame_info['frame_offsets']  # First 10 positions
+        analysis['duration'] = frame_info['duration']
+        analysis['bitrate_kbps'] = frame_info['bitrate_kbps']
+        analysis['max_chain'] = frame_info['max_chain']
+        analysis['resyncs'] = frame_info['resyncs']
+        
+        # Score based on MP3 frames
+        if mp3_frames > 0:
+            score += mp3_frames * 20  # 20 points per frame
+        
+        # Bonus for a sensible frame size
+        avg_distance = frame_info['avg_frame_length'] if mp3_frames > 1 else None
+        if avg_distance is not None and 100 < avg_distance < 5000:
+            score += 50
+        
+        # 2. Valid MP3 Header at Start
+        if (len(data) >= 4 and 
+            data[0] == 0xFF and 
+            (data[1] & 0xE0) == 0xE0):
+            
+            score += 200  # Big bonus for valid start
+            analysis['valid_header'] = True
+            
+            # Extract MP3 frame info
             mpeg_version = (data[1] >> 3) & 0x03
             layer = (data[1] >> 1) & 0x03
             bitrate_index = (data[2] >> 4) & 0x0F
@@ -72,70 +516,141 @@ def analyze_audio_quality(data):
                 score += 30
             if sample_rate_index <= 2:  # Valid sample rate
                 score += 30
-                
-        except:
-            pass
-    else:
-        analysis['valid_header'] = False
-    
-    # 3. File Size Analysis
-    file_size = len(data)
-    analysis['file_size'] = file_size
-    
-    if 10000 < file_size < 50000000:  # Reasonable audio file size
-        score += 20
-    if 50000 < file_size < 10000000:  # Even better size range
-        score += 50
-    
-    # 4. Entropy Analysis (avoid too uniform or too random)
-    sample_size = min(1000, len(data))
-    byte_counts = Counter(data[:sample_size])
-    
-    max_count = max(byte_counts.values()) if byte_counts else 0
-    unique_bytes = len(byte_counts)
-    
-    analysis['unique_bytes_in_sample'] = unique_bytes
-    analysis['max_byte_frequency'] = max_count
-    
-    # Penalty for too uniform (wrong key) or too random (not audio)
-    uniformity = max_count / float(sample_size)
-    if uniformity > 0.4:  # More than 40% same byte = probably wrong
-        score -= 100
-    elif uniformity < 0.02:  # Less than 2% max frequency = too random
-        score -= 50
-    else:
-        score += 20  # Good entropy
-    
-    # Bonus for reasonable byte distribution
-    if 50 < unique_bytes < 200:  # Good variety
-        score += 30
-    
-    # 5. Look for Other Audio Format Headers
-    # ID3 tags
-    if len(data) >= 3 and data[:3] == b'ID3':
-        score += 100
-        analysis['has_id3'] = True
-    
-    # RIFF/WAV
-    if len(data) >= 4 and data[:4] == b'RIFF':
-        score += 100
-        analysis['has_riff'] = True
-    
-    # 6. Frame consistency analysis
-    if mp3_syncs >= 2:
-        distances = []
-        for i in range(len(sync_positions) - 1):
-            distances.append(sync_positions[i + 1] - sync_positions[i])
-        
-        if distances:
-            avg_distance = sum(distances) / len(distances)
+        else:
+            analysis['valid_header'] = False
+        
+        # 3. File Size Analysis
+        file_size = file_size or self.size
+        analysis['file_size'] = file_size
+        
+        if 10000 < file_size < 50000000:  # Reasonable audio file size
+            score += 20
+        if 50000 < file_size < 10000000:  # Even better size range
+            score += 50
+        
+        # 4. Entropy Analysis (avoid too uniform or too random)
+        sample_size = min(1000, len(data))
+        byte_counts = Counter(data[:sample_size])
+        
+        max_count = max(byte_counts.values()) if byte_counts else 0
+        unique_bytes = len(byte_counts)
+        
+        analysis['unique_bytes_in_sample'] = unique_bytes
+        analysis['max_byte_frequency'] = max_count
+        
+        # Penalty for too uniform (wrong key) or too random (not audio)
+        uniformity = max_count / float(sample_size)
+        if uniformity > 0.4:  # More than 40% same byte = probably wrong
+            score -= 100
+        elif uniformity < 0.02:  # Less than 2% max frequency = too random
+            score -= 50
+        else:
+            score += 20  # Good entropy
+        
+        # Bonus for reasonable byte distribution
+        if 50 < unique_bytes < 200:  # Good variety
+            score += 30
+        
+        # 5. Look for Other Audio Format Headers
+        # ID3 tags
+        if data[:3] == b'ID3':
+            score += 100
+            analysis['has_id3'] = True
+        
+        # RIFF/WAV
+        if data[:4] == b'RIFF':
+            score += 100
+            analysis['has_riff'] = True
+        
+        # 6. Frame consistency analysis
+        if avg_distance is not None:
             analysis['avg_frame_distance'] = avg_distance
             
             # Audio frames should be relatively consistent in size
             if 100 < avg_distance < 2000:  # Typical MP3 frame sizes
                 score += 40
-    
-    return max(0, score), mp3_syncs, analysis
+        
+        return max(0, score), mp3_frames, analysis
+
+def analyze_audio_quality(data):
+    """Comprehensive audio quality analysis"""
+    analyzer = AudioStreamAnalyzer()
+    analyzer.update(data)
+    return analyzer.result()
+
+def analyze_decrypted_stream(data, xor_key, block_size=STREAM_BLOCK_SIZE, stop_after=None, max_bytes=None):
+    """analyze_audio_quality of data XORed with xor_key, decrypting one block at a time
+    
+    With stop_after, decryption stops as soon as that many frames chain; with
+    max_bytes, after that many bytes. analysis['bytes_examined'] says how far it got.
+    """
+    analyzer = AudioStreamAnalyzer(stop_after)
+    end = len(data) if max_bytes is None else min(len(data), max_bytes)
+    
+    for offset in range(0, end, block_size):
+        analyzer.update(apply_pure_xor(data[offset:min(offset + block_size, end)], xor_key))
+        if analyzer.done:
+            break
+    
+    score, mp3_frames, analysis = analyzer.result(file_size=len(data))
+    analysis['bytes_examined'] = analyzer.size
+    return score, mp3_frames, analysis
+
+def confirm_decrypted_stream(data, xor_key):
+    """Phase 2 check of one key: analyze only until FRAME_CHAIN_CONFIRM frames chain (or 1 MB)"""
+    return analyze_decrypted_stream(data, xor_key, CONFIRM_BLOCK_SIZE, FRAME_CHAIN_CONFIRM, CONFIRM_MAX_BYTES)
+
+def sample_windows(size, window_size=SAMPLE_WINDOW_SIZE):
+    """(offset, length) of the start, middle and end windows of a file, without overlap"""
+    if size <= window_size * 3:
+        return [(0, size)]
+    return [(0, window_size), ((size - window_size) // 2, window_size), (size - window_size, window_size)]
+
+def rank_keys_sampled(data, key_scores, verbose=False):
+    """Sampled phase 2: score candidate keys on a few windows, stopping once one leads by SAMPLE_WIN_MARGIN
+    
+    Returns ([(key, score, mp3_frames, analysis)] best first, file bytes examined). Scores
+    come from the start window analysis plus 20 points per frame chained in the
+    other windows examined.
+    """
+    results = {}
+    bytes_examined = 0
+    
+    for index, (offset, length) in enumerate(sample_windows(len(data))):
+        bytes_examined += length
+        for xor_key, chunk_score in key_scores:
+            window = apply_pure_xor(data[offset:offset + length], xor_key)
+            
+            if index == 0:
+                analyzer = AudioStreamAnalyzer()
+                analyzer.update(window)
+                score, mp3_frames, analysis = analyzer.result(file_size=len(data))
+                results[xor_key] = [score, mp3_frames, analysis]
+            else:
+                frames = validate_mp3_frames(window)['frames']
+                results[xor_key][0] += frames * 20
+                results[xor_key][1] += frames
+        
+        ranked = sorted(results.items(), key=lambda item: item[1][1], reverse=True)
+        if verbose:
+            log(f"  Window {index + 1} @ {offset}: " +
+                  ", ".join(f"0x{key:02X}={frames}" for key, (score, frames, analysis) in ranked))
+        if len(ranked) == 1 or ranked[0][1][1] - ranked[1][1][1] >= SAMPLE_WIN_MARGIN:
+            break
+    
+    ranked = sorted(((key, score, frames, analysis) for key, (score, frames, analysis) in results.items()),
+                    key=lambda x: x[1], reverse=True)
+    return ranked, bytes_examined
+
+@contextlib.contextmanager
+def map_file(file_path):
+    """Memory-map a file read-only, so only the parts that are touched get loaded"""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''  # mmap can't map empty files
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
 
 def analyze_chunk_quality(chunk_data):
     """Fast quality analysis for small chunks"""
@@ -192,190 +707,321 @@ def analyze_chunk_quality(chunk_data):
     
     return max(0, score)
 
-def discover_xor_key(file_path, verbose=False, chunk_size=4096):
-    """Discover XOR key using efficient chunk scoring"""
+def score_all_keys(chunk_data):
+    """Score every XOR key on a chunk in one pass (same result as analyze_chunk_quality per key)
+    
+    XOR only relabels byte values, so the byte histogram (and with it the uniformity
+    and unique byte count) is the same for every key. MP3 syncs are counted from a
+    table of (byte, next byte top 3 bits) pairs, and format headers can only match
+    for the key that turns the first header byte into the byte at that offset.
+    """
+    if not chunk_data or len(chunk_data) < 10:
+        return [0] * 256
+    
+    chunk_data = bytes(chunk_data)
+    
+    # Key-independent part: entropy and byte variety
+    base_score = 0
+    sample = chunk_data[:min(512, len(chunk_data))]
+    byte_counts = Counter(sample)
+    uniformity = max(byte_counts.values()) / len(sample)
+    
+    if uniformity > 0.5:
+        base_score -= 50
+    elif uniformity > 0.3:
+        base_score -= 20
+    else:
+        base_score += 10
+    
+    if 20 < len(byte_counts) < 200:
+        base_score += 20
+    
+    # Adjacent pair table: (byte, top 3 bits of next byte) -> count
+    pair_counts = Counter(zip(chunk_data[:-1], chunk_data[1:].translate(HIGH_BITS_TABLE)))
+    
+    scores = []
+    for xor_key in range(256):
+        # Decrypted pair is a sync when byte == 0xFF and next top bits == 0b111
+        mp3_syncs = pair_counts.get((0xFF ^ xor_key, 7 ^ (xor_key >> 5)), 0)
+        magic_score = mp3_syncs * 100
+        if chunk_data[0] ^ xor_key == 0xFF and ((chunk_data[1] ^ xor_key) & 0xE0) == 0xE0:
+            magic_score += 50
+        scores.append(base_score + magic_score)
+    
+    # Format headers: each offset can only match for one key
+    format_headers = [
+        (b'ID3', 150),
+        (b'RIFF', 120),
+        (b'fLaC', 120),
+        (b'OggS', 120),
+        (b'FORM', 100),
+    ]
+    
+    for header, points in format_headers:
+        matched_keys = set()
+        for offset in range(min(len(chunk_data) - len(header), 32)):
+            xor_key = chunk_data[offset] ^ header[0]
+            if xor_key in matched_keys:
+                continue
+            if apply_pure_xor(chunk_data[offset:offset+len(header)], xor_key) == header:
+                matched_keys.add(xor_key)
+                scores[xor_key] += points
+    
+    return [max(0, score) for score in scores]
+
+def score_chunk_keys(chunk_data, verbose=False, scoring=None):
+    """Phase 1: rank all 256 XOR keys on a chunk, returns [(key, score)] best first"""
+    scoring = scoring or SCORING_MODE
+    key_scores = []
+    
+    if scoring == 'histogram':
+        for xor_key, chunk_score in enumerate(score_all_keys(chunk_data)):
+            if chunk_score > 0:
+                key_scores.append((xor_key, chunk_score))
+    else:
+        for xor_key in range(256):
+            if verbose and xor_key % 64 == 0:
+                log(f"  Scoring keys 0x{xor_key:02X}-0x{min(xor_key + 63, 255):02X}...")
+            
+            # Quick XOR of just the chunk
+            decrypted_chunk = apply_pure_xor(chunk_data, xor_key)
+            
+            # Score the chunk
+            chunk_score = analyze_chunk_quality(decrypted_chunk)
+            
+            if chunk_score > 0:
+                key_scores.append((xor_key, chunk_score))
+    
+    # Sort by chunk score (best first)
+    key_scores.sort(key=lambda x: x[1], reverse=True)
+    
+    return key_scores
+
+def discover_xor_key(file_path, verbose=False, chunk_size=4096, hint_keys=None):
+    """Discover XOR key using efficient chunk scoring
+    
+    hint_keys are previously recovered keys (e.g. from the key cache) that are
+    tried first and only accepted if their decrypted frames chain.
+    """
     
-    print(f"Analyzing: {os.path.basename(file_path)}")
+    log(f"Analyzing: {os.path.basename(file_path)}")
+    timer = PhaseTimer()
     
-    # Read the file
+    # Map the file; phase 1 and the header checks only touch its first pages
     try:
-        with open(file_path, 'rb') as f:
-            data = f.read()
-    except Exception as e:
-        print(f"Error reading file: {e}")
+        with map_file(file_path) as data:
+            timer.lap('read')
+            return discover_xor_key_in_data(data, verbose, chunk_size, hint_keys, timer)
+    except OSError as e:
+        log_error(f"Error reading file: {e}")
         return None
+
+def discover_xor_key_in_data(data, verbose=False, chunk_size=4096, hint_keys=None, timer=None):
+    """discover_xor_key on file contents (bytes or mmap)
+    
+    Time spent deriving candidate keys is charged to timer's 'phase1', time spent
+    confirming them to 'phase2'; the times end up in analysis['timings'].
+    """
+    timer = timer or PhaseTimer()
     
     if len(data) < 100:
-        print(f"Warning: File very small ({len(data)} bytes)")
+        log_error(f"Warning: File very small ({len(data)} bytes)")
         return None
     
-    print(f"File size: {len(data)} bytes")
+    log(f"File size: {len(data)} bytes")
     
-    # Phase 1: Fast chunk scoring
-    print("Phase 1: Scoring chunks with all XOR keys...")
-    chunk_data = data[:chunk_size]
-    key_scores = []
-    
-    for xor_key in range(256):
-        if verbose and xor_key % 64 == 0:
-            print(f"  Scoring keys 0x{xor_key:02X}-0x{min(xor_key + 63, 255):02X}...")
+    # Cached keys: confirm by frame chaining instead of searching. No byte-0 header
+    # check here, keys the search found for files with leading junk must hit too
+    for hint_key in hint_keys or []:
+        timer.lap('phase1')
         
-        # Quick XOR of just the chunk
-        decrypted_chunk = apply_pure_xor(chunk_data, xor_key)
+        full_score, mp3_frames, analysis = confirm_decrypted_stream(data, hint_key)
+        timer.lap('phase2')
         
-        # Score the chunk
-        chunk_score = analyze_chunk_quality(decrypted_chunk)
+        if full_score > 0 and analysis['max_chain'] >= FRAME_CHAIN_CONFIRM:
+            analysis['key_path'] = 'cache'
+            analysis['timings'] = timer.times
+            log(f"✓ Cached key confirmed: 0x{hint_key:02X} (full_score={full_score}, MP3_frames={mp3_frames})")
+            return [(hint_key, full_score, mp3_frames, len(data), analysis)]
+    
+    # Fast path: read the key straight off a known header plaintext
+    for fast_key, header_name in known_plaintext_keys(data):
+        log(f"Fast path: key 0x{fast_key:02X} from {header_name} header")
+        timer.lap('phase1')
         
-        if chunk_score > 0:
-            key_scores.append((xor_key, chunk_score))
+        full_score, mp3_frames, analysis = confirm_decrypted_stream(data, fast_key)
+        timer.lap('phase2')
+        
+        if full_score > 0:
+            analysis['key_path'] = f"known-plaintext:{header_name}"
+            analysis['timings'] = timer.times
+            log(f"✓ Fast path key confirmed: 0x{fast_key:02X} (full_score={full_score}, MP3_frames={mp3_frames})")
+            return [(fast_key, full_score, mp3_frames, len(data), analysis)]
+        
+        log(f"✗ Fast path key 0x{fast_key:02X} failed full validation (score={full_score})")
     
-    # Sort by chunk score (best first)
-    key_scores.sort(key=lambda x: x[1], reverse=True)
+    # Phase 1: Fast chunk scoring
+    log(f"Phase 1: Scoring chunks with all XOR keys ({SCORING_MODE})...")
+    key_scores = score_chunk_keys(data[:chunk_size], verbose=verbose)
+    timer.lap('phase1')
     
-    print(f"Phase 1 complete: {len(key_scores)} keys with positive scores")
+    log(f"Phase 1 complete: {len(key_scores)} keys with positive scores")
     
     if not key_scores:
-        print("No promising keys found in chunk analysis")
+        log("No promising keys found in chunk analysis")
         return None
     
     if verbose:
-        print("Top chunk scores:")
+        log("Top chunk scores:")
         for i, (key, score) in enumerate(key_scores[:5]):
-            print(f"  {i+1}. Key 0x{key:02X}: chunk_score={score}")
+            log(f"  {i+1}. Key 0x{key:02X}: chunk_score={score}")
     
     # Phase 2: Full file analysis of ONLY the best key
     best_key = key_scores[0][0]
     best_chunk_score = key_scores[0][1]
     
-    print(f"Phase 2: Full analysis of best key 0x{best_key:02X} (chunk_score={best_chunk_score})")
+    log(f"Phase 2: Full analysis of best key 0x{best_key:02X} (chunk_score={best_chunk_score})")
     
-    # Apply XOR to full file with best key
-    decrypted_data = apply_pure_xor(data, best_key)
-    
-    # Comprehensive analysis
-    full_score, mp3_syncs, analysis = analyze_audio_quality(decrypted_data)
+    # Frame-chain analysis, decrypting only until enough frames chain
+    full_score, mp3_frames, analysis = confirm_decrypted_stream(data, best_key)
+    analysis['bytes_examined'] = max(analysis['bytes_examined'], min(chunk_size, len(data)))
+    timer.lap('phase2')
     
     if full_score > 0:
-        candidates = [(best_key, full_score, mp3_syncs, len(decrypted_data), analysis)]
-        print(f"✓ Best key confirmed: 0x{best_key:02X} (full_score={full_score}, MP3_syncs={mp3_syncs})")
+        analysis['key_path'] = 'search'
+        analysis['timings'] = timer.times
+        candidates = [(best_key, full_score, mp3_frames, len(data), analysis)]
+        log(f"✓ Best key confirmed: 0x{best_key:02X} (full_score={full_score}, MP3_frames={mp3_frames})")
         return candidates
     else:
-        print(f"✗ Best key failed full validation (score={full_score})")
+        log(f"✗ Best key failed full validation (score={full_score})")
         return None
 
 def discover_xor_key_with_alts(file_path, verbose=False, chunk_size=4096, num_alts=3):
     """Discover XOR key and alternatives using chunk scoring"""
     
-    print(f"Analyzing: {os.path.basename(file_path)}")
+    log(f"Analyzing: {os.path.basename(file_path)}")
+    timer = PhaseTimer()
     
-    # Read the file
+    # Map the file; phase 1 only touches its first pages
     try:
-        with open(file_path, 'rb') as f:
-            data = f.read()
-    except Exception as e:
-        print(f"Error reading file: {e}")
+        with map_file(file_path) as data:
+            timer.lap('read')
+            return discover_xor_key_with_alts_in_data(data, verbose, chunk_size, num_alts, timer)
+    except OSError as e:
+        log_error(f"Error reading file: {e}")
         return None
+
+def discover_xor_key_with_alts_in_data(data, verbose=False, chunk_size=4096, num_alts=3, timer=None):
+    """discover_xor_key_with_alts on file contents (bytes or mmap)"""
+    timer = timer or PhaseTimer()
     
     if len(data) < 100:
-        print(f"Warning: File very small ({len(data)} bytes)")
+        log_error(f"Warning: File very small ({len(data)} bytes)")
         return None
     
-    print(f"File size: {len(data)} bytes")
+    log(f"File size: {len(data)} bytes")
     
     # Phase 1: Fast chunk scoring
-    print("Phase 1: Scoring chunks with all XOR keys...")
-    chunk_data = data[:chunk_size]
-    key_scores = []
+    log(f"Phase 1: Scoring chunks with all XOR keys ({SCORING_MODE})...")
+    key_scores = score_chunk_keys(data[:chunk_size], verbose=verbose)
+    timer.lap('phase1')
     
-    for xor_key in range(256):
-        if verbose and xor_key % 64 == 0:
-            print(f"  Scoring keys 0x{xor_key:02X}-0x{min(xor_key + 63, 255):02X}...")
-        
-        # Quick XOR of just the chunk
-        decrypted_chunk = apply_pure_xor(chunk_data, xor_key)
-        
-        # Score the chunk
-        chunk_score = analyze_chunk_quality(decrypted_chunk)
-        
-        if chunk_score > 0:
-            key_scores.append((xor_key, chunk_score))
-    
-    # Sort by chunk score (best first)
-    key_scores.sort(key=lambda x: x[1], reverse=True)
-    
-    print(f"Phase 1 complete: {len(key_scores)} keys with positive scores")
+    log(f"Phase 1 complete: {len(key_scores)} keys with positive scores")
     
     if not key_scores:
-        print("No promising keys found in chunk analysis")
+        log("No promising keys found in chunk analysis")
         return None
     
     if verbose:
-        print("Top chunk scores:")
+        log("Top chunk scores:")
         for i, (key, score) in enumerate(key_scores[:5]):
-            print(f"  {i+1}. Key 0x{key:02X}: chunk_score={score}")
+            log(f"  {i+1}. Key 0x{key:02X}: chunk_score={score}")
     
-    # Phase 2: Full file analysis of top candidates
+    # Phase 2: Sampled analysis of top candidates (start, middle, end windows)
     top_keys = key_scores[:num_alts + 1]  # Best + alternatives
-    print(f"Phase 2: Full analysis of top {len(top_keys)} keys...")
+    log(f"Phase 2: Sampled analysis of top {len(top_keys)} keys...")
     
-    candidates = []
+    # The phase 1 chunk lies inside the start window
+    ranked, bytes_examined = rank_keys_sampled(data, top_keys, verbose)
+    bytes_examined = max(bytes_examined, min(chunk_size, len(data)))
+    timer.lap('phase2')
     
-    for i, (xor_key, chunk_score) in enumerate(top_keys):
-        if verbose:
-            print(f"  Analyzing key 0x{xor_key:02X} (chunk_score={chunk_score})...")
-        
-        # Apply XOR to full file
-        decrypted_data = apply_pure_xor(data, xor_key)
-        
-        # Comprehensive analysis
-        full_score, mp3_syncs, analysis = analyze_audio_quality(decrypted_data)
-        
+    candidates = []
+    for xor_key, full_score, mp3_frames, analysis in ranked:
         if full_score > 0:
-            candidates.append((xor_key, full_score, mp3_syncs, len(decrypted_data), analysis))
-    
-    # Sort by full score (best first)
-    candidates.sort(key=lambda x: x[1], reverse=True)
+            analysis['key_path'] = 'search'
+            analysis['bytes_examined'] = bytes_examined
+            analysis['timings'] = timer.times
+            candidates.append((xor_key, full_score, mp3_frames, len(data), analysis))
     
-    print(f"Phase 2 complete: {len(candidates)} keys confirmed")
+    log(f"Phase 2 complete: {len(candidates)} keys confirmed, "
+          f"examined {bytes_examined} of {len(data)} bytes")
     
     if candidates:
-        print("\nConfirmed candidates:")
-        for i, (key, score, mp3_syncs, size, analysis) in enumerate(candidates):
+        log("\nConfirmed candidates:")
+        for i, (key, score, mp3_frames, size, analysis) in enumerate(candidates):
             valid_header = "✓" if analysis.get('valid_header', False) else "✗"
-            print(f"  {i+1}. Key 0x{key:02X}: Score={score:3d}, MP3_syncs={mp3_syncs:2d}, Header={valid_header}")
+            log(f"  {i+1}. Key 0x{key:02X}: Score={score:3d}, MP3_frames={mp3_frames:2d}, Header={valid_header}")
     
     return candidates
 
-def decrypt_file(input_path, output_path, xor_key):
-    """Decrypt file using XOR key"""
+def decrypt_file(input_path, output_path, xor_key, block_size=STREAM_BLOCK_SIZE, stats=None):
+    """Decrypt file using XOR key
+    
+    Streams the file through one reused buffer: each block is XORed in place,
+    written out and fed to the validator, so memory use doesn't depend on file size.
+    If a stats dict is given it is filled with per-step times, size and validation results.
+    """
     
     try:
-        with open(input_path, 'rb') as f:
-            data = f.read()
-        
-        decrypted_data = apply_pure_xor(data, xor_key)
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        analyzer = AudioStreamAnalyzer()
+        timer = PhaseTimer()
+        data_size = 0
         
-        with open(output_path, 'wb') as f:
-            f.write(decrypted_data)
+        with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+            while True:
+                length = src.readinto(buffer)
+                timer.lap('read')
+                if not length:
+                    break
+                block = view[:length]
+                apply_pure_xor_inplace(block if length < block_size else buffer, xor_key)
+                timer.lap('xor')
+                dst.write(block)
+                timer.lap('write')
+                analyzer.update(block)
+                timer.lap('validate')
+                data_size += length
         
-        print(f"Decrypted {len(data)} bytes -> {len(decrypted_data)} bytes")
+        log(f"Decrypted {data_size} bytes -> {data_size} bytes")
         
         # Validate the result
-        score, mp3_syncs, analysis = analyze_audio_quality(decrypted_data)
-        print(f"Validation: Score={score}, MP3_syncs={mp3_syncs}, Valid_header={analysis.get('valid_header', False)}")
+        score, mp3_frames, analysis = analyzer.result()
+        if stats is not None:
+            stats.update(timer.times)
+            stats.update({'bytes': data_size, 'score': score, 'mp3_frames': mp3_frames,
+                          'duration': analysis.get('duration', 0)})
+        log(f"Validation: Score={score}, MP3_frames={mp3_frames}, "
+              f"Duration={analysis.get('duration', 0):.1f}s, Bitrate={analysis.get('bitrate_kbps', 0):.0f}kbps, "
+              f"Valid_header={analysis.get('valid_header', False)}")
         
         return True
         
     except Exception as e:
-        print(f"Error during decryption: {e}")
+        log_error(f"Error during decryption: {e}")
         return False
 
 def process_single_file(file_path, chunk_size=4096, show_alts=False):
     """Process a single file with optimized chunk-based analysis"""
     
-    print("="*80)
-    print("ULTRA-OPTIMIZED SINGLE FILE ANALYSIS")
-    print("="*80)
+    log("="*80)
+    log("ULTRA-OPTIMIZED SINGLE FILE ANALYSIS")
+    log("="*80)
+    
+    start_time = time.perf_counter()
     
     if show_alts:
         candidates = discover_xor_key_with_alts(file_path, verbose=True, chunk_size=chunk_size)
@@ -383,104 +1029,574 @@ def process_single_file(file_path, chunk_size=4096, show_alts=False):
         candidates = discover_xor_key(file_path, verbose=True, chunk_size=chunk_size)
     
     if not candidates:
-        print("No valid XOR keys found!")
+        log("No valid XOR keys found!")
+        emit_record(file_record(file_path, candidates, None, time.perf_counter() - start_time))
         return
     
     # Use the best key
     best_key = candidates[0][0]
     best_score = candidates[0][1]
     
-    print(f"\nUsing best key: 0x{best_key:02X} (score: {best_score})")
+    log(f"\nUsing best key: 0x{best_key:02X} (score: {best_score}, path: {candidates[0][4].get('key_path', 'search')})")
     
     # Generate output filename
     base_name = os.path.splitext(file_path)[0]
     output_path = f"{base_name}_decrypted_key{best_key:02X}.mp3"
     
     # Decrypt
-    if decrypt_file(file_path, output_path, best_key):
-        print(f"SUCCESS! Decrypted to: {output_path}")
+    decrypt_stats = {}
+    decrypted = decrypt_file(file_path, output_path, best_key, stats=decrypt_stats)
+    emit_record(dict(file_record(file_path, candidates, decrypt_stats, time.perf_counter() - start_time),
+                     output=output_path))
+    
+    if decrypted:
+        log(f"SUCCESS! Decrypted to: {output_path}")
         
         # Save alternatives only if requested and available
         if show_alts and len(candidates) > 1:
-            print("\nSaving alternative decryptions...")
-            for i, (key, score, mp3_syncs, size, analysis) in enumerate(candidates[1:4]):
+            log("\nSaving alternative decryptions...")
+            for i, (key, score, mp3_frames, size, analysis) in enumerate(candidates[1:4]):
                 alt_output = f"{base_name}_alt{i+2}_key{key:02X}.mp3"
                 decrypt_file(file_path, alt_output, key)
-                print(f"Alternative {i+2}: {alt_output}")
+                log(f"Alternative {i+2}: {alt_output}")
+
+def file_record(file_path, candidates, decrypt_stats, total_time):
+    """NDJSON record of one processed file: key, discovery path and per-phase timings"""
+    record = {'type': 'file', 'file': file_path, 'key': None, 'score': 0, 'key_path': None,
+              'scoring': SCORING_MODE, 'size': os.path.getsize(file_path) if os.path.exists(file_path) else 0}
+    
+    if candidates:
+        key, score, mp3_frames, size, analysis = candidates[0]
+        timings = analysis.get('timings', {})
+        record.update({
+            'key': key,
+            'score': score,
+            'key_path': analysis.get('key_path', 'search'),
+            'read_time': timings.get('read', 0.0),
+            'phase1_time': timings.get('phase1', 0.0),
+            'phase2_time': timings.get('phase2', 0.0),
+            'bytes_read': analysis.get('bytes_examined', size),
+        })
+    
+    if decrypt_stats:
+        record.update({
+            'decrypt_read_time': decrypt_stats.get('read', 0.0),
+            'xor_time': decrypt_stats.get('xor', 0.0),
+            'write_time': decrypt_stats.get('write', 0.0),
+            'validate_time': decrypt_stats.get('validate', 0.0),
+            'mp3_frames': decrypt_stats.get('mp3_frames', 0),
+            'duration': decrypt_stats.get('duration', 0),
+        })
+    
+    record['total_time'] = total_time
+    record['ok'] = bool(candidates) and bool(decrypt_stats) and decrypt_stats.get('score', 0) > 0
+    return record
+
+def batch_output_path(file_path, output_base=None):
+    """Output path of a batch file: next to the source, or <output_base>.mp3 in a mirrored tree"""
+    if output_base is None:
+        return f"{os.path.splitext(file_path)[0]}_decrypted.mp3"
+    return f"{output_base}.mp3"
+
+def process_batch_file(file_path, chunk_size=4096, show_alts=False, output_base=None, hint_keys=None):
+    """Discover the key for one batch file and decrypt it, returns (key, score, candidates)
+    
+    Output goes next to the source as <name>_decrypted.mp3, or to <output_base>.mp3
+    when an output base path (without extension) is given.
+    """
+    
+    file_start_time = time.time()
+    
+    if show_alts:
+        candidates = discover_xor_key_with_alts(file_path, chunk_size=chunk_size)
+    else:
+        candidates = discover_xor_key(file_path, chunk_size=chunk_size, hint_keys=hint_keys)
+    
+    if not candidates:
+        processing_time = time.time() - file_start_time
+        log(f"NO VALID KEY FOUND - {processing_time:.1f}s")
+        emit_record(file_record(file_path, candidates, None, processing_time))
+        return (None, 0, [])
+    
+    best_key = candidates[0][0]
+    best_score = candidates[0][1]
+    
+    processing_time = time.time() - file_start_time
+    key_path = candidates[0][4].get('key_path', 'search')
+    bytes_examined = candidates[0][4].get('bytes_examined', candidates[0][3])
+    log(f"BEST KEY: 0x{best_key:02X} (score: {best_score}, path: {key_path}, "
+          f"examined {bytes_examined}/{candidates[0][3]} bytes) - {processing_time:.1f}s")
+    
+    # Decrypt with best key
+    base_name = output_base or os.path.splitext(file_path)[0]
+    output_path = batch_output_path(file_path, output_base)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    decrypt_stats = {}
+    decrypt_file(file_path, output_path, best_key, stats=decrypt_stats)
+    emit_record(dict(file_record(file_path, candidates, decrypt_stats, time.time() - file_start_time),
+                     output=output_path))
+    
+    # Save alternatives if requested
+    if show_alts and len(candidates) > 1:
+        for j, (key, score, mp3_frames, size, analysis) in enumerate(candidates[1:3]):
+            alt_output = f"{base_name}_alt{j+2}_key{key:02X}.mp3"
+            decrypt_file(file_path, alt_output, key)
+            log(f"  Alternative {j+2}: key 0x{key:02X}")
+    
+    return (best_key, best_score, candidates[:3] if show_alts else [candidates[0]])
+
+def init_batch_worker(xor_backend, scoring_mode, output_mode='text'):
+    """Process pool initializer - carry the parent's XOR backend, scoring and output modes into the worker"""
+    set_xor_backend(xor_backend)
+    set_scoring_mode(scoring_mode)
+    set_output_mode(output_mode)
+
+def run_batch_worker(file_path, chunk_size, show_alts, output_base=None, hint_keys=None):
+    """Process pool entry point - process one file and return its log instead of printing it"""
+    output = io.StringIO()
+    
+    with contextlib.redirect_stdout(output):
+        try:
+            result = process_batch_file(file_path, chunk_size, show_alts, output_base, hint_keys)
+        except Exception as e:
+            log_error(f"Error processing file: {e}")
+            result = (None, 0, [])
+    
+    return result, output.getvalue()
+
+def print_file_header(i, total, filename):
+    """Print the per-file banner used in batch output"""
+    log(f"\n[{i}/{total if total else '?'}] " + "="*50)
+    log(f"PROCESSING: {filename}")
+    log("="*60)
+
+def run_batch(work_items, chunk_size=4096, show_alts=False, jobs=1, total=None):
+    """Process (name, file_path, output_base, hint_keys) work items, yields (name, result) as files finish
+    
+    work_items can be a lazy iterator. In parallel mode at most 2 * jobs files are
+    in flight, so new work is pulled from the iterator only as workers free up.
+    """
+    if jobs <= 1:
+        for i, (name, file_path, output_base, hint_keys) in enumerate(work_items, 1):
+            print_file_header(i, total, name)
+            yield name, process_batch_file(file_path, chunk_size, show_alts, output_base, hint_keys)
+        return
+    
+    # Workers capture their own output; each file's log is printed as one block when it finishes
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_batch_worker,
+                             initargs=(XOR_BACKEND, SCORING_MODE, OUTPUT_MODE)) as pool:
+        pending = {}
+        completed = 0
+        work_items = iter(work_items)
+        exhausted = False
+        
+        while pending or not exhausted:
+            while not exhausted and len(pending) < jobs * 2:
+                try:
+                    name, file_path, output_base, hint_keys = next(work_items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = pool.submit(run_batch_worker, file_path, chunk_size, show_alts, output_base, hint_keys)
+                pending[future] = name
+            
+            if not pending:
+                break
+            
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                result, output = future.result()
+                completed += 1
+                print_file_header(completed, total, name)
+                print(output, end='')
+                yield name, result
+
+def file_fingerprint(file_path):
+    """Fingerprint a file by its size and a hash of its first bytes"""
+    with open(file_path, 'rb') as f:
+        head = f.read(FINGERPRINT_HEAD_SIZE)
+    size = os.path.getsize(file_path)
+    return f"{size}:{hashlib.sha1(head).hexdigest()}"
 
-def process_directory(dir_path, chunk_size=4096, show_alts=False):
+def craftie_folder(file_path):
+    """Key cache folder for a file: the craftie UUID is the name of the folder holding it"""
+    return os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+
+class KeyCache:
+    """On-disk JSON cache of recovered keys by file fingerprint and craftie folder, with LRU eviction"""
+    
+    def __init__(self, path, max_entries=KEY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.files = OrderedDict()
+        self.folders = OrderedDict()
+        
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    cache = json.load(f)
+                self.files = OrderedDict(cache.get('files', {}))
+                self.folders = OrderedDict(cache.get('folders', {}))
+            except (OSError, ValueError) as e:
+                log_error(f"Warning: ignoring unreadable key cache {path}: {e}")
+    
+    def hint_keys(self, fingerprint, folder):
+        """Keys to try first for a file: its own cached key, then keys seen in the same folder"""
+        keys = []
+        
+        if fingerprint in self.files:
+            self.files.move_to_end(fingerprint)
+            keys.append(self.files[fingerprint])
+        if folder in self.folders:
+            self.folders.move_to_end(folder)
+            keys.extend(key for key in self.folders[folder] if key not in keys)
+        
+        return keys
+    
+    def store(self, fingerprint, folder, key):
+        """Record a recovered key, evicting the least recently used entries past max_entries"""
+        self.files[fingerprint] = key
+        self.files.move_to_end(fingerprint)
+        
+        # Most recent key first, a few per folder
+        folder_keys = [key] + [k for k in self.folders.get(folder, []) if k != key]
+        self.folders[folder] = folder_keys[:4]
+        self.folders.move_to_end(folder)
+        
+        while len(self.files) > self.max_entries:
+            self.files.popitem(last=False)
+        while len(self.folders) > self.max_entries:
+            self.folders.popitem(last=False)
+    
+    def save(self):
+        """Write the cache atomically"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': self.files, 'folders': self.folders}, f)
+        os.replace(tmp_path, self.path)
+
+class BatchManifest:
+    """Append-only JSON lines record of processed files, used to skip unchanged sources
+    
+    Files decrypted before are skipped while their source is unchanged. Files that failed
+    are skipped too, unless retry_failed is set (--resume); files a killed run never
+    finished have no entry and are always processed.
+    """
+    
+    def __init__(self, path, retry_failed=False):
+        self.path = path
+        self.retry_failed = retry_failed
+        self.entries = {}
+        self.skipped = 0
+        
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partial last line from a killed run
+                    self.entries[entry['name']] = entry
+        
+        # Rewrite compacted (last entry per file), then append as files finish
+        self.file = open(path, 'w')
+        for entry in self.entries.values():
+            self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+    
+    def is_current(self, name, file_path, output_path):
+        """True if the file's source is unchanged since it was processed and the outcome still stands:
+        its output exists, or it failed and failures aren't retried"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+        if entry['key'] is None:
+            if self.retry_failed:
+                return False
+        elif not os.path.exists(output_path):
+            return False
+        
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        
+        # Touched but maybe not changed (e.g. copied off the card again)
+        return file_fingerprint(file_path) == entry['fingerprint']
+    
+    def record(self, name, file_path, output_path, key, score, fingerprint=None):
+        """Append the outcome for one file"""
+        stat = os.stat(file_path)
+        entry = {
+            'name': name,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'fingerprint': fingerprint or file_fingerprint(file_path),
+            'output': output_path,
+            'key': key,
+            'score': score,
+        }
+        self.entries[name] = entry
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+
+def run_cached_batch(work_items, key_cache=None, manifest=None, chunk_size=4096, show_alts=False, jobs=1, total=None):
+    """run_batch over (name, file_path, output_base) work items with manifest skipping and key cache hints"""
+    file_info = {}
+    
+    def prepare():
+        for name, file_path, output_base in work_items:
+            output_path = batch_output_path(file_path, output_base)
+            if manifest is not None and manifest.is_current(name, file_path, output_path):
+                manifest.skipped += 1
+                continue
+            
+            folder = craftie_folder(file_path)
+            fingerprint = None
+            hint_keys = None
+            
+            if key_cache is not None:
+                try:
+                    fingerprint = file_fingerprint(file_path)
+                    hint_keys = key_cache.hint_keys(fingerprint, folder)
+                except OSError:
+                    pass
+            
+            file_info[name] = (file_path, output_path, fingerprint, folder)
+            yield name, file_path, output_base, hint_keys
+    
+    try:
+        for name, result in run_batch(prepare(), chunk_size, show_alts, jobs, total):
+            file_path, output_path, fingerprint, folder = file_info.pop(name)
+            key, score = result[0], result[1]
+            
+            if key is not None and key_cache is not None and fingerprint is not None:
+                key_cache.store(fingerprint, folder, key)
+            if manifest is not None:
+                try:
+                    manifest.record(name, file_path, output_path, key, score, fingerprint)
+                except OSError as e:
+                    log_error(f"Warning: could not record {name} in manifest: {e}")
+            
+            yield name, result
+    finally:
+        if key_cache is not None:
+            key_cache.save()
+        if manifest is not None:
+            manifest.close()
+
+def open_key_cache(cache_path, default_dir):
+    """Open the key cache at cache_path, or <default_dir>/key_cache.json; '' disables the cache"""
+    if cache_path == '':
+        return None
+    if cache_path is None:
+        os.makedirs(default_dir, exist_ok=True)
+        cache_path = os.path.join(default_dir, KEY_CACHE_FILENAME)
+    
+    key_cache = KeyCache(cache_path)
+    log(f"Key cache: {cache_path} ({len(key_cache.files)} files, {len(key_cache.folders)} folders)")
+    return key_cache
+
+def open_manifest(default_dir, resume=False):
+    """Open <default_dir>/manifest.jsonl; with resume, files that failed before are retried"""
+    os.makedirs(default_dir, exist_ok=True)
+    manifest = BatchManifest(os.path.join(default_dir, MANIFEST_FILENAME), resume)
+    
+    if manifest.entries:
+        failed = sum(1 for entry in manifest.entries.values() if entry['key'] is None)
+        log(f"Manifest {manifest.path}: {len(manifest.entries)} files, {failed} failed"
+            f"{' (retrying them)' if resume and failed else ''}")
+    return manifest
+
+def process_directory(dir_path, chunk_size=4096, show_alts=False, jobs=1, key_cache_path=None, resume=False):
     """Process all files in a directory with ultra-optimized analysis"""
     
-    print("="*80)
-    print("ULTRA-OPTIMIZED BATCH DIRECTORY ANALYSIS")
-    print("="*80)
+    log("="*80)
+    log("ULTRA-OPTIMIZED BATCH DIRECTORY ANALYSIS")
+    log("="*80)
     
     # Find potential audio files
-    extensions = ['.abc', '.dat', '.bin', '.enc']
     files_to_process = []
     
     for filename in os.listdir(dir_path):
-        if any(filename.lower().endswith(ext) for ext in extensions):
+        if any(filename.lower().endswith(ext) for ext in BATCH_EXTENSIONS):
             files_to_process.append(filename)
     
     if not files_to_process:
-        print("No files with audio extensions found!")
+        log("No files with audio extensions found!")
         return
     
-    print(f"Found {len(files_to_process)} files to process")
-    print(f"Using chunk size: {chunk_size} bytes for initial scoring")
-    print(f"Alternatives: {'Enabled' if show_alts else 'Disabled (use --show-alts to enable)'}")
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    
+    log(f"Found {len(files_to_process)} files to process")
+    log(f"Using chunk size: {chunk_size} bytes for initial scoring")
+    log(f"Alternatives: {'Enabled' if show_alts else 'Disabled (use --show-alts to enable)'}")
+    log(f"Parallel jobs: {jobs}")
+    key_cache = open_key_cache(key_cache_path, dir_path)
+    manifest = open_manifest(dir_path, resume)
     
     # Process each file
     all_results = {}
     total_start_time = time.time()
     
-    for i, filename in enumerate(files_to_process, 1):
-        print(f"\n[{i}/{len(files_to_process)}] " + "="*50)
-        print(f"PROCESSING: {filename}")
-        print("="*60)
-        
-        file_start_time = time.time()
-        file_path = os.path.join(dir_path, filename)
+    work_items = ((filename, os.path.join(dir_path, filename), None) for filename in files_to_process)
+    for filename, result in run_cached_batch(work_items, key_cache, manifest, chunk_size, show_alts, jobs,
+                                             len(files_to_process)):
+        all_results[filename] = result
+    
+    # Keep the summary in directory order
+    all_results = {filename: all_results[filename] for filename in files_to_process if filename in all_results}
+    
+    total_time = time.time() - total_start_time
+    print_batch_summary(all_results, total_time, jobs, manifest.skipped)
+
+def iter_card_files(root, skip_paths=()):
+    """Walk an SD card tree with os.scandir, yields relative paths of encrypted files as they are found"""
+    skip_paths = {os.path.abspath(path) for path in skip_paths}
+    stack = ['']
+    
+    while stack:
+        rel_dir = stack.pop()
+        subdirs = []
         
-        if show_alts:
-            candidates = discover_xor_key_with_alts(file_path, chunk_size=chunk_size)
-        else:
-            candidates = discover_xor_key(file_path, chunk_size=chunk_size)
+        try:
+            with os.scandir(os.path.join(root, rel_dir)) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    rel_path = os.path.join(rel_dir, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in CARD_SKIP_DIRS or os.path.abspath(entry.path) in skip_paths:
+                            continue
+                        subdirs.append(rel_path)
+                    elif any(entry.name.lower().endswith(ext) for ext in BATCH_EXTENSIONS):
+                        yield rel_path
+        except OSError as e:
+            log_error(f"Warning: cannot read {os.path.join(root, rel_dir)}: {e}")
+            continue
         
-        if candidates:
-            best_key = candidates[0][0]
-            best_score = candidates[0][1]
-            all_results[filename] = (best_key, best_score, candidates[:3] if show_alts else [candidates[0]])
-            
-            processing_time = time.time() - file_start_time
-            print(f"BEST KEY: 0x{best_key:02X} (score: {best_score}) - {processing_time:.1f}s")
-            
-            # Decrypt with best key
-            base_name = os.path.splitext(file_path)[0]
-            output_path = f"{base_name}_decrypted.mp3"
-            decrypt_file(file_path, output_path, best_key)
-            
-            # Save alternatives if requested
-            if show_alts and len(candidates) > 1:
-                for j, (key, score, mp3_syncs, size, analysis) in enumerate(candidates[1:3]):
-                    alt_output = f"{base_name}_alt{j+2}_key{key:02X}.mp3"
-                    decrypt_file(file_path, alt_output, key)
-                    print(f"  Alternative {j+2}: key 0x{key:02X}")
-        else:
-            all_results[filename] = (None, 0, [])
-            processing_time = time.time() - file_start_time
-            print(f"NO VALID KEY FOUND - {processing_time:.1f}s")
+        # Depth first, in name order
+        stack.extend(reversed(subdirs))
+
+def parse_craftie_path(rel_path):
+    """Split a card-relative path of the form craftie/<LANG>/<UUID>/<file>, returns (lang, uuid) or (None, None)"""
+    parts = rel_path.replace(os.sep, '/').split('/')
+    if len(parts) == 4 and parts[0] == 'craftie':
+        return parts[1], parts[2]
+    if len(parts) == 3 and parts[0] == 'craftie':  # Older cards without a language level
+        return None, parts[1]
+    return None, None
+
+def process_card_tree(root, output_dir=None, chunk_size=4096, show_alts=False, jobs=1, key_cache_path=None,
+                      resume=False):
+    """Decrypt every encrypted file under an SD card tree into a mirrored output tree"""
+    
+    log("="*80)
+    log("ULTRA-OPTIMIZED SD CARD ANALYSIS")
+    log("="*80)
+    
+    if output_dir is None:
+        output_dir = os.path.normpath(root) + "_decrypted"
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    
+    log(f"Card root: {root}")
+    log(f"Output tree: {output_dir}")
+    log(f"Using chunk size: {chunk_size} bytes for initial scoring")
+    log(f"Alternatives: {'Enabled' if show_alts else 'Disabled (use --show-alts to enable)'}")
+    log(f"Parallel jobs: {jobs}")
+    key_cache = open_key_cache(key_cache_path, output_dir)
+    manifest = open_manifest(output_dir, resume)
+    
+    # Work items are produced while the walk runs, so decryption starts on the first file found
+    work_items = ((rel_path, os.path.join(root, rel_path), os.path.join(output_dir, os.path.splitext(rel_path)[0]))
+                  for rel_path in iter_card_files(root, skip_paths=[output_dir]))
+    
+    all_results = {}
+    total_start_time = time.time()
+    
+    for rel_path, result in run_cached_batch(work_items, key_cache, manifest, chunk_size, show_alts, jobs):
+        all_results[rel_path] = result
     
     total_time = time.time() - total_start_time
+    all_results = dict(sorted(all_results.items()))
+    print_batch_summary(all_results, total_time, jobs, manifest.skipped)
+    
+    # Per-language breakdown of the craftie folders
+    crafties = {}
+    for rel_path, (key, score, candidates) in all_results.items():
+        lang, uuid = parse_craftie_path(rel_path)
+        if uuid is None:
+            continue
+        files, decrypted = crafties.get((lang, uuid), (0, 0))
+        crafties[(lang, uuid)] = (files + 1, decrypted + (key is not None))
+    
+    if crafties:
+        log(f"\nCRAFTIE SUMMARY:")
+        for lang in sorted({lang or '-' for lang, uuid in crafties}):
+            lang_crafties = [counts for (l, uuid), counts in crafties.items() if (l or '-') == lang]
+            files = sum(files for files, decrypted in lang_crafties)
+            decrypted = sum(decrypted for files, decrypted in lang_crafties)
+            log(f"  {lang}: {len(lang_crafties)} crafties, {decrypted}/{files} files decrypted")
+
+def batch_summary_record(all_results, total_time, jobs=1, skipped=0):
+    """NDJSON summary record of a batch run"""
+    found = [(key, candidates[0][4]) for key, score, candidates in all_results.values() if key is not None]
+    
+    phase_totals = {}
+    for key, analysis in found:
+        for phase, seconds in analysis.get('timings', {}).items():
+            phase_totals[phase] = phase_totals.get(phase, 0.0) + seconds
+    
+    return {
+        'type': 'summary',
+        'files': len(all_results),
+        'successful': len(found),
+        'failed': len(all_results) - len(found),
+        'skipped': skipped,
+        'jobs': jobs,
+        'scoring': SCORING_MODE,
+        'xor_backend': XOR_BACKEND,
+        'total_time': total_time,
+        'key_paths': dict(Counter(analysis.get('key_path', 'search') for key, analysis in found)),
+        'phase_times': phase_totals,
+        'keys': sorted({f"0x{key:02X}" for key, analysis in found}),
+    }
+
+def print_batch_summary(all_results, total_time, jobs=1, skipped=0):
+    """Print the timing, key discovery summary and key statistics for a batch run
+    
+    In json mode this is a single summary record instead.
+    """
+    
+    if OUTPUT_MODE == 'json':
+        emit_record(batch_summary_record(all_results, total_time, jobs, skipped))
+        return
     
     # Final summary
     print("\n" + "="*80)
     print("ULTRA-OPTIMIZED BATCH PROCESSING COMPLETE")
     print("="*80)
     
+    if skipped:
+        print(f"\nSkipped (unchanged since last run): {skipped} files")
+    
+    if not all_results:
+        print("\nNo files were processed")
+        return
+    
     print(f"\nTIMING: Total processing time: {total_time:.1f} seconds")
-    print(f"Average per file: {total_time/len(files_to_process):.1f} seconds")
+    print(f"Average per file: {total_time/len(all_results):.1f} seconds")
+    if jobs > 1:
+        print(f"Throughput: {len(all_results)/total_time:.1f} files/s with {jobs} jobs")
     
     print("\nKEY DISCOVERY SUMMARY:")
     successful_files = 0
@@ -495,10 +1611,23 @@ def process_directory(dir_path, chunk_size=4096, show_alts=False):
             print(f"  {filename:30} -> FAILED")
     
     print(f"\nSTATISTICS:")
-    print(f"  Files processed: {len(files_to_process)}")
+    print(f"  Files processed: {len(all_results)}")
     print(f"  Successful: {successful_files}")
-    print(f"  Failed: {len(files_to_process) - successful_files}")
-    print(f"  Success rate: {successful_files/len(files_to_process)*100:.1f}%")
+    print(f"  Failed: {len(all_results) - successful_files}")
+    print(f"  Success rate: {successful_files/len(all_results)*100:.1f}%")
+    
+    key_paths = Counter(candidates[0][4].get('key_path', 'search')
+                        for key, score, candidates in all_results.values() if key is not None)
+    if key_paths:
+        fast_path_files = sum(count for path, count in key_paths.items() if path != 'search')
+        print(f"  Fast path hits: {fast_path_files}/{successful_files}")
+        for path, count in sorted(key_paths.items()):
+            print(f"    {path}: {count} files")
+        
+        examined = sum(candidates[0][4].get('bytes_examined', candidates[0][3])
+                       for key, score, candidates in all_results.values() if key is not None)
+        total_size = sum(candidates[0][3] for key, score, candidates in all_results.values() if key is not None)
+        print(f"  Bytes examined for key discovery: {examined}/{total_size} ({examined/max(total_size, 1)*100:.1f}%)")
     
     if all_keys:
         print(f"\nKEY ANALYSIS:")
@@ -526,6 +1655,39 @@ def process_directory(dir_path, chunk_size=4096, show_alts=False):
             for key in sorted(key_counts.keys()):
                 print(f"    0x{key:02X}: {key_counts[key]} files")
 
+@contextlib.contextmanager
+def profiled(profiler=None, output_path=None):
+    """Run the body under cProfile or tracemalloc and report to stderr (no-op without a profiler)"""
+    if profiler == 'cprofile':
+        import cProfile
+        import pstats
+        
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            output_path = output_path or 'decrypt_crafties.prof'
+            profile.dump_stats(output_path)
+            print(f"\nPROFILE: cProfile stats saved to {output_path}", file=sys.stderr)
+            pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+    elif profiler == 'tracemalloc':
+        import tracemalloc
+        
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"\nPROFILE: Python heap current {current/1e6:.1f} MB, peak {peak/1e6:.1f} MB", file=sys.stderr)
+            for stat in snapshot.statistics('lineno')[:15]:
+                print(f"  {stat}", file=sys.stderr)
+    else:
+        yield
+
 def main():
     """Main function with ultra-optimization and optional alternatives"""
     
@@ -536,15 +1698,47 @@ def main():
                         help='Chunk size for initial scoring (default: 4096)')
     parser.add_argument('--show-alts', action='store_true', 
                         help='Generate alternative decryptions (slower but more thorough)')
+    parser.add_argument('--xor-backend', choices=['auto'] + XOR_BACKENDS, default='auto',
+                        help='XOR implementation to use (default: auto - numpy if installed)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files to process in parallel for directories (default: 1, 0 = all cores)')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Walk a whole SD card tree (craftie/<LANG>/<UUID>/) and decrypt into a mirrored output tree')
+    parser.add_argument('-o', '--output-dir',
+                        help='Output tree for --recursive (default: <path>_decrypted)')
+    parser.add_argument('--key-cache',
+                        help='Key cache file for batch modes (default: key_cache.json next to the output, "" to disable)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Also retry files that failed in a previous batch run (unchanged files that were '
+                             'decrypted are always skipped, unfinished ones always processed)')
+    parser.add_argument('--scoring', choices=SCORING_MODES, default='histogram',
+                        help='Phase 1 key scoring: one-pass histogram or per-key brute force (default: histogram)')
+    output_group = parser.add_mutually_exclusive_group()
+    output_group.add_argument('--json', action='store_true',
+                              help='Print one NDJSON record per file (key, path, per-phase timings) plus a summary record')
+    output_group.add_argument('--quiet', action='store_true',
+                              help='Only print errors and the final summary')
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'],
+                        help='Profile the run (parallel workers are not profiled, use -j 1) and report to stderr')
+    parser.add_argument('--profile-output',
+                        help='Save cProfile stats to this file for pstats/snakeviz (default: decrypt_crafties.prof)')
     
     args = parser.parse_args()
     
+    try:
+        backend = set_xor_backend(args.xor_backend)
+        set_scoring_mode(args.scoring)
+        set_output_mode('json' if args.json else 'quiet' if args.quiet else 'text')
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    
     # Validate chunk size
     if args.chunk_size < 512:
-        print("Warning: Very small chunk size may miss audio headers")
+        log_error("Warning: Very small chunk size may miss audio headers")
         args.chunk_size = 512
     elif args.chunk_size > 32768:
-        print("Warning: Large chunk size reduces optimization benefits")
+        log_error("Warning: Large chunk size reduces optimization benefits")
         args.chunk_size = 32768
     
     # Get path from command line or prompt user
@@ -554,20 +1748,25 @@ def main():
         target_path = input("Enter file or directory path: ").strip()
     
     if not os.path.exists(target_path):
-        print(f"Error: Path '{target_path}' does not exist!")
+        log_error(f"Error: Path '{target_path}' does not exist!")
         return
     
-    print(f"ULTRA-OPTIMIZATION: Using {args.chunk_size} byte chunks for scoring")
-    print(f"Strategy: Score ALL keys on chunks, decrypt ONLY the highest scoring key")
-    print(f"Alternatives: {'Enabled' if args.show_alts else 'Disabled (use --show-alts to enable)'}")
-    print("This provides maximum speed with excellent accuracy!\n")
-    
-    if os.path.isfile(target_path):
-        process_single_file(target_path, args.chunk_size, args.show_alts)
-    elif os.path.isdir(target_path):
-        process_directory(target_path, args.chunk_size, args.show_alts)
-    else:
-        print(f"Error: '{target_path}' is neither a file nor directory!")
+    log(f"ULTRA-OPTIMIZATION: Using {args.chunk_size} byte chunks for scoring")
+    log(f"Strategy: Score ALL keys on chunks, decrypt ONLY the highest scoring key")
+    log(f"XOR backend: {backend}, phase 1 scoring: {args.scoring}")
+    log(f"Alternatives: {'Enabled' if args.show_alts else 'Disabled (use --show-alts to enable)'}")
+    log("This provides maximum speed with excellent accuracy!\n")
+    
+    with profiled(args.profile, args.profile_output):
+        if os.path.isfile(target_path):
+            process_single_file(target_path, args.chunk_size, args.show_alts)
+        elif os.path.isdir(target_path) and args.recursive:
+            process_card_tree(target_path, args.output_dir, args.chunk_size, args.show_alts, args.jobs,
+                              args.key_cache, args.resume)
+        elif os.path.isdir(target_path):
+            process_directory(target_path, args.chunk_size, args.show_alts, args.jobs, args.key_cache, args.resume)
+        else:
+            log_error(f"Error: '{target_path}' is neither a file nor directory!")
 
 if __name__ == "__main__":
     main()
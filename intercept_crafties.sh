@@ -85,14 +85,8 @@ process_existing() {
     local pcap_file="$1"
     echo -e "${YELLOW}Processing existing pcap file: $pcap_file${NC}"
     
-    # Extract HTTP requests using tshark
-    tshark -r "$pcap_file" -Y "http.request and http.host == \"audiocnd.storypod.com\"" \
-           -T fields -e http.request.full_uri 2>/dev/null | while read -r url; do
-        
-        if [ -n "$url" ]; then
-            download_url "$url"
-        fi
-    done
+    # pcap_urls.py reads pcap/pcapng natively and downloads new URLs itself (same processed_urls.txt)
+    python3 "$(dirname "$0")/pcap_urls.py" "$pcap_file" -o "$OUTPUT_DIR"
 }
 
 # Alternative method using tshark live capture
@@ -181,9 +175,8 @@ elif [ "$1" = "-f" ]; then
     PROCESSED_URLS_FILE="$OUTPUT_DIR/processed_urls.txt"
     touch "$PROCESSED_URLS_FILE"
     
-    # Check if tshark is available for pcap processing
-    if ! command -v tshark &> /dev/null; then
-        echo -e "${RED}Error: tshark is required for pcap processing. Install with: sudo apt install tshark${NC}"
+    if ! command -v python3 &> /dev/null; then
+        echo -e "${RED}Error: python3 is required for pcap processing${NC}"
         exit 1
     fi
     
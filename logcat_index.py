@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Logcat Indexer - incremental index of the device logs in /logcat/storypod_logcat_[num].txt
+Streams each log line by line with precompiled patterns and keeps a byte offset checkpoint per file,
+so a re-run only parses what was appended. Craftie scans, post_body requests, access tokens and
+signed audiocnd URLs go into sqlite, where StorypodAPI and mirror_crafties.py read them
+
+Usage: python logcat_index.py update <sdcard_or_logcat_dir> [--db logcat_index.db]
+       python logcat_index.py follow <logcat_dir> | token | scans | urls | stats
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from urllib.parse import urlsplit, parse_qs
+
+LOGCAT_INDEX_FILENAME = 'logcat_index.db'
+LOGCAT_PATTERN = re.compile(r'^storypod_logcat_(\d+)\.txt$')
+CHECKPOINT_HEAD_SIZE = 256    # Bytes hashed to notice a log that was replaced or restarted
+URL_EXPIRY_MARGIN = 60        # Seconds a signed URL must still be valid for to be handed out
+LOGCAT_SCHEMA_VERSION = 1     # PRAGMA user_version; an index with another version is rebuilt from the logs
+
+# Cheap first test on the raw line; the patterns below only run on lines that pass it
+INTERESTING_LINE = re.compile(rb'crafite_uuid|post_body|access-token|audiocnd')
+LINE_TIME = re.compile(r'^\W*(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?|\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)?)')
+SCAN_EVENT = re.compile(r'crafite_uuid\s*=\s*(\d+)\s*,\s*crafite_psyid\s*=\s*([0-9A-Fa-f]+)')
+POST_BODY = re.compile(r'post_body\s*=\s*(\{.*)')
+POST_FIELD = re.compile(r'"(\w+)"\s*:\s*"?([^",}]*)')
+ACCESS_TOKEN = re.compile(r'access-token["\']?\s*[:=]\s*["\']?([^\s"\',;}]{16,})')
+AUDIO_URL = re.compile(r'https?://audiocnd\.storypod\.com/audios/([^/\s?"\']+)\.mp3(?:\?[^\s"\']*)?')
+
+LOGCAT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,     -- bytes parsed, always at a line boundary
+    head_size INTEGER NOT NULL,
+    head_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    file TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    position INTEGER NOT NULL,   -- log number and offset: orders lines across files
+    time TEXT,
+    kind TEXT NOT NULL,          -- 'scan' or 'post_body'
+    craftie_uuid TEXT,
+    psyid TEXT,
+    device_id TEXT,
+    audio_id TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS events_by_craftie ON events (craftie_uuid, position);
+CREATE INDEX IF NOT EXISTS events_by_file ON events (file);
+CREATE TABLE IF NOT EXISTS tokens (     -- one row per token and file, so a re-indexed file replaces its own
+    token TEXT NOT NULL,
+    file TEXT NOT NULL,
+    position INTEGER NOT NULL,   -- where it was last seen in the file
+    time TEXT,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (token, file)
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT NOT NULL,
+    audio_id TEXT NOT NULL,
+    expires INTEGER,
+    file TEXT NOT NULL,
+    position INTEGER NOT NULL,   -- where it was first seen in the file
+    time TEXT,
+    PRIMARY KEY (url, file)
+);
+CREATE INDEX IF NOT EXISTS urls_by_audio ON urls (audio_id, expires);
+"""
+
+def log_number(path):
+    """The [num] of storypod_logcat_[num].txt, 0 for other names"""
+    match = LOGCAT_PATTERN.match(os.path.basename(path))
+    return int(match.group(1)) if match else 0
+
+def find_logs(paths):
+    """Log files in paths (files, logcat folders or card roots with a logcat/ folder), oldest first"""
+    logs = []
+    for path in paths:
+        if os.path.isfile(path):
+            logs.append(path)
+            continue
+        if os.path.isdir(os.path.join(path, 'logcat')):
+            path = os.path.join(path, 'logcat')
+        if os.path.isdir(path):
+            logs += [os.path.join(path, name) for name in os.listdir(path) if LOGCAT_PATTERN.match(name)]
+    return sorted(set(logs), key=lambda log: (log_number(log), log))
+
+def url_expires(url):
+    """Expires= of a signed URL (epoch seconds), or None"""
+    values = parse_qs(urlsplit(url).query).get('Expires')
+    return int(values[0]) if values and values[0].isdigit() else None
+
+def parse_post_body(text):
+    """Fields of a logged post_body: the JSON object, or its "key":value pairs if the log cut it off"""
+    try:
+        body = json.loads(text)
+        if isinstance(body, dict):
+            return body
+    except ValueError:
+        pass
+    return dict(POST_FIELD.findall(text))
+
+def parse_line(line):
+    """Everything of interest in one decoded log line as a list of (kind, fields)"""
+    found = []
+
+    match = SCAN_EVENT.search(line)
+    if match:
+        found.append(('scan', {'craftie_uuid': match.group(1), 'psyid': match.group(2).lower()}))
+
+    match = POST_BODY.search(line)
+    if match:
+        found.append(('post_body', parse_post_body(match.group(1).strip())))
+
+    for token in ACCESS_TOKEN.findall(line):
+        found.append(('token', {'token': token}))
+
+    for match in AUDIO_URL.finditer(line):
+        found.append(('url', {'url': match.group(0), 'audio_id': match.group(1)}))
+
+    return found
+
+class LogcatIndex:
+    """sqlite store of what the logs contain, updated incrementally from per-file checkpoints"""
+
+    def __init__(self, db_path=LOGCAT_INDEX_FILENAME):
+        self.conn = sqlite3.connect(db_path)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != LOGCAT_SCHEMA_VERSION:
+            # Older layout (or a new file): start over, the checkpoints go too so every log is re-read
+            self.conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS events; "
+                                    "DROP TABLE IF EXISTS tokens; DROP TABLE IF EXISTS urls;")
+            self.conn.execute(f"PRAGMA user_version = {LOGCAT_SCHEMA_VERSION}")
+        self.conn.executescript(LOGCAT_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def head_hash(self, f, size):
+        f.seek(0)
+        return hashlib.sha1(f.read(size)).hexdigest()
+
+    def update(self, paths):
+        """Parse what was appended to each log since the last update, returns counts of new items"""
+        counts = {'files': 0, 'lines': 0, 'scans': 0, 'post_bodies': 0, 'tokens': 0, 'urls': 0}
+        for path in find_logs(paths):
+            if self.update_file(path, counts):
+                counts['files'] += 1
+        return counts
+
+    def update_file(self, path, counts):
+        """Parse one log from its checkpoint, returns whether there were new complete lines"""
+        path = os.path.abspath(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+
+        row = self.conn.execute("SELECT offset, head_size, head_hash FROM files WHERE path = ?", (path,)).fetchone()
+        offset = row[0] if row else 0
+
+        with open(path, 'rb') as f, self.conn:
+            # A log that shrank or starts differently was rotated or restarted: index it from scratch
+            if row and (size < offset or self.head_hash(f, row[1]) != row[2]):
+                for table in ('events', 'tokens', 'urls'):
+                    self.conn.execute(f"DELETE FROM {table} WHERE file = ?", (path,))
+                offset = 0
+            if size == offset:
+                return False
+
+            start = offset
+            base = log_number(path) << 40
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Still being written, parsed once complete
+                if INTERESTING_LINE.search(line):
+                    self.index_line(line.decode('utf-8', 'replace'), path, offset, base + offset, counts)
+                offset += len(line)
+                counts['lines'] += 1
+
+            head_size = min(offset, CHECKPOINT_HEAD_SIZE)
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                              (path, offset, head_size, self.head_hash(f, head_size)))
+        return offset > start
+
+    def index_line(self, line, path, offset, position, counts):
+        match = LINE_TIME.match(line)
+        line_time = match.group(1) if match else None
+
+        for kind, fields in parse_line(line):
+            if kind == 'scan':
+                self.conn.execute("INSERT INTO events VALUES (?, ?, ?, ?, 'scan', ?, ?, NULL, NULL, NULL)",
+                                  (path, offset, position, line_time, fields['craftie_uuid'], fields['psyid']))
+                counts['scans'] += 1
+
+            elif kind == 'post_body':
+                audio_id = fields.get('current_audio_id') or fields.get('audio_id')
+                self.conn.execute("INSERT INTO events VALUES (?, ?, ?, ?, 'post_body', ?, ?, ?, ?, ?)",
+                                  (path, offset, position, line_time,
+                                   str(fields['crafite_uuid']) if fields.get('crafite_uuid') else None,
+                                   fields.get('crafite_card') or None, fields.get('device_id') or None,
+                                   str(audio_id) if audio_id else None, json.dumps(fields)))
+                counts['post_bodies'] += 1
+
+            elif kind == 'token':
+                token = fields['token']
+                if self.conn.execute("SELECT 1 FROM tokens WHERE token = ? AND file = ?", (token, path)).fetchone():
+                    self.conn.execute("UPDATE tokens SET position = MAX(position, ?), time = ?, "
+                                      "count = count + 1 WHERE token = ? AND file = ?",
+                                      (position, line_time, token, path))
+                    continue
+                if not self.conn.execute("SELECT 1 FROM tokens WHERE token = ?", (token,)).fetchone():
+                    counts['tokens'] += 1
+                self.conn.execute("INSERT INTO tokens VALUES (?, ?, ?, ?, 1)", (token, path, position, line_time))
+
+            elif kind == 'url':
+                url = fields['url']
+                if self.conn.execute("SELECT 1 FROM urls WHERE url = ? AND file = ?", (url, path)).fetchone():
+                    continue
+                if not self.conn.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone():
+                    counts['urls'] += 1
+                self.conn.execute("INSERT INTO urls VALUES (?, ?, ?, ?, ?, ?)",
+                                  (url, fields['audio_id'], url_expires(url), path, position, line_time))
+
+    def latest_token(self):
+        """The access token seen last in the logs, or None"""
+        row = self.conn.execute("SELECT token FROM tokens ORDER BY position DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def device_id(self):
+        """The device id of the newest post_body that has one, or None"""
+        row = self.conn.execute("SELECT device_id FROM events WHERE device_id IS NOT NULL "
+                                "ORDER BY position DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def scans(self, craftie_uuid=None, newest=None):
+        """Rows (time, craftie_uuid, psyid, file) of craftie scans, oldest first
+
+        With newest, only the last that many scans indexed (highest rowids), so follow() reads
+        just what an update added instead of the whole table.
+        """
+        query = "SELECT time, craftie_uuid, psyid, file, position FROM events WHERE kind = 'scan'"
+        params = []
+        if craftie_uuid:
+            query += " AND craftie_uuid = ?"
+            params.append(craftie_uuid)
+        if newest:
+            query += " ORDER BY rowid DESC LIMIT ?"
+            params.append(newest)
+        query = f"SELECT time, craftie_uuid, psyid, file FROM ({query}) ORDER BY position"
+        return self.conn.execute(query, params).fetchall()
+
+    def audio_urls(self, valid_for=URL_EXPIRY_MARGIN):
+        """{audio_id: url} of signed URLs still valid for valid_for seconds, newest per audio id
+
+        With valid_for None every URL is returned, expired or not.
+        """
+        query = "SELECT audio_id, url FROM urls"
+        params = []
+        if valid_for is not None:
+            query += " WHERE expires IS NULL OR expires > ?"
+            params.append(int(time.time()) + valid_for)
+        return dict(self.conn.execute(query + " ORDER BY position", params).fetchall())
+
+    def stats(self):
+        """Number of indexed files, events, distinct tokens and distinct URLs"""
+        queries = {
+            'files': "SELECT COUNT(*) FROM files",
+            'events': "SELECT COUNT(*) FROM events",
+            'tokens': "SELECT COUNT(DISTINCT token) FROM tokens",
+            'urls': "SELECT COUNT(DISTINCT url) FROM urls",
+        }
+        return {table: self.conn.execute(query).fetchone()[0] for table, query in queries.items()}
+
+def print_counts(counts):
+    print(f"{counts['lines']} new lines in {counts['files']} logs: {counts['scans']} scans, "
+          f"{counts['post_bodies']} post bodies, {counts['tokens']} new tokens, {counts['urls']} new audio URLs")
+
+def follow(index, paths, interval=1.0):
+    """Keep indexing logs (and new log files) as they are written, until interrupted"""
+    token = index.latest_token()
+    while True:
+        counts = index.update(paths)
+        if counts['lines']:
+            print(f"{time.strftime('%H:%M:%S')} ", end='')
+            print_counts(counts)
+            for line_time, craftie_uuid, psyid, path in index.scans(newest=counts['scans']) if counts['scans'] else []:
+                print(f"  scan {craftie_uuid} ({psyid}) at {line_time or '?'}")
+            if index.latest_token() != token:
+                token = index.latest_token()
+                print(f"  new access token: {token}")
+        time.sleep(interval)
+
+def main():
+    """Update or query a logcat index"""
+
+    parser = argparse.ArgumentParser(description='Incremental index of storypod_logcat_*.txt device logs')
+    parser.add_argument('--db', default=LOGCAT_INDEX_FILENAME,
+                        help=f"Index database (default: {LOGCAT_INDEX_FILENAME})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='Index new lines of the logs')
+    update.add_argument('paths', nargs='+', help='Log files, logcat folders or SD card roots')
+    follow_parser = commands.add_parser('follow', help='Index logs as they are written (Ctrl+C to stop)')
+    follow_parser.add_argument('paths', nargs='+', help='Log files, logcat folders or SD card roots')
+    follow_parser.add_argument('--interval', type=float, default=1.0, help='Seconds between checks (default: 1)')
+    commands.add_parser('token', help='Newest access token and device id')
+    scans = commands.add_parser('scans', help='Craftie scans, oldest first')
+    scans.add_argument('--craftie', help='Only scans of this craftie UUID')
+    urls = commands.add_parser('urls', help='Signed audio URLs that are still valid')
+    urls.add_argument('--all', action='store_true', help='Include expired URLs')
+    commands.add_parser('stats', help='Number of indexed files, events, tokens and URLs')
+
+    args = parser.parse_args()
+    index = LogcatIndex(args.db)
+
+    try:
+        if args.command == 'update':
+            start = time.time()
+            counts = index.update(args.paths)
+            print_counts(counts)
+            print(f"Indexed in {time.time() - start:.2f}s")
+
+        elif args.command == 'follow':
+            print(f"Following {', '.join(args.paths)} (Ctrl+C to stop)")
+            try:
+                follow(index, args.paths, args.interval)
+            except KeyboardInterrupt:
+                print("\nStopped")
+
+        elif args.command == 'token':
+            print(f"access-token: {index.latest_token() or 'none found'}")
+            print(f"device_id:    {index.device_id() or 'none found'}")
+
+        elif args.command == 'scans':
+            rows = index.scans(args.craftie)
+            for line_time, craftie_uuid, psyid, path in rows:
+                print(f"  {line_time or '?':26} {craftie_uuid} {psyid}  ({os.path.basename(path)})")
+            print(f"{len(rows)} scans")
+
+        elif args.command == 'urls':
+            audio_urls = index.audio_urls(None if args.all else URL_EXPIRY_MARGIN)
+            for audio_id, url in sorted(audio_urls.items()):
+                print(f"  {audio_id:>8} {url}")
+            print(f"{len(audio_urls)} audio URLs{'' if args.all else ' still valid'}")
+
+        elif args.command == 'stats':
+            for table, count in index.stats().items():
+                print(f"  {table:8} {count}")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Craftie Mirror - download the audio of every craftie bound to a device
+Runs get_bound_crafties -> get_craftie_playlist -> get_audio_stream_url -> download as an asyncio
+pipeline with bounded concurrency per stage, on StorypodAPI's pooled session
+Files land in the SD card layout (<out>/craftie/EN/<UUID>/<AUDIO_ID>.abc) so decrypt_crafties.py -r works on it
+
+Usage: python mirror_crafties.py --token <ACCESS_TOKEN> --device-id <DEVICE_UUID> --firmware <VERSION> [-o mirror]
+       python mirror_crafties.py --logcat-index logcat_index.db --firmware <VERSION>
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from storypod import StorypodAPI, ResponseCache
+from logcat_index import LogcatIndex
+
+CRAFTIE_UUID_PATTERN = re.compile(r'^\d{12}$')
+
+def find_values(obj, predicate):
+    """All strings/numbers in a decoded JSON response matching predicate, in document order
+
+    The response layouts aren't documented, so fields are found by their shape rather than their path.
+    """
+    found = []
+    if isinstance(obj, dict):
+        for value in obj.values():
+            found.extend(find_values(value, predicate))
+    elif isinstance(obj, list):
+        for value in obj:
+            found.extend(find_values(value, predicate))
+    elif isinstance(obj, (str, int)) and not isinstance(obj, bool) and predicate(str(obj)):
+        found.append(str(obj))
+    return found
+
+def bound_craftie_uuids(response):
+    """Craftie UUIDs (12 digits, e.g. 010000010004) in a craftielist response"""
+    return list(dict.fromkeys(find_values(response, CRAFTIE_UUID_PATTERN.match)))
+
+def audio_stream_url(response):
+    """First http(s) URL in a playurl response"""
+    urls = find_values(response, lambda value: value.startswith(('http://', 'https://')))
+    return urls[0] if urls else None
+
+class CraftieMirror:
+    """Pipeline state: per-stage semaphores and counters"""
+
+    def __init__(self, api, output_dir, language='EN', playlist_jobs=4, url_jobs=8, download_jobs=8, logged_urls=None):
+        self.api = api
+        self.logged_urls = logged_urls or {}  # audio id -> still valid signed URL from the device logs
+        self.output_dir = output_dir
+        self.language = language
+        self.playlist_slots = asyncio.Semaphore(playlist_jobs)
+        self.url_slots = asyncio.Semaphore(url_jobs)
+        self.download_slots = asyncio.Semaphore(download_jobs)
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.from_logs = 0
+        self.bytes = 0
+
+    async def call(self, func, *args):
+        """Run a blocking StorypodAPI call on a worker thread"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def mirror_craftie(self, craftie_uuid):
+        async with self.playlist_slots:
+            try:
+                audio_ids = await self.call(self.api.get_craftie_playlist, craftie_uuid)
+            except Exception as e:
+                print(f"Error: playlist of {craftie_uuid}: {e}", file=sys.stderr)
+                self.failed += 1
+                return
+
+        folder = os.path.join(self.output_dir, 'craftie', self.language, craftie_uuid)
+        os.makedirs(folder, exist_ok=True)
+        print(f"{craftie_uuid}: {len(audio_ids)} audio files")
+
+        await asyncio.gather(*(self.mirror_audio(craftie_uuid, audio_id, folder) for audio_id in audio_ids))
+
+    async def mirror_audio(self, craftie_uuid, audio_id, folder):
+        destination = os.path.join(folder, f"{audio_id}.abc")
+        if os.path.exists(destination):
+            self.skipped += 1
+            return
+
+        # A URL the device already got signed saves the stream URL request (if it still works)
+        logged_url = self.logged_urls.get(str(audio_id))
+        if logged_url and await self.download(logged_url, destination, f"{craftie_uuid}/{audio_id}", quiet=True):
+            self.from_logs += 1
+            return
+
+        async with self.url_slots:
+            try:
+                url = audio_stream_url(await self.call(self.api.get_audio_stream_url, audio_id, craftie_uuid))
+            except Exception as e:
+                print(f"Error: stream URL of {craftie_uuid}/{audio_id}: {e}", file=sys.stderr)
+                url = None
+        if url is None:
+            self.failed += 1
+            return
+
+        # Signed URLs expire, so each is used right after it is issued
+        if not await self.download(url, destination, f"{craftie_uuid}/{audio_id}"):
+            self.failed += 1
+
+    async def download(self, url, destination, name, quiet=False):
+        """Download one file, returns whether it worked"""
+        async with self.download_slots:
+            try:
+                received = await self.call(self.api.download_audio_resumable, url, destination)
+            except Exception as e:
+                if not quiet:
+                    print(f"Error: download of {name}: {e}", file=sys.stderr)
+                return False
+
+        self.downloaded += 1
+        # Only what came over the wire, a resumed .part was counted by the run that fetched it
+        self.bytes += received
+        print(f"  {name}.abc ({os.path.getsize(destination)} bytes)")
+        return True
+
+    async def run(self, firmware, craftie_uuids=None):
+        if not craftie_uuids:
+            craftie_uuids = bound_craftie_uuids(await self.call(self.api.get_bound_crafties, firmware))
+        print(f"Bound crafties: {len(craftie_uuids)}")
+
+        await asyncio.gather(*(self.mirror_craftie(craftie_uuid) for craftie_uuid in craftie_uuids))
+
+async def run_mirror(api, args, pool_size, logged_urls=None):
+    """Run the mirror pipeline, returns the CraftieMirror with its counters"""
+    # Size the default executor to the connection pool so every stage slot gets a thread
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=pool_size))
+
+    mirror = CraftieMirror(api, args.output_dir, playlist_jobs=args.playlist_jobs,
+                           url_jobs=args.url_jobs, download_jobs=args.download_jobs, logged_urls=logged_urls)
+    await mirror.run(args.firmware, args.craftie)
+    return mirror
+
+def main():
+    """Mirror every bound craftie's audio into an SD card style tree"""
+
+    parser = argparse.ArgumentParser(description='Concurrent mirror of all bound crafties\' audio')
+    parser.add_argument('--token', help='Device access token (default: the newest one in --logcat-index)')
+    parser.add_argument('--device-id', help='Device UUID (default: the newest one in --logcat-index)')
+    parser.add_argument('--firmware', required=True, help='Firmware version to report')
+    parser.add_argument('-o', '--output-dir', default='mirror', help='Output tree (default: mirror)')
+    parser.add_argument('--craftie', action='append', help='Only mirror this craftie UUID (repeatable)')
+    parser.add_argument('--playlist-jobs', type=int, default=4, help='Concurrent playlist requests (default: 4)')
+    parser.add_argument('--url-jobs', type=int, default=8, help='Concurrent stream URL requests (default: 8)')
+    parser.add_argument('--download-jobs', type=int, default=8, help='Concurrent downloads (default: 8)')
+    parser.add_argument('--response-cache', default='storypod_cache.json',
+                        help='Cache of craftie list/playlist responses (default: storypod_cache.json, "" to disable)')
+    parser.add_argument('--logcat-index', help='logcat_index.py database: token, device id and signed URLs from the device logs')
+
+    args = parser.parse_args()
+
+    logged_urls = {}
+    if args.logcat_index:
+        index = LogcatIndex(args.logcat_index)
+        args.token = args.token or index.latest_token()
+        args.device_id = args.device_id or index.device_id()
+        logged_urls = index.audio_urls()
+        index.close()
+    if not args.token or not args.device_id:
+        parser.error('--token and --device-id are required (or a --logcat-index that has them)')
+
+    print("="*80)
+    print("CRAFTIE MIRROR")
+    print("="*80)
+
+    start_time = time.time()
+    pool_size = args.playlist_jobs + args.url_jobs + args.download_jobs
+
+    cache = ResponseCache(args.response_cache) if args.response_cache else None
+
+    with StorypodAPI(args.token, args.device_id, pool_size=pool_size, cache=cache) as api:
+        try:
+            mirror = asyncio.run(run_mirror(api, args, pool_size, logged_urls))
+        except KeyboardInterrupt:
+            print("\nInterrupted - partial downloads are kept as .part and resumed on the next run")
+            return
+
+        total_time = time.time() - start_time
+        print(f"\nDownloaded: {mirror.downloaded} files ({mirror.bytes / 1e6:.1f} MB) in {total_time:.1f}s")
+        print(f"Skipped (already on disk): {mirror.skipped}")
+        if logged_urls:
+            print(f"Downloaded with signed URLs from the logs: {mirror.from_logs}")
+        print(f"Failed: {mirror.failed}")
+        if cache is not None:
+            print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+        print("\nAPI latency:")
+        api.print_latency()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Capture URL Extractor - audiocnd request URLs straight from pcap / pcapng files, no tshark needed
+Memory-maps each capture and walks it packet by packet: Ethernet / Linux cooked / raw IP, IPv4 and IPv6,
+then TCP to port 80, reassembling just enough of each flow to read the HTTP request heads.
+New URLs go straight to a pool of download threads (same headers and processed_urls.txt as
+intercept_crafties.sh)
+
+Usage: python pcap_urls.py capture.pcapng [more captures...] [-o downloads] [--list]
+"""
+
+import os
+import sys
+import time
+import struct
+import argparse
+import urllib.request
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import decrypt_crafties
+
+AUDIO_HOST = 'audiocnd.storypod.com'
+PROCESSED_URLS_FILENAME = 'processed_urls.txt'
+DOWNLOAD_HEADERS = {'User-Agent': 'Allwinner/CedarX 2.7', 'Range': 'bytes=0-', 'Connection': 'close'}
+DOWNLOAD_BLOCK_SIZE = 256 * 1024
+
+# Capture formats: pcap magic (either byte order, micro or nanosecond timestamps), pcapng section header
+PCAP_MAGICS = {b'\xd4\xc3\xb2\xa1': '<', b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>', b'\xa1\xb2\x3c\x4d': '>'}
+PCAPNG_SECTION = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+
+# Link types (www.tcpdump.org/linktypes.html)
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 14, 101, 228, 229)
+LINKTYPE_LINUX_SLL = 113      # tcpdump -i any
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPV6_EXTENSION_HEADERS = (0, 43, 60)  # hop-by-hop, routing, destination options
+IP_PROTO_TCP = 6
+
+TCP_FIN, TCP_SYN, TCP_RST = 0x01, 0x02, 0x04
+SEQ_MASK = 0xFFFFFFFF
+MAX_REQUEST_HEAD = 16 * 1024  # Same limit as serve_crafties.py
+MAX_AHEAD_SEGMENTS = 64       # Out-of-order segments kept per flow before a gap is given up on
+MAX_FLOWS = 65536
+
+def iter_packets(data):
+    """Yield (link type, offset, captured length) of every packet in a pcap or pcapng capture
+
+    A capture that ends mid-packet (still being written, or cut) ends the iteration there.
+    """
+    magic = bytes(data[:4])
+    if magic in PCAP_MAGICS:
+        endian = PCAP_MAGICS[magic]
+        linktype = struct.unpack_from(endian + 'I', data, 20)[0] & 0x0FFFFFFF
+        record = struct.Struct(endian + '8xII')
+        offset = 24
+        while offset + 16 <= len(data):
+            caplen, length = record.unpack_from(data, offset)
+            offset += 16
+            if offset + caplen > len(data):
+                return
+            yield linktype, offset, caplen
+            offset += caplen
+
+    elif magic == PCAPNG_SECTION:
+        endian = '<'
+        interfaces = []
+        offset = 0
+        while offset + 12 <= len(data):
+            if bytes(data[offset:offset + 4]) == PCAPNG_SECTION:
+                # Section header: byte order, and a new set of interfaces
+                endian = '<' if struct.unpack_from('<I', data, offset + 8)[0] == PCAPNG_BYTE_ORDER else '>'
+                interfaces = []
+            block_type, block_length = struct.unpack_from(endian + 'II', data, offset)
+            if block_length < 12 or offset + block_length > len(data):
+                return
+
+            if block_type == 1:    # Interface description
+                interfaces.append(struct.unpack_from(endian + 'H', data, offset + 8)[0])
+            elif block_type == 6:  # Enhanced packet
+                interface, caplen = struct.unpack_from(endian + 'I8xI', data, offset + 8)
+                if interface < len(interfaces):
+                    yield interfaces[interface], offset + 28, min(caplen, block_length - 32)
+            elif block_type == 3:  # Simple packet (interface 0)
+                length = struct.unpack_from(endian + 'I', data, offset + 8)[0]
+                if interfaces:
+                    yield interfaces[0], offset + 12, min(length, block_length - 16)
+            elif block_type == 2:  # Obsolete packet block
+                interface, caplen = struct.unpack_from(endian + 'H10xI', data, offset + 8)
+                if interface < len(interfaces):
+                    yield interfaces[interface], offset + 28, min(caplen, block_length - 32)
+            offset += block_length
+
+    else:
+        raise ValueError('not a pcap or pcapng capture')
+
+def ip_offset(data, linktype, offset, length):
+    """Offset of the IP header in a packet, or None for other link layer payloads"""
+    if linktype == LINKTYPE_ETHERNET:
+        if length < 14:
+            return None
+        ethertype = struct.unpack_from('>H', data, offset + 12)[0]
+        header = 14
+        while ethertype in ETHERTYPE_VLAN and header + 4 <= length:
+            ethertype = struct.unpack_from('>H', data, offset + header + 2)[0]
+            header += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if length < 16:
+            return None
+        ethertype = struct.unpack_from('>H', data, offset + 14)[0]
+        header = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if length < 20:
+            return None
+        ethertype = struct.unpack_from('>H', data, offset)[0]
+        header = 20
+    elif linktype == LINKTYPE_NULL or linktype in LINKTYPE_RAW:
+        # Loopback's 4 byte family field is in the capturing host's byte order, the IP version says it all
+        header = 4 if linktype == LINKTYPE_NULL else 0
+        if length <= header:
+            return None
+        ethertype = {4: ETHERTYPE_IPV4, 6: ETHERTYPE_IPV6}.get(data[offset + header] >> 4)
+    else:
+        return None
+
+    return offset + header if ethertype in (ETHERTYPE_IPV4, ETHERTYPE_IPV6) else None
+
+def tcp_segment(data, ip, end, ports):
+    """(flow key, seq, flags, payload start, payload end) of a TCP segment to one of ports, or None"""
+    if ip + 20 > end:
+        return None
+
+    version = data[ip] >> 4
+    if version == 4:
+        header = (data[ip] & 0x0F) * 4
+        total_length, fragment, protocol = struct.unpack_from('>H2xH1xB', data, ip + 2)
+        if protocol != IP_PROTO_TCP or fragment & 0x3FFF:  # Fragments never carry a request head here
+            return None
+        addresses = bytes(data[ip + 12:ip + 20])
+        end = min(end, ip + total_length)
+        tcp = ip + header
+    elif version == 6:
+        if ip + 40 > end:
+            return None
+        payload_length, next_header = struct.unpack_from('>HB', data, ip + 4)
+        addresses = bytes(data[ip + 8:ip + 40])
+        end = min(end, ip + 40 + payload_length)
+        tcp = ip + 40
+        while next_header in IPV6_EXTENSION_HEADERS and tcp + 8 <= end:
+            next_header = data[tcp]
+            tcp += (data[tcp + 1] + 1) * 8
+        if next_header != IP_PROTO_TCP:
+            return None
+    else:
+        return None
+
+    if tcp + 20 > end:
+        return None
+    source_port, destination_port, seq, header_flags = struct.unpack_from('>HHI4xH', data, tcp)
+    if destination_port not in ports:
+        return None
+
+    payload = tcp + (header_flags >> 12) * 4
+    return (addresses, source_port, destination_port), seq, header_flags & 0x3F, payload, end
+
+class TCPFlow:
+    """Client-to-server byte stream of one connection, reassembled only as far as request heads need"""
+
+    def __init__(self, seq):
+        self.next_seq = seq
+        self.buf = bytearray()
+        self.ahead = {}       # seq -> payload received before the bytes in front of it
+        self.skip = 0         # Request body bytes still to drop
+
+    def add(self, seq, payload):
+        """Add a segment, returns whether the stream grew"""
+        diff = (seq - self.next_seq) & SEQ_MASK
+        if diff >= 1 << 31:
+            # Retransmission: keep only what is new
+            overlap = (self.next_seq - seq) & SEQ_MASK
+            if overlap >= len(payload):
+                return False
+            payload = payload[overlap:]
+        elif diff:
+            self.ahead[seq] = payload
+            if len(self.ahead) > MAX_AHEAD_SEGMENTS:
+                # The missing segment isn't in the capture: continue after the gap
+                self.next_seq = min(self.ahead, key=lambda s: (s - self.next_seq) & SEQ_MASK)
+                self.buf.clear()
+                self.skip = 0
+                payload = self.ahead.pop(self.next_seq)
+            else:
+                return False
+
+        self.append(payload)
+        while self.next_seq in self.ahead:
+            self.append(self.ahead.pop(self.next_seq))
+        return True
+
+    def append(self, payload):
+        self.next_seq = (self.next_seq + len(payload)) & SEQ_MASK
+        if self.skip:
+            dropped = min(self.skip, len(payload))
+            self.skip -= dropped
+            payload = payload[dropped:]
+        self.buf += payload
+
+    def requests(self):
+        """Yield (method, target, headers) of every complete request head in the stream"""
+        while True:
+            end = self.buf.find(b'\r\n\r\n')
+            if end == -1:
+                if len(self.buf) > MAX_REQUEST_HEAD:
+                    self.buf.clear()  # Not HTTP, or the capture started mid-body
+                return
+
+            lines = self.buf[:end].decode('latin-1').split('\r\n')
+            del self.buf[:end + 4]
+
+            parts = lines[0].split(' ')
+            if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+                continue
+            headers = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(':')
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+
+            body = headers.get('content-length', '0')
+            if body.isdigit() and int(body):
+                dropped = min(int(body), len(self.buf))
+                del self.buf[:dropped]
+                self.skip = int(body) - dropped
+
+            yield parts[0], parts[1], headers
+
+def request_url(target, headers):
+    """Full URL of a request: absolute-form targets as they are, else http://<Host><target>"""
+    if target.startswith(('http://', 'https://')):
+        return target
+    host = headers.get('host', '')
+    if host.endswith(':80'):
+        host = host[:-3]
+    return f"http://{host}{target}" if host else None
+
+class RequestExtractor:
+    """Streams captures and reports each new request URL to a host, once"""
+
+    def __init__(self, host=AUDIO_HOST, ports=(80,), seen=None):
+        self.host = host.lower() if host else None
+        self.ports = frozenset(ports)
+        self.flows = {}
+        self.seen = set(seen or ())
+        self.packets = 0
+        self.bytes = 0
+        self.requests = 0
+
+    def matches(self, url):
+        return self.host is None or (urlsplit(url).hostname or '').lower() == self.host
+
+    def extract(self, data):
+        """Yield new request URLs of one capture (bytes or mmap)"""
+        flows = self.flows
+        for linktype, offset, length in iter_packets(data):
+            self.packets += 1
+            self.bytes += length
+
+            ip = ip_offset(data, linktype, offset, length)
+            if ip is None:
+                continue
+            segment = tcp_segment(data, ip, offset + length, self.ports)
+            if segment is None:
+                continue
+            key, seq, flags, start, end = segment
+
+            flow = flows.get(key)
+            if flow is None or flags & TCP_SYN:
+                if len(flows) >= MAX_FLOWS:
+                    del flows[next(iter(flows))]
+                flow = flows[key] = TCPFlow((seq + 1) & SEQ_MASK if flags & TCP_SYN else seq)
+
+            if end > start and flow.add(seq, bytes(data[start:end])):
+                for method, target, headers in flow.requests():
+                    self.requests += 1
+                    url = request_url(target, headers)
+                    if url and url not in self.seen and self.matches(url):
+                        self.seen.add(url)
+                        yield url
+
+            if flags & (TCP_FIN | TCP_RST):
+                flows.pop(key, None)
+
+def audio_filename(url):
+    """<ID>.mp3 of an /audios/<ID>.mp3 URL, None for other URLs"""
+    directory, _, filename = urlsplit(url).path.rpartition('/')
+    return filename if directory.endswith('/audios') and filename.endswith('.mp3') else None
+
+def download_url(url, output_dir):
+    """Download an audio URL into output_dir (via a .part file), returns (url, path or None, error)"""
+    filename = audio_filename(url)
+    if filename is None:
+        return url, None, 'not an audio URL'
+    destination = os.path.join(output_dir, filename)
+    part_path = destination + '.part'
+
+    try:
+        request = urllib.request.Request(url, headers=DOWNLOAD_HEADERS)
+        with urllib.request.urlopen(request, timeout=30) as response, open(part_path, 'wb') as f:
+            while True:
+                block = response.read(DOWNLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                f.write(block)
+        os.replace(part_path, destination)
+    except OSError as e:  # URLError and HTTPError included
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return url, None, str(e)
+    return url, destination, None
+
+def load_processed(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(line.strip() for line in f if line.strip())
+
+def main():
+    """Extract (and download) audiocnd URLs from capture files"""
+
+    parser = argparse.ArgumentParser(description='HTTP request URLs from pcap/pcapng captures, without tshark')
+    parser.add_argument('captures', nargs='+', help='pcap or pcapng files')
+    parser.add_argument('-o', '--output-dir', default='downloads', help='Download directory (default: downloads)')
+    parser.add_argument('--list', action='store_true', help='Only print the URLs, download nothing')
+    parser.add_argument('--host', default=AUDIO_HOST, help=f"Host whose requests are extracted (default: {AUDIO_HOST}, "
+                                                          f"'' for all)")
+    parser.add_argument('--port', type=int, action='append', help='Server port (repeatable, default: 80)')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Parallel downloads (default: 4)')
+
+    args = parser.parse_args()
+
+    print("="*80)
+    print("CAPTURE URL EXTRACTOR")
+    print("="*80)
+
+    processed_path = os.path.join(args.output_dir, PROCESSED_URLS_FILENAME)
+    if not args.list:
+        os.makedirs(args.output_dir, exist_ok=True)
+    seen = set() if args.list else load_processed(processed_path)
+    extractor = RequestExtractor(args.host or None, args.port or [80], seen)
+
+    start_time = time.time()
+    new_urls = 0
+    downloads = []
+    pool = None if args.list else ThreadPoolExecutor(max_workers=args.jobs)
+    processed = None if args.list else open(processed_path, 'a')
+
+    try:
+        for capture in args.captures:
+            print(f"Reading {capture}")
+            try:
+                with decrypt_crafties.map_file(capture) as data:
+                    for url in extractor.extract(data):
+                        new_urls += 1
+                        print(f"  {url}")
+                        if pool is not None:
+                            processed.write(url + '\n')
+                            processed.flush()
+                            if audio_filename(url):
+                                downloads.append(pool.submit(download_url, url, args.output_dir))
+            except (OSError, ValueError) as e:
+                print(f"Error: {capture}: {e}", file=sys.stderr)
+        elapsed = time.time() - start_time
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+            processed.close()
+
+    print(f"\n{extractor.packets} packets ({extractor.bytes / 1e6:.1f} MB) in {elapsed:.1f}s "
+          f"({extractor.bytes / 1e6 / elapsed if elapsed else 0:.1f} MB/s), {extractor.requests} HTTP requests")
+    print(f"New URLs: {new_urls}")
+
+    if downloads:
+        failed = 0
+        for future in downloads:
+            url, path, error = future.result()
+            if error:
+                failed += 1
+                print(f"✗ Failed to download {url}: {error}")
+        print(f"Downloaded: {len(downloads) - failed}/{len(downloads)} to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
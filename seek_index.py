@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+MP3 Seek Index - precomputed frame table sidecars for byte-accurate seeking
+Walks the frames of a decrypted .mp3 (or an .abc with its XOR key) once and writes <file>.seek:
+the offset and starting sample of every frame, so time->byte and byte->time are a binary search
+
+Usage: python seek_index.py <file_or_dir> [--key 0x5C]
+       python seek_index.py <file> --time 93.5 | --byte 1048576
+"""
+
+import os
+import sys
+import struct
+import argparse
+from array import array
+from bisect import bisect_right
+
+import decrypt_crafties
+
+SEEK_INDEX_SUFFIX = '.seek'
+SEEK_INDEX_MAGIC = b'CSIX'
+SEEK_INDEX_VERSION = 1
+
+# magic, version, key, sample_rate, frames, source size, source mtime, total samples
+SEEK_INDEX_HEADER = struct.Struct('<4sHHIIQQQ')
+
+def uint32_array(values=()):
+    """array of unsigned 32 bit ints (the typecode depends on the platform's int size)"""
+    return array('I' if array('I').itemsize == 4 else 'L', values)
+
+class FrameTableWalker(decrypt_crafties.MP3FrameWalker):
+    """MP3FrameWalker that records every confirmed frame's offset and starting sample"""
+
+    def __init__(self):
+        super().__init__()
+        self.offsets = uint32_array()
+        self.start_samples = uint32_array()
+
+    def commit(self, offset, header):
+        self.offsets.append(offset)
+        self.start_samples.append(self.samples)
+        super().commit(offset, header)
+
+class SeekIndex:
+    """Frame table of one audio file with O(log n) time/byte lookups"""
+
+    def __init__(self, offsets, start_samples, sample_rate, total_samples, source_size=0, source_mtime=0, key=0):
+        self.offsets = offsets
+        self.start_samples = start_samples
+        self.sample_rate = sample_rate
+        self.total_samples = total_samples
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+        self.key = key
+
+    @property
+    def frames(self):
+        return len(self.offsets)
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sample_rate if self.sample_rate else 0.0
+
+    def time_to_byte(self, seconds):
+        """Offset of the frame playing at the given time (clamped to the first/last frame)"""
+        if not self.offsets:
+            return 0
+        sample = int(seconds * self.sample_rate)
+        i = max(bisect_right(self.start_samples, sample) - 1, 0)
+        return self.offsets[i]
+
+    def byte_to_time(self, offset):
+        """Start time in seconds of the frame containing the given byte offset"""
+        if not self.offsets:
+            return 0.0
+        i = max(bisect_right(self.offsets, offset) - 1, 0)
+        return self.start_samples[i] / self.sample_rate
+
+    def is_current(self, source_path, xor_key=None):
+        """Whether the index still matches its source file (and xor_key, unless None)"""
+        if xor_key is not None and xor_key != self.key:
+            return False
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return False
+        return stat.st_size == self.source_size and int(stat.st_mtime) == self.source_mtime
+
+    def save(self, path):
+        """Write the sidecar atomically (little-endian regardless of platform)"""
+        offsets, start_samples = uint32_array(self.offsets), uint32_array(self.start_samples)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            start_samples.byteswap()
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SEEK_INDEX_HEADER.pack(SEEK_INDEX_MAGIC, SEEK_INDEX_VERSION, self.key, self.sample_rate,
+                                           self.frames, self.source_size, self.source_mtime, self.total_samples))
+            f.write(offsets.tobytes())
+            f.write(start_samples.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a sidecar written by save(), raises ValueError if it isn't one"""
+        with open(path, 'rb') as f:
+            header = f.read(SEEK_INDEX_HEADER.size)
+            if len(header) < SEEK_INDEX_HEADER.size:
+                raise ValueError(f"{path}: truncated seek index")
+            (magic, version, key, sample_rate, frames,
+             source_size, source_mtime, total_samples) = SEEK_INDEX_HEADER.unpack(header)
+            if magic != SEEK_INDEX_MAGIC or version != SEEK_INDEX_VERSION:
+                raise ValueError(f"{path}: not a seek index (or unsupported version)")
+
+            offsets, start_samples = uint32_array(), uint32_array()
+            try:
+                offsets.fromfile(f, frames)
+                start_samples.fromfile(f, frames)
+            except EOFError:
+                raise ValueError(f"{path}: truncated seek index")
+
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            start_samples.byteswap()
+
+        return cls(offsets, start_samples, sample_rate, total_samples, source_size, source_mtime, key)
+
+def seek_index_path(source_path):
+    return source_path + SEEK_INDEX_SUFFIX
+
+def build_seek_index(source_path, xor_key=0, block_size=decrypt_crafties.STREAM_BLOCK_SIZE):
+    """Walk every frame of source_path (decrypting with xor_key) in one streaming pass"""
+    walker = FrameTableWalker()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+
+    with open(source_path, 'rb') as f:
+        while True:
+            length = f.readinto(buffer)
+            if not length:
+                break
+            block = view[:length]
+            if xor_key:
+                decrypt_crafties.apply_pure_xor_inplace(block, xor_key)
+            walker.update(block)
+
+    stat = os.stat(source_path)
+    sample_rate = walker.first_header['sample_rate'] if walker.first_header else 0
+    return SeekIndex(walker.offsets, walker.start_samples, sample_rate, walker.samples,
+                     stat.st_size, int(stat.st_mtime), xor_key)
+
+def load_or_build(source_path, xor_key=None, rebuild=False):
+    """Seek index of source_path from its sidecar, (re)building the sidecar if missing or stale
+
+    xor_key only applies to .abc files (plain .mp3 files always use 0); a sidecar built
+    with a different key is stale. For .abc files without an xor_key the key is recovered
+    with discover_xor_key. Returns None if no key could be found.
+    """
+    index_path = seek_index_path(source_path)
+    if not source_path.lower().endswith('.abc'):
+        xor_key = 0
+
+    if not rebuild and os.path.exists(index_path):
+        try:
+            index = SeekIndex.load(index_path)
+            if index.is_current(source_path, xor_key):
+                return index
+        except (OSError, ValueError) as e:
+            print(f"Warning: rebuilding {index_path}: {e}")
+
+    if xor_key is None:
+        candidates = decrypt_crafties.discover_xor_key(source_path)
+        if not candidates:
+            return None
+        xor_key = candidates[0][0]
+
+    index = build_seek_index(source_path, xor_key)
+    index.save(index_path)
+    return index
+
+def iter_audio_files(path):
+    """The .abc/.mp3 files at path (a file, or a directory searched recursively)"""
+    if os.path.isfile(path):
+        yield path
+        return
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d not in decrypt_crafties.CARD_SKIP_DIRS)
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in ('.abc', '.mp3'):
+                yield os.path.join(dirpath, filename)
+
+def main():
+    """Build seek index sidecars, or look up a time/byte offset in one"""
+
+    parser = argparse.ArgumentParser(description='Precomputed MP3 frame seek index sidecars')
+    parser.add_argument('path', help='Audio file, or directory to index recursively')
+    parser.add_argument('--key', type=lambda value: int(value, 0),
+                        help='XOR key of the .abc file(s), not applied to .mp3 (default: recover it with discover_xor_key)')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild sidecars even if they are current')
+    lookup = parser.add_mutually_exclusive_group()
+    lookup.add_argument('--time', type=float, help='Print the byte offset of the frame playing at this time (seconds)')
+    lookup.add_argument('--byte', type=int, help='Print the start time of the frame containing this byte offset')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"Error: Path '{args.path}' does not exist!")
+        return
+
+    decrypt_crafties.set_output_mode('quiet')
+
+    if args.time is not None or args.byte is not None:
+        index = load_or_build(args.path, args.key, args.rebuild)
+        if index is None:
+            print(f"Error: no XOR key found for {args.path}")
+            return
+        if args.time is not None:
+            print(index.time_to_byte(args.time))
+        else:
+            print(f"{index.byte_to_time(args.byte):.3f}")
+        return
+
+    total_frames = 0
+    for source_path in iter_audio_files(args.path):
+        index = load_or_build(source_path, args.key, args.rebuild)
+        if index is None:
+            print(f"  {source_path:50} -> NO KEY FOUND")
+            continue
+        total_frames += index.frames
+        print(f"  {source_path:50} -> {index.frames} frames, {index.duration:.1f}s, "
+              f"{os.path.getsize(seek_index_path(source_path))} byte index")
+
+    print(f"\nIndexed {total_frames} frames")
+
+if __name__ == "__main__":
+    main()
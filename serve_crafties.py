@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Craftie Audio Server - local stand-in for audiocnd.storypod.com
+Serves /audios/<ID>.mp3 from a library of encrypted .abc files (decrypted on the fly with the
+recovered XOR key) or plain .mp3 files, with HTTP Range, keep-alive and an LRU cache of hot files
+
+Point audiocnd.storypod.com at this machine (DNS) and the Storypod plays whatever it serves
+Usage: python serve_crafties.py <library_dir> [--port 80] [--cache-mb 256]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+import decrypt_crafties
+
+LIBRARY_EXTENSIONS = ['.abc', '.mp3']
+SERVE_BLOCK_SIZE = 256 * 1024
+MAX_REQUEST_HEAD = 16 * 1024
+KEEPALIVE_TIMEOUT = 15
+HOT_FILE_HITS = 2  # a file is cached in memory from its second request on
+KEY_CACHE_SAVE_BATCH = 32  # recovered keys between key cache saves (it is also saved on shutdown)
+
+HTTP_REASONS = {
+    200: 'OK',
+    206: 'Partial Content',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    416: 'Range Not Satisfiable',
+    500: 'Internal Server Error',
+}
+
+def parse_range(header, size):
+    """Parse a single 'bytes=' Range header, returns (start, end) inclusive, None for the whole file
+
+    A malformed header is ignored (None, as RFC 9110 asks); ValueError is only raised for a
+    well-formed range that can't be satisfied. Multi-range requests are answered with their
+    first range (the device only ever sends 'bytes=N-').
+    """
+    if not header:
+        return None
+
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    first, sep, last = spec.split(',')[0].strip().partition('-')
+    first, last = first.strip(), last.strip()
+    if not sep or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+
+    return start, min(int(last), size - 1) if last else size - 1
+
+class HotFileCache:
+    """LRU cache of decrypted file contents bounded by total bytes"""
+
+    def __init__(self, max_bytes, max_file_bytes):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        data = self.entries.get(path)
+        if data is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(path)
+        self.hits += 1
+        return data
+
+    def put(self, path, data):
+        if len(data) > self.max_file_bytes or len(data) > self.max_bytes:
+            return
+        if path in self.entries:
+            self.size -= len(self.entries.pop(path))
+        self.entries[path] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            old_path, old_data = self.entries.popitem(last=False)
+            self.size -= len(old_data)
+
+class LibraryEntry:
+    """One servable file as it was on disk (size, mtime) and, for .abc files, the XOR key once recovered"""
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.version = (stat.st_size, stat.st_mtime_ns)
+        self.encrypted = path.lower().endswith('.abc')
+        self.key = None if self.encrypted else 0
+        self.key_lock = None  # created on the event loop by AudioServer.ensure_key
+        self.requests = 0
+
+    @property
+    def size(self):
+        return self.version[0]
+
+    @property
+    def cache_key(self):
+        """Hot cache key: a replaced file never hits the old file's contents"""
+        return (self.path,) + self.version
+
+    def matches(self, stat):
+        return (stat.st_size, stat.st_mtime_ns) == self.version
+
+class AudioLibrary:
+    """Maps audio IDs (file names without extension) to files under a library directory"""
+
+    def __init__(self, root, key_cache=None):
+        self.root = root
+        self.key_cache = key_cache
+        self.entries = {}
+        self.last_scan = 0
+        self.rescan = None  # future of a rescan in progress
+        self.key_cache_lock = threading.Lock()  # keys are recovered on executor threads
+        self.unsaved_keys = 0
+
+    def scan(self):
+        """Index every .abc/.mp3 under root; plain .mp3 wins over .abc with the same ID
+
+        Entries (with their recovered keys) are kept for files that are unchanged on disk.
+        """
+        entries = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in decrypt_crafties.CARD_SKIP_DIRS]
+            for filename in filenames:
+                audio_id, ext = os.path.splitext(filename)
+                if ext.lower() not in LIBRARY_EXTENSIONS:
+                    continue
+                if audio_id in entries and ext.lower() == '.abc':
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                existing = self.entries.get(audio_id)
+                if existing and existing.path == path and existing.matches(stat):
+                    entries[audio_id] = existing
+                else:
+                    entries[audio_id] = LibraryEntry(path, stat)
+
+        self.entries = entries
+        self.last_scan = time.time()
+        return len(entries)
+
+    async def lookup(self, audio_id):
+        """Entry for audio_id, rescanning (at most once a second, off the event loop) for files
+        added since startup; concurrent misses wait for the same rescan"""
+        entry = self.entries.get(audio_id)
+        if entry is None and (self.rescan is not None or time.time() - self.last_scan > 1):
+            if self.rescan is None:
+                self.rescan = asyncio.get_running_loop().run_in_executor(None, self.scan)
+                self.rescan.add_done_callback(lambda done: setattr(self, 'rescan', None))
+            try:
+                await asyncio.shield(self.rescan)
+            except OSError as e:
+                print(f"Error rescanning {self.root}: {e}", file=sys.stderr)
+            entry = self.entries.get(audio_id)
+        return entry
+
+    def refresh(self, entry):
+        """The entry for entry's file as it is on disk now: entry itself if unchanged, a new one
+        (without a key) if the file was replaced, None if it is gone"""
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            return None
+        if entry.matches(stat):
+            return entry
+
+        fresh = LibraryEntry(entry.path, stat)
+        audio_id = os.path.splitext(os.path.basename(entry.path))[0]
+        if self.entries.get(audio_id) is entry:
+            self.entries[audio_id] = fresh
+        return fresh
+
+    def recover_key(self, entry):
+        """Recover an .abc file's key (blocking), using and updating the key cache"""
+        fingerprint = decrypt_crafties.file_fingerprint(entry.path)
+        folder = decrypt_crafties.craftie_folder(entry.path)
+        with self.key_cache_lock:
+            hint_keys = self.key_cache.hint_keys(fingerprint, folder) if self.key_cache else None
+
+        candidates = decrypt_crafties.discover_xor_key(entry.path, hint_keys=hint_keys)
+        if not candidates:
+            return None
+
+        key = candidates[0][0]
+        if self.key_cache is not None:
+            with self.key_cache_lock:
+                self.key_cache.store(fingerprint, folder, key)
+                self.unsaved_keys += 1
+                if self.unsaved_keys >= KEY_CACHE_SAVE_BATCH:
+                    self.save_key_cache()
+        return key
+
+    def save_key_cache(self):
+        """Write keys recovered since the last save (callers hold key_cache_lock, or are the only thread left)"""
+        if self.key_cache is None or not self.unsaved_keys:
+            return
+        try:
+            self.key_cache.save()
+            self.unsaved_keys = 0
+        except OSError as e:
+            print(f"Warning: could not save key cache: {e}", file=sys.stderr)
+
+def read_block(path, offset, length):
+    """Read length bytes at offset (runs in the executor)"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+def read_decrypted(path, key):
+    """Read and decrypt a whole file (runs in the executor)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return decrypt_crafties.apply_pure_xor(data, key) if key else data
+
+class AudioServer:
+    """asyncio HTTP/1.1 server for /audios/<ID>.mp3"""
+
+    def __init__(self, library, cache):
+        self.library = library
+        self.cache = cache
+        self.fills = {}  # path -> future of a hot cache fill in progress
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one connection until the client closes it or asks to"""
+        peer = writer.get_extra_info('peername')
+
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, 400)
+                    break
+
+                keep_alive = await self.handle_request(head, writer, peer)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def handle_request(self, head, writer, peer):
+        """Answer one request, returns whether the connection stays open"""
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            await self.send_error(writer, 400)
+            return False
+
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+
+        if method not in ('GET', 'HEAD'):
+            await self.send_error(writer, 405, keep_alive)
+            return keep_alive
+
+        # Query strings (Expires, Policy, Signature, ...) are ignored
+        path = unquote(urlsplit(target).path)
+        directory, _, filename = path.rpartition('/')
+        audio_id, ext = os.path.splitext(filename)
+        entry = await self.library.lookup(audio_id) if directory == '/audios' and ext == '.mp3' else None
+        if entry is not None:
+            # A file replaced since it was indexed gets a fresh entry: new key, new length, new cache key
+            entry = self.library.refresh(entry)
+
+        if entry is None:
+            print(f"{peer[0]} {method} {path} -> 404")
+            await self.send_error(writer, 404, keep_alive)
+            return keep_alive
+
+        status = await self.send_audio(writer, entry, headers.get('range'), method == 'HEAD', keep_alive)
+        print(f"{peer[0]} {method} {path} {headers.get('range', '')} -> {status} "
+              f"({'0x%02X' % entry.key if entry.key is not None else 'no key'})")
+        return keep_alive and status != 500
+
+    async def send_error(self, writer, status, keep_alive=False, extra_headers=None):
+        body = f"{status} {HTTP_REASONS[status]}\n".encode()
+        headers = {'Content-Type': 'text/plain', 'Content-Length': str(len(body))}
+        headers.update(extra_headers or {})
+        await self.send_head(writer, status, headers, keep_alive)
+        writer.write(body)
+        await writer.drain()
+
+    async def send_head(self, writer, status, headers, keep_alive):
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        head = f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+        head += ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write((head + '\r\n').encode('latin-1'))
+
+    async def ensure_key(self, entry):
+        """Recover the entry's key once; concurrent requests for the same file wait for the first"""
+        if entry.key is not None:
+            return entry.key
+
+        if entry.key_lock is None:
+            entry.key_lock = asyncio.Lock()
+        async with entry.key_lock:
+            if entry.key is None:
+                loop = asyncio.get_running_loop()
+                try:
+                    entry.key = await loop.run_in_executor(None, self.library.recover_key, entry)
+                except OSError as e:
+                    print(f"Error recovering key for {entry.path}: {e}", file=sys.stderr)
+        return entry.key
+
+    async def fill_cache(self, entry):
+        """Load an entry into the hot cache off the event loop; concurrent requests share one fill"""
+        fill = self.fills.get(entry.cache_key)
+        if fill is None:
+            loop = asyncio.get_running_loop()
+            fill = loop.run_in_executor(None, read_decrypted, entry.path, entry.key)
+            self.fills[entry.cache_key] = fill
+            fill.add_done_callback(lambda done: self.fill_done(entry.cache_key, done))
+
+        try:
+            # Shielded so a client hanging up doesn't cancel the fill for the others
+            return await asyncio.shield(fill)
+        except OSError as e:
+            print(f"Error caching {entry.path}: {e}", file=sys.stderr)
+            return None
+
+    def fill_done(self, cache_key, fill):
+        del self.fills[cache_key]
+        if not fill.cancelled() and fill.exception() is None:
+            self.cache.put(cache_key, fill.result())
+
+    async def send_audio(self, writer, entry, range_header, head_only, keep_alive):
+        """Stream (part of) an entry, decrypting block by block; returns the HTTP status"""
+        size = entry.size
+
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            await self.send_error(writer, 416, keep_alive, {'Content-Range': f"bytes */{size}"})
+            return 416
+
+        if await self.ensure_key(entry) is None:
+            await self.send_error(writer, 500, keep_alive)
+            return 500
+
+        start, end = byte_range or (0, size - 1)
+        status = 206 if byte_range else 200
+        headers = {
+            'Content-Type': 'audio/mpeg',
+            'Content-Length': str(end - start + 1),
+            'Accept-Ranges': 'bytes',
+        }
+        if byte_range:
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        await self.send_head(writer, status, headers, keep_alive)
+
+        if head_only:
+            await writer.drain()
+            return status
+
+        entry.requests += 1
+        cached = self.cache.get(entry.cache_key)
+        loop = asyncio.get_running_loop()
+
+        if cached is None and entry.requests >= HOT_FILE_HITS and size <= self.cache.max_file_bytes:
+            cached = await self.fill_cache(entry)
+
+        offset = start
+        while offset <= end:
+            length = min(SERVE_BLOCK_SIZE, end - offset + 1)
+            if cached is not None:
+                block = cached[offset:offset + length]
+            else:
+                block = await loop.run_in_executor(None, read_block, entry.path, offset, length)
+                if not block:
+                    break
+                # Single-byte XOR doesn't depend on the position, so any range decrypts on its own
+                if entry.key:
+                    block = decrypt_crafties.apply_pure_xor(block, entry.key)
+            writer.write(block)
+            await writer.drain()
+            offset += len(block)
+
+        return status
+
+async def serve(library, cache, host, port, warm=False):
+    """Run the server until interrupted"""
+    server = AudioServer(library, cache)
+
+    if warm:
+        # Recover every key up front so no request waits for key discovery
+        start = time.time()
+        for entry in library.entries.values():
+            await server.ensure_key(entry)
+        print(f"Recovered keys for {len(library.entries)} files in {time.time() - start:.1f}s")
+
+    listener = await asyncio.start_server(server.handle_connection, host, port, limit=MAX_REQUEST_HEAD)
+    print(f"Serving on http://{host}:{port}/audios/<ID>.mp3")
+
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    """Serve a library directory as audiocnd.storypod.com"""
+
+    parser = argparse.ArgumentParser(description='Local decrypting audio server (audiocnd.storypod.com stand-in)')
+    parser.add_argument('library', help='Directory with .abc and/or .mp3 files, searched recursively')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=80, help='Port to listen on (default: 80, as the device expects)')
+    parser.add_argument('--cache-mb', type=int, default=256, help='Memory for hot decrypted files in MB (default: 256)')
+    parser.add_argument('--cache-file-mb', type=int, default=32,
+                        help='Largest file kept in the hot cache in MB (default: 32)')
+    parser.add_argument('--key-cache',
+                        help='Key cache file (default: key_cache.json in the library, "" to disable)')
+    parser.add_argument('--warm', action='store_true', help='Recover all keys before accepting connections')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.library):
+        print(f"Error: '{args.library}' is not a directory!")
+        return
+
+    decrypt_crafties.set_output_mode('quiet')
+
+    print("="*80)
+    print("CRAFTIE AUDIO SERVER")
+    print("="*80)
+
+    key_cache = decrypt_crafties.open_key_cache(args.key_cache, args.library)
+    library = AudioLibrary(args.library, key_cache)
+    print(f"Library: {args.library} ({library.scan()} files)")
+
+    cache = HotFileCache(args.cache_mb * 1024 * 1024, args.cache_file_mb * 1024 * 1024)
+
+    try:
+        asyncio.run(serve(library, cache, args.host, args.port, args.warm))
+    except KeyboardInterrupt:
+        print(f"\nStopped - hot cache: {cache.hits} hits, {cache.misses} misses, "
+              f"{cache.size / 1e6:.1f} MB in {len(cache.entries)} files")
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+    finally:
+        library.save_key_cache()
+
+if __name__ == "__main__":
+    main()
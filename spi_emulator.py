@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+SPI Flasher Emulator - software stand-in for an ESP board running SPI_FLASHER.ino with a GD25Q64
+Serves the sketch's serial protocol (I/R/W/E and the binary P/B/H/K/S/G commands) on a pty over a
+simulated 8 MB NOR image, modelling the baud rate, SPI clock, Serial.parseInt timeouts and page-program/erase times
+
+Usage: python spi_emulator.py [--image flash.bin] [--protocol 3]
+       python spi_tool.py <printed pty path> dump dump.bin 8192
+"""
+
+import os
+import sys
+import time
+import tty
+import zlib
+import select
+import struct
+import argparse
+
+import spi_tool
+
+GD25Q64_JEDEC_ID = bytes([0xC8, 0x40, 0x17])
+GD25Q64_SIZE = 8 * 1024 * 1024
+
+# GD25Q64C datasheet typical times, and the sketch's own delays
+DEFAULT_TIMINGS = {
+    'page_program': 0.0006,     # tPP typ 0.6 ms
+    'sector_erase': 0.05,       # tSE typ 50 ms
+    'chip_erase': 25.0,         # tCE typ 25 s
+    'parse_int_timeout': 1.0,   # Stream default setTimeout(1000)
+    'write_enable_delay': 0.005, # delay(5) after write enable in the W and E commands
+    'spi_clock_hz': spi_tool.SPI_CLOCK_HZ, # ESP8266 SPI default, the sketch never calls setFrequency
+}
+
+class SerialLink:
+    """Master side of a pty with the sketch's serial timing: bytes move at baud/10 per second each way"""
+
+    def __init__(self, fd, baud=spi_tool.BAUD_RATE):
+        self.fd = fd
+        self.byte_time = 10 / baud
+        self.rx = bytearray()
+        self.rx_clock = 0.0
+        self.tx_clock = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def fill(self, timeout):
+        """Wait up to timeout (None = forever) for more input, returns whether any arrived"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:  # No client on the pty right now
+            time.sleep(0.05)
+            return False
+        self.rx += data
+        return bool(data)
+
+    def read(self, n, timeout):
+        """Read up to n bytes like Serial.readBytes: gives up after timeout without new input"""
+        while len(self.rx) < n:
+            if not self.fill(timeout):
+                break
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        self.account_rx(len(data))
+        return data
+
+    def peek(self, timeout):
+        """Next byte without consuming it (Stream::timedPeek), or None after timeout"""
+        if not self.rx and not self.fill(timeout):
+            return None
+        return self.rx[0]
+
+    def account_rx(self, n):
+        # A byte can't be handled before it would have crossed the wire
+        self.rx_clock = max(self.rx_clock, time.perf_counter()) + n * self.byte_time
+        self.bytes_in += n
+        self.sleep_until(self.rx_clock)
+
+    def write(self, data):
+        for i in range(0, len(data), 256):
+            chunk = data[i:i + 256]
+            self.tx_clock = max(self.tx_clock, time.perf_counter()) + len(chunk) * self.byte_time
+            self.sleep_until(self.tx_clock)
+            os.write(self.fd, chunk)
+        self.bytes_out += len(data)
+
+    def sleep_until(self, deadline):
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+class FlashEmulator:
+    """The sketch's command loop over a NOR image (programming only clears bits, erasing sets them)"""
+
+    def __init__(self, link, image=None, size=GD25Q64_SIZE, protocol=3, timings=None):
+        self.link = link
+        self.flash = bytearray(b'\xFF' * size)
+        if image:
+            self.flash[:len(image)] = image[:size]
+        self.protocol = protocol
+        self.timings = dict(DEFAULT_TIMINGS, **(timings or {}))
+        self.commands = {}
+        self.first_command = None
+        self.last_command = None
+        self.busy = 0.0
+        self.spi = 0.0
+        self.idle = True
+
+    def stats(self):
+        """Commands (round trips), bytes moved and busy time since the last reset_stats()"""
+        return {
+            'commands': dict(self.commands),
+            'round_trips': sum(self.commands.values()),
+            'bytes_in': self.link.bytes_in,
+            'bytes_out': self.link.bytes_out,
+            'active_seconds': (self.last_command - self.first_command) if self.first_command else 0.0,
+            'busy_seconds': self.busy,
+            'spi_seconds': self.spi,
+        }
+
+    def reset_stats(self):
+        self.commands = {}
+        self.first_command = self.last_command = None
+        self.busy = 0.0
+        self.spi = 0.0
+        self.link.bytes_in = self.link.bytes_out = 0
+
+    def wait(self, seconds):
+        """Flash busy time (WIP set)"""
+        self.busy += seconds
+        time.sleep(seconds)
+
+    def spi_transfer(self, length):
+        """SPI bus time for length bytes (command, address and data) clocked between chip and MCU"""
+        seconds = length * 8 / self.timings['spi_clock_hz']
+        self.spi += seconds
+        time.sleep(seconds)
+
+    def parse_int(self):
+        """Stream::parseInt: skip to a digit, read digits, leave the terminator unread"""
+        timeout = self.timings['parse_int_timeout']
+        c = self.link.peek(timeout)
+        while c is not None and not (48 <= c <= 57 or c == ord('-')):
+            self.link.read(1, timeout)
+            c = self.link.peek(timeout)
+        if c is None:
+            return 0
+
+        negative = c == ord('-')
+        if negative:
+            self.link.read(1, timeout)
+        value = 0
+        c = self.link.peek(timeout)
+        while c is not None and 48 <= c <= 57:
+            value = value * 10 + c - 48
+            self.link.read(1, timeout)
+            c = self.link.peek(timeout)
+        return -value if negative else value
+
+    def read_flash(self, address, length):
+        address %= len(self.flash)
+        data = self.flash[address:address + length]
+        while len(data) < length:  # Reads wrap around at the end of the chip
+            data += self.flash[:length - len(data)]
+        return bytes(data)
+
+    def program(self, address, data):
+        """Page program: wraps within the 256 byte page, can only clear bits"""
+        page = address & ~(spi_tool.PAGE_SIZE - 1)
+        # Past 256 bytes the chip keeps only the last 256 it was sent
+        for i in range(max(len(data) - spi_tool.PAGE_SIZE, 0), len(data)):
+            offset = page + (address + i) % spi_tool.PAGE_SIZE
+            self.flash[offset % len(self.flash)] &= data[i]
+        self.spi_transfer(4 + len(data))
+        self.wait(self.timings['page_program'])
+
+    def run(self):
+        """Serve commands forever"""
+        while True:
+            command = self.link.read(1, None)
+            if not command:
+                continue
+            self.handle(command[0])
+
+    def handle(self, command):
+        name = chr(command)
+        handler = getattr(self, f"cmd_{name}", None) if name.isalpha() else None
+        if handler is None or (name in 'PBHKSG' and self.protocol < self.min_protocol(name)):
+            return  # Unknown bytes (like the ',' after an R command) are ignored by the sketch
+
+        self.idle = False
+        self.first_command = self.first_command or time.perf_counter()
+        self.commands[name] = self.commands.get(name, 0) + 1
+        handler()
+        self.last_command = max(time.perf_counter(), self.link.tx_clock)
+        self.idle = True
+
+    @staticmethod
+    def min_protocol(name):
+        return {'P': 1, 'B': 1, 'H': 2, 'S': 2, 'G': 2, 'K': 3}[name]
+
+    def send_status(self, status):
+        self.link.write(spi_tool.BULK_SYNC + bytes([status]))
+
+    def cmd_I(self):
+        self.link.write(GD25Q64_JEDEC_ID)
+
+    def cmd_R(self):
+        address = self.parse_int()
+        length = max(self.parse_int(), 0)
+        self.spi_transfer(4 + length)
+        self.link.write(self.read_flash(address, length))
+
+    def cmd_W(self):
+        address = self.parse_int()
+        length = self.parse_int()
+        if self.link.peek(self.timings['parse_int_timeout']) == ord(','):
+            self.link.read(1, 0)
+        data = self.link.read(length, self.timings['parse_int_timeout'])
+        self.wait(self.timings['write_enable_delay'])
+        self.program(address, data)
+
+    def cmd_E(self):
+        self.wait(self.timings['write_enable_delay'])
+        self.flash[:] = b'\xFF' * len(self.flash)
+        self.wait(self.timings['chip_erase'])
+
+    def cmd_P(self):
+        self.link.write(b'SPIF' + bytes([self.protocol]))
+
+    def cmd_B(self):
+        header = self.link.read(9, self.timings['parse_int_timeout'])
+        if len(header) != 9:
+            return
+        seq, address, length = spi_tool.BULK_REQUEST.unpack(header)
+        valid = 0 < length <= 0x1000000 and address < 0x1000000
+        head = spi_tool.BULK_RESPONSE.pack(seq, 0 if valid else 1, address, length if valid else 0)
+        data = self.read_flash(address, length) if valid else b''
+        self.link.write(spi_tool.BULK_SYNC + head)
+        if valid:
+            # The sketch reads 256 bytes over SPI, then writes them to the serial port
+            self.spi_transfer(4)
+            for offset in range(0, length, 256):
+                self.spi_transfer(min(256, length - offset))
+                self.link.write(data[offset:offset + 256])
+        self.link.write(struct.pack('<I', zlib.crc32(data, zlib.crc32(head))))
+
+    def sector_request(self):
+        header = self.link.read(6, self.timings['parse_int_timeout'])
+        if len(header) != 6:
+            return None
+        address, count = struct.unpack('<IH', header)
+        if address % spi_tool.SECTOR_SIZE or address + count * spi_tool.SECTOR_SIZE > len(self.flash):
+            self.send_status(1)
+            return None
+        return address, count
+
+    def cmd_H(self):
+        request = self.sector_request()
+        if request is None:
+            return
+        address, count = request
+        crcs = [zlib.crc32(self.flash[address + i * spi_tool.SECTOR_SIZE:address + (i + 1) * spi_tool.SECTOR_SIZE])
+                for i in range(count)]
+        self.send_status(0)
+        self.spi_transfer(count * (4 + spi_tool.SECTOR_SIZE))  # Every sector is read in full
+        self.link.write(struct.pack(f'<H{count}I', count, *crcs))
+
+    def cmd_K(self):
+        request = self.sector_request()
+        if request is None:
+            return
+        address, count = request
+        blank = b'\xFF' * spi_tool.SECTOR_SIZE
+        bitmap = bytearray((count + 7) // 8)
+        spi_bytes = 0
+        for i in range(count):
+            start = address + i * spi_tool.SECTOR_SIZE
+            sector = self.flash[start:start + spi_tool.SECTOR_SIZE]
+            if sector == blank:
+                bitmap[i // 8] |= 1 << (i % 8)
+                spi_bytes += 4 + spi_tool.SECTOR_SIZE
+            else:
+                # The sketch stops at the end of the 256 byte chunk holding the first programmed byte
+                first = len(sector) - len(sector.lstrip(b'\xFF'))
+                spi_bytes += 4 + (first // 256 + 1) * 256
+        self.send_status(0)
+        self.spi_transfer(spi_bytes)
+        self.link.write(struct.pack('<H', count) + bitmap)
+
+    def cmd_S(self):
+        header = self.link.read(4, self.timings['parse_int_timeout'])
+        if len(header) != 4:
+            return
+        address, = struct.unpack('<I', header)
+        if address % spi_tool.SECTOR_SIZE or address >= len(self.flash):
+            self.send_status(1)
+            return
+        self.flash[address:address + spi_tool.SECTOR_SIZE] = b'\xFF' * spi_tool.SECTOR_SIZE
+        self.wait(self.timings['sector_erase'])
+        self.send_status(0)
+
+    def cmd_G(self):
+        header = self.link.read(6, self.timings['parse_int_timeout'])
+        if len(header) != 6:
+            return
+        address, length = struct.unpack('<IH', header)
+        if not 0 < length <= spi_tool.PAGE_SIZE or address % spi_tool.PAGE_SIZE + length > spi_tool.PAGE_SIZE:
+            self.send_status(1)
+            return
+        data = self.link.read(length, self.timings['parse_int_timeout'])
+        crc = self.link.read(4, self.timings['parse_int_timeout'])
+        if len(data) != length or len(crc) != 4:
+            self.send_status(1)
+            return
+        if zlib.crc32(data) != struct.unpack('<I', crc)[0]:
+            self.send_status(2)
+            return
+        self.program(address, data)
+        self.send_status(0)
+
+def open_pty():
+    """Create a raw pty pair, returns (master fd, slave fd, slave path)"""
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    return master, slave, os.ttyname(slave)
+
+def main():
+    """Run the emulator on a pty until interrupted"""
+
+    parser = argparse.ArgumentParser(description='SPI_FLASHER.ino + GD25Q64 emulator on a pty')
+    parser.add_argument('--image', help='Initial flash contents (flat or .sparse image, default: erased)')
+    parser.add_argument('--save', help='Write the flash contents here on exit')
+    parser.add_argument('--protocol', type=int, default=3, choices=[0, 1, 2, 3],
+                        help='Sketch protocol version to emulate, 0 = original I/R/W/E only (default: 3)')
+    parser.add_argument('--baud', type=int, default=spi_tool.BAUD_RATE, help='Simulated baud rate (default: 921600)')
+    parser.add_argument('--chip-erase-s', type=float, default=DEFAULT_TIMINGS['chip_erase'],
+                        help='Simulated chip erase time in seconds (default: 25)')
+    parser.add_argument('--spi-mhz', type=float, default=DEFAULT_TIMINGS['spi_clock_hz'] / 1e6,
+                        help='Simulated SPI clock in MHz (default: 1, the ESP8266 default)')
+
+    args = parser.parse_args()
+
+    image = spi_tool.read_image(args.image) if args.image else None
+    master, slave, path = open_pty()
+    emulator = FlashEmulator(SerialLink(master, args.baud), image, protocol=args.protocol,
+                             timings={'chip_erase': args.chip_erase_s, 'spi_clock_hz': args.spi_mhz * 1e6})
+
+    print("="*80)
+    print("SPI FLASHER EMULATOR")
+    print("="*80)
+    print(f"GD25Q64 (8 MB), protocol {args.protocol}, {args.baud} baud, {args.spi_mhz:g} MHz SPI")
+    print(f"Serial port: {path}")
+    print(f"  python spi_tool.py {path} id")
+    sys.stdout.flush()
+
+    try:
+        emulator.run()
+    except KeyboardInterrupt:
+        stats = emulator.stats()
+        print(f"\nStopped - {stats['round_trips']} commands, {stats['bytes_in']} bytes in, {stats['bytes_out']} bytes out")
+    finally:
+        if args.save:
+            with open(args.save, 'wb') as f:
+                f.write(emulator.flash)
+            print(f"Flash contents saved to: {args.save}")
+        os.close(master)
+        os.close(slave)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,350 @@
 import serial
 import sys
 import time
+import io
+import os
+import zlib
+import struct
+from collections import deque
+
+BAUD_RATE = 921600
+SPI_CLOCK_HZ = 1000000                 # ESP8266 SPI default, the sketch never changes it
+BULK_SYNC = b'\xA5\x5A'
+BULK_REQUEST = struct.Struct('<BII')   # seq, address, length (after the 'B')
+BULK_RESPONSE = struct.Struct('<BBII') # seq, status, address, length (after the sync bytes)
+BULK_BLOCK_SIZE = 64 * 1024
+BULK_WINDOW = 4                        # Outstanding requests; 10 bytes each in the sketch's RX buffer
+BULK_RETRIES = 5
+SECTOR_SIZE = 4096
+PAGE_SIZE = 256
+HASH_BATCH = 64                        # Sectors per 'H' request
+BLANK_BATCH = 64                       # Sectors per 'K' request (256 KB of erased flash is ~2 s at 1 MHz SPI)
+
+# Sparse image (<name>.sparse): header, sector bitmap (bit set = sector stored), stored sectors in order.
+# Sectors not stored are erased (all 0xFF). The CRC32 is over the expanded image
+SPARSE_SUFFIX = '.sparse'
+SPARSE_MAGIC = b'SPFI'
+SPARSE_HEADER = struct.Struct('<4sBIII')  # magic, version, sector size, image size, image crc32
+SPARSE_VERSION = 1
+
+def probe_bulk_protocol(ser):
+    """Protocol version of the sketch's binary commands, or 0 for a sketch that only speaks R/W/E/I"""
+    ser.reset_input_buffer()
+    ser.write(b'P')
+    reply = ser.read(5)
+    if len(reply) == 5 and reply[:4] == b'SPIF':
+        return reply[4]
+    ser.reset_input_buffer()
+    return 0
+
+def read_bulk_frame(ser, expected=None):
+    """Read one bulk response, returns (seq, status, address, data, crc_ok) or None if the framing is lost
+
+    The CRC32 covers the response header and the data. With expected=(seq, address, length) of the
+    request being answered, a header for another request or longer than it asked for is rejected
+    before its payload is read, so a corrupted length can't stall on a huge read.
+    """
+    if ser.read(2) != BULK_SYNC:
+        return None
+    head = ser.read(BULK_RESPONSE.size)
+    if len(head) != BULK_RESPONSE.size:
+        return None
+    seq, status, address, length = BULK_RESPONSE.unpack(head)
+    if expected and (seq != expected[0] or address != expected[1] or length > expected[2]):
+        return None
+    payload = ser.read(length + 4)
+    if len(payload) != length + 4:
+        return None
+    data = payload[:length]
+    crc = struct.unpack('<I', payload[length:])[0]
+    return seq, status, address, data, zlib.crc32(data, zlib.crc32(head)) == crc
+
+def drain(ser, idle=0.3):
+    """Discard everything the sketch still sends for requests in flight"""
+    timeout = ser.timeout
+    ser.timeout = idle
+    while ser.read(4096):
+        pass
+    ser.timeout = timeout
+    ser.reset_input_buffer()
+
+def bulk_dump(ser, f, total_bytes, block_size=BULK_BLOCK_SIZE, window=BULK_WINDOW, retries=BULK_RETRIES,
+              ranges=None):
+    """Dump with pipelined 'B' requests, re-reading any block whose frame or CRC32 is bad
+
+    ranges limits the dump to a list of (address, length); f is written at each block's address.
+    """
+    # A block takes ~10 bits per byte on the wire plus 8 per byte on the SPI bus, which the
+    # sketch reads in between serial writes; allow twice that before calling it lost
+    ser.timeout = max(1.0, 2 * ((block_size + 16) * 10 / BAUD_RATE + (block_size + 4) * 8 / SPI_CLOCK_HZ))
+
+    pending = deque()
+    for range_start, range_length in ranges if ranges is not None else [(0, total_bytes)]:
+        for addr in range(range_start, range_start + range_length, block_size):
+            pending.append((addr, min(block_size, range_start + range_length - addr)))
+    total_bytes = sum(length for addr, length in pending)
+    outstanding = deque()
+    attempts = {}
+    seq = 0
+    done = 0
+    rereads = 0
+    start = time.time()
+
+    while pending or outstanding:
+        while pending and len(outstanding) < window:
+            addr, length = pending.popleft()
+            ser.write(b'B' + BULK_REQUEST.pack(seq, addr, length))
+            outstanding.append((seq, addr, length))
+            seq = (seq + 1) & 0xFF
+
+        expected_seq, addr, length = outstanding[0]
+        frame = read_bulk_frame(ser, outstanding[0])
+
+        if frame and frame[4] and frame[1] != 0:
+            raise RuntimeError(f"sketch rejected read of {length} bytes at 0x{addr:06X} (status {frame[1]})")
+
+        if frame and frame[4] and frame[0] == expected_seq and frame[2] == addr and len(frame[3]) == length:
+            outstanding.popleft()
+            f.seek(addr)
+            f.write(frame[3])
+            done += length
+            elapsed = time.time() - start
+            print(f"Dumping... {done / total_bytes * 100:.2f}% complete "
+                  f"({done / elapsed / 1024 if elapsed else 0:.1f} KB/s)", end='\r')
+            continue
+
+        # Corrupted or lost frame: let the in-flight replies finish, then ask again from this block on
+        drain(ser)
+        for _, failed_addr, failed_length in outstanding:
+            attempts[failed_addr] = attempts.get(failed_addr, 0) + 1
+            if attempts[failed_addr] > retries:
+                raise RuntimeError(f"block at 0x{failed_addr:06X} failed {retries} re-reads")
+        rereads += 1
+        pending.extendleft(reversed([(a, l) for _, a, l in outstanding]))
+        outstanding.clear()
+
+    return rereads
+
+def read_status(ser):
+    """Status byte of a sector command reply, or None if none arrived"""
+    reply = ser.read(3)
+    if len(reply) != 3 or reply[:2] != BULK_SYNC:
+        return None
+    return reply[2]
+
+def hash_sectors(ser, address, count):
+    """CRC32 of each of count 4 KB sectors from address, computed on the device"""
+    ser.write(b'H' + struct.pack('<IH', address, count))
+    if read_status(ser) != 0:
+        raise RuntimeError(f"sector hash at 0x{address:06X} failed")
+    reply = ser.read(2 + 4 * count)
+    if len(reply) != 2 + 4 * count or struct.unpack('<H', reply[:2])[0] != count:
+        raise RuntimeError(f"short sector hash reply at 0x{address:06X}")
+    return list(struct.unpack(f'<{count}I', reply[2:]))
+
+def erase_sector(ser, address):
+    ser.write(b'S' + struct.pack('<I', address))
+    if read_status(ser) != 0:
+        raise RuntimeError(f"erase of sector 0x{address:06X} failed")
+
+def program_page(ser, address, data, retries=BULK_RETRIES):
+    """Program one page, resending it if the device saw a CRC error"""
+    for _ in range(retries):
+        ser.write(b'G' + struct.pack('<IH', address, len(data)) + data + struct.pack('<I', zlib.crc32(data)))
+        status = read_status(ser)
+        if status == 0:
+            return
+        if status is None:
+            drain(ser)
+    raise RuntimeError(f"programming page 0x{address:06X} failed {retries} times")
+
+def read_range(ser, address, length, retries=BULK_RETRIES):
+    """Read length bytes at address with the bulk protocol, re-reading a bad frame up to retries times"""
+    for _ in range(retries + 1):
+        ser.write(b'B' + BULK_REQUEST.pack(0, address, length))
+        frame = read_bulk_frame(ser, (0, address, length))
+        if frame and frame[4] and frame[1] == 0 and len(frame[3]) == length:
+            return frame[3]
+        drain(ser)
+    raise RuntimeError(f"block at 0x{address:06X} failed {retries} re-reads")
+
+def device_hashes(ser, total_sectors):
+    hashes = []
+    for first in range(0, total_sectors, HASH_BATCH):
+        hashes += hash_sectors(ser, first * SECTOR_SIZE, min(HASH_BATCH, total_sectors - first))
+        print(f"Comparing... {len(hashes) / total_sectors * 100:.2f}% complete", end='\r')
+    return hashes
+
+def write_sector(ser, address, sector):
+    """Erase one sector and program its pages, skipping pages that stay erased (all 0xFF)"""
+    erase_sector(ser, address)
+    for offset in range(0, SECTOR_SIZE, PAGE_SIZE):
+        page = sector[offset:offset + PAGE_SIZE]
+        if page.count(0xFF) != len(page):
+            program_page(ser, address + offset, page)
+
+def differential_flash(ser, image):
+    """Flash only the 4 KB sectors whose on-device CRC32 differs from the image, then verify them
+
+    Returns (changed sectors, total sectors).
+    """
+    # Sector commands wait for the flash (erase up to ~400 ms, hashing reads 256 KB per request)
+    ser.timeout = 10
+
+    # A partial last sector keeps the device's bytes past the end of the image
+    tail = len(image) % SECTOR_SIZE
+    if tail:
+        last = len(image) - tail
+        image = image + read_range(ser, last, SECTOR_SIZE)[tail:]
+    total_sectors = len(image) // SECTOR_SIZE
+
+    hashes = device_hashes(ser, total_sectors)
+    changed = [i for i in range(total_sectors)
+               if zlib.crc32(image[i * SECTOR_SIZE:(i + 1) * SECTOR_SIZE]) != hashes[i]]
+    print(f"\n{len(changed)}/{total_sectors} sectors differ")
+
+    start = time.time()
+    for n, i in enumerate(changed):
+        write_sector(ser, i * SECTOR_SIZE, image[i * SECTOR_SIZE:(i + 1) * SECTOR_SIZE])
+        elapsed = time.time() - start
+        print(f"Flashing... {(n + 1) / len(changed) * 100:.2f}% complete "
+              f"({(n + 1) * SECTOR_SIZE / elapsed / 1024 if elapsed else 0:.1f} KB/s)", end='\r')
+
+    # Verify the rewritten sectors, giving each failure one more write
+    for attempt in range(2):
+        failed = [i for i in changed
+                  if hash_sectors(ser, i * SECTOR_SIZE, 1)[0] != zlib.crc32(image[i * SECTOR_SIZE:(i + 1) * SECTOR_SIZE])]
+        if not failed:
+            break
+        if attempt == 0:
+            print(f"\nRewriting {len(failed)} sectors that failed verification")
+            for i in failed:
+                write_sector(ser, i * SECTOR_SIZE, image[i * SECTOR_SIZE:(i + 1) * SECTOR_SIZE])
+    if failed:
+        raise RuntimeError(f"{len(failed)} sectors failed verification: "
+                           + ', '.join(f"0x{i * SECTOR_SIZE:06X}" for i in failed))
+
+    return len(changed), total_sectors
+
+def blank_sectors(ser, total_sectors):
+    """Per sector, whether the device reports it erased (protocol 3 'K')"""
+    # An erased sector is read in full, so a batch of BLANK_BATCH must fit well inside this
+    ser.timeout = 10
+    erased = []
+    for first in range(0, total_sectors, BLANK_BATCH):
+        count = min(BLANK_BATCH, total_sectors - first)
+        ser.write(b'K' + struct.pack('<IH', first * SECTOR_SIZE, count))
+        if read_status(ser) != 0:
+            raise RuntimeError(f"blank check at 0x{first * SECTOR_SIZE:06X} failed")
+        reply = ser.read(2 + (count + 7) // 8)
+        if len(reply) != 2 + (count + 7) // 8:
+            raise RuntimeError(f"short blank check reply at 0x{first * SECTOR_SIZE:06X}")
+        bitmap = reply[2:]
+        erased += [bool(bitmap[i // 8] >> (i % 8) & 1) for i in range(count)]
+    return erased
+
+def sector_runs(present, sector_size=SECTOR_SIZE):
+    """(address, length) of each run of consecutive present sectors"""
+    runs = []
+    for i, keep in enumerate(present):
+        if not keep:
+            continue
+        if runs and runs[-1][0] + runs[-1][1] == i * sector_size:
+            runs[-1] = (runs[-1][0], runs[-1][1] + sector_size)
+        else:
+            runs.append((i * sector_size, sector_size))
+    return runs
+
+def write_sparse_image(path, image, sector_size=SECTOR_SIZE):
+    """Save image as a sparse file: only sectors that aren't all 0xFF are stored"""
+    total_sectors = (len(image) + sector_size - 1) // sector_size
+    bitmap = bytearray((total_sectors + 7) // 8)
+    blank = b'\xFF' * sector_size
+    stored = 0
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SPARSE_HEADER.pack(SPARSE_MAGIC, SPARSE_VERSION, sector_size, len(image), zlib.crc32(image)))
+        bitmap_offset = f.tell()
+        f.write(bitmap)
+        for i in range(total_sectors):
+            sector = image[i * sector_size:(i + 1) * sector_size]
+            if sector != blank[:len(sector)]:
+                bitmap[i // 8] |= 1 << (i % 8)
+                f.write(sector)
+                stored += 1
+        f.seek(bitmap_offset)
+        f.write(bitmap)
+    os.replace(tmp_path, path)
+    return stored, total_sectors
+
+def read_sparse_image(path):
+    """Expand a sparse file back to the flat image"""
+    with open(path, 'rb') as f:
+        header = f.read(SPARSE_HEADER.size)
+        if len(header) != SPARSE_HEADER.size:
+            raise ValueError(f"{path}: truncated sparse image")
+        magic, version, sector_size, image_size, image_crc = SPARSE_HEADER.unpack(header)
+        if magic != SPARSE_MAGIC or version != SPARSE_VERSION:
+            raise ValueError(f"{path}: not a sparse image (or unsupported version)")
+        total_sectors = (image_size + sector_size - 1) // sector_size
+        bitmap = f.read((total_sectors + 7) // 8)
+
+        image = bytearray(b'\xFF' * image_size)
+        for i in range(total_sectors):
+            if bitmap[i // 8] >> (i % 8) & 1:
+                length = min(sector_size, image_size - i * sector_size)
+                sector = f.read(length)
+                if len(sector) != length:
+                    raise ValueError(f"{path}: truncated sparse image")
+                image[i * sector_size:i * sector_size + length] = sector
+
+    if zlib.crc32(image) != image_crc:
+        raise ValueError(f"{path}: image CRC mismatch")
+    return bytes(image)
+
+def read_image(path):
+    """Flat image bytes of a flat or sparse file"""
+    if path.endswith(SPARSE_SUFFIX):
+        return read_sparse_image(path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def sparse_dump(ser, filename, total_bytes, block_size, protocol):
+    """Dump only the non-erased sectors (as reported by the device) into a sparse image"""
+    total_sectors = (total_bytes + SECTOR_SIZE - 1) // SECTOR_SIZE
+    if protocol >= 3:
+        erased = blank_sectors(ser, total_sectors)
+        print(f"{erased.count(True)}/{total_sectors} sectors erased, skipping them")
+    else:
+        print("Sketch has no blank check, reading every sector")
+        erased = [False] * total_sectors
+
+    runs = [(addr, min(length, total_bytes - addr)) for addr, length in sector_runs([not e for e in erased])]
+    image = io.BytesIO(b'\xFF' * total_bytes)
+    rereads = bulk_dump(ser, image, total_bytes, block_size, ranges=runs)
+    stored, total_sectors = write_sparse_image(filename, image.getbuffer()[:total_bytes].tobytes())
+    print(f"\nSparse image: {stored}/{total_sectors} sectors stored, {os.path.getsize(filename) / 1024:.0f} KB")
+    return rereads
+
+def legacy_dump(ser, f, total_bytes):
+    """Dump with one ASCII R command per 256 bytes (sketches without the bulk command)"""
+    for addr in range(0, total_bytes, 256):
+        ser.write(f'R{addr},256,'.encode())
+        data = ser.read(256)
+        f.write(data)
+        progress = (addr + 256) / total_bytes * 100
+        print(f"Dumping... {progress:.2f}% complete", end='\r')
 
 def main():
-    if len(sys.argv) < 4:
+    if len(sys.argv) < 3:
         print("Usage: python spi_tool.py <PORT> <COMMAND> [ARGS...]")
         print("Commands:")
         print("  id - Identify chip")
-        print("  dump <filename> <size_in_kb> - Dump flash to file")
-        print("  flash <filename> - Flash file to chip")
+        print("  dump <filename> <size_in_kb> [block_kb] - Dump flash to file (default 64 KB CRC-checked blocks)")
+        print("      a filename ending in .sparse skips erased sectors and stores only the used ones")
+        print("  flash <filename> [full] - Flash a flat or .sparse image (only changed 4 KB sectors, verified;")
+        print("      full = every non-erased page)")
         print("  erase - Erase the entire chip")
         return
 
@@ -16,7 +352,7 @@ def main():
     command = sys.argv[2]
 
     try:
-        ser = serial.Serial(port, 921600, timeout=1)
+        ser = serial.Serial(port, BAUD_RATE, timeout=1)
     except serial.SerialException as e:
         print(f"Error opening serial port {port}: {e}")
         return
@@ -32,40 +368,78 @@ def main():
             print("No response from chip.")
 
     elif command == "dump":
-        if len(sys.argv) != 5:
-            print("Usage: python spi_tool.py <PORT> dump <filename> <size_in_kb>")
+        if len(sys.argv) not in (5, 6):
+            print("Usage: python spi_tool.py <PORT> dump <filename>[.sparse] <size_in_kb> [block_kb]")
             return
         filename = sys.argv[3]
         size_kb = int(sys.argv[4])
+        block_size = int(sys.argv[5]) * 1024 if len(sys.argv) == 6 else BULK_BLOCK_SIZE
         total_bytes = size_kb * 1024
         
-        with open(filename, 'wb') as f:
-            for addr in range(0, total_bytes, 256):
-                ser.write(f'R{addr},256,'.encode())
-                data = ser.read(256)
-                f.write(data)
-                progress = (addr + 256) / total_bytes * 100
-                print(f"Dumping... {progress:.2f}% complete", end='\r')
-        print("\nDump complete.")
+        start = time.time()
+        protocol = probe_bulk_protocol(ser)
+        if not protocol and filename.endswith(SPARSE_SUFFIX):
+            print("Error: sparse dumps need the bulk read command, reflash SPI_FLASHER.ino")
+            ser.close()
+            return
+        
+        if protocol:
+            try:
+                if filename.endswith(SPARSE_SUFFIX):
+                    rereads = sparse_dump(ser, filename, total_bytes, block_size, protocol)
+                else:
+                    with open(filename, 'wb') as f:
+                        rereads = bulk_dump(ser, f, total_bytes, block_size)
+            except RuntimeError as e:
+                print(f"\nError: {e}")
+                ser.close()
+                return
+            if rereads:
+                print(f"\nRe-read after corrupted blocks: {rereads} times")
+        else:
+            print("Sketch has no bulk read command, using 256 byte R commands (reflash SPI_FLASHER.ino for speed)")
+            with open(filename, 'wb') as f:
+                legacy_dump(ser, f, total_bytes)
+        elapsed = time.time() - start
+        print(f"\nDump complete. {total_bytes / 1024:.0f} KB in {elapsed:.1f}s ({total_bytes / elapsed / 1024:.1f} KB/s)")
 
     elif command == "flash":
-        if len(sys.argv) != 4:
-            print("Usage: python spi_tool.py <PORT> flash <filename>")
+        if len(sys.argv) not in (4, 5) or (len(sys.argv) == 5 and sys.argv[4] != "full"):
+            print("Usage: python spi_tool.py <PORT> flash <filename> [full]")
             return
         filename = sys.argv[3]
+        full = len(sys.argv) == 5
+        
+        try:
+            image = read_image(filename)
+        except ValueError as e:
+            print(f"Error: {e}")
+            ser.close()
+            return
+        
+        if not full and probe_bulk_protocol(ser) >= 2:
+            start = time.time()
+            try:
+                changed, total_sectors = differential_flash(ser, image)
+            except RuntimeError as e:
+                print(f"\nError: {e}")
+                ser.close()
+                return
+            print(f"\nFlash complete and verified. {changed}/{total_sectors} sectors written in {time.time() - start:.1f}s")
+            ser.close()
+            return
         
-        with open(filename, 'rb') as f:
-            addr = 0
-            while True:
-                chunk = f.read(256)
-                if not chunk:
-                    break
+        if not full:
+            print("Sketch has no sector commands, writing every page (reflash SPI_FLASHER.ino for differential flashing)")
+        for addr in range(0, len(image), 256):
+            chunk = image[addr:addr + 256]
+            # Programming 0xFF leaves NOR flash unchanged, so erased pages are skipped
+            if chunk.count(0xFF) != len(chunk):
                 ser.write(f'W{addr},{len(chunk)},'.encode())
                 ser.write(chunk)
                 time.sleep(0.01) # Give the chip some time to write
-                addr += len(chunk)
-                progress = (addr / f.tell()) * 100 if f.tell() > 0 else 0
-                print(f"Flashing... {progress:.2f}% complete", end='\r')
+            progress = (addr + len(chunk)) / len(image) * 100
+            print(f"Flashing... {progress:.2f}% complete", end='\r')
         print("\nFlash complete.")
 
     elif command == "erase":
@@ -1,9 +1,123 @@
 import requests
 import os
-import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from craftie_catalog import parse_form
+from logcat_index import LogcatIndex
+
+# Seconds a cached response stays fresh, per endpoint path. Endpoints not listed are never cached
+CACHE_TTLS = {
+    "crafite/craftielist": 300,
+    "crafite/playlist": 3600,
+    "crafite/download/txt": 3600,
+    "mqtt/get": 86400,
+    "ota/newversion": 600,
+}
+# Body fields that identify a content version: a cached response only answers a request with the same values
+CACHE_VERSION_FIELDS = ("en_version", "es_version", "firmware", "version")
+# Endpoints whose responses hold credentials: cached in memory only, unless the cache is told to persist them
+CACHE_MEMORY_ONLY = ("mqtt/get",)
+# Values of a JSON response's "code" field that mean the call succeeded
+API_SUCCESS_CODES = (0, 200, "0", "200")
+
+def api_succeeded(response):
+    # Whether a decoded response is a success worth caching; plain-text bodies have no code field
+    if not isinstance(response, dict):
+        return True
+    return response.get("code") in API_SUCCESS_CODES or response.get("success") is True
+
+class ResponseCache:
+    # Cache of decoded API responses, in memory and optionally persisted to a JSON file by save().
+    # Entries are keyed by endpoint + request body minus the version fields; the version values are
+    # stored with the entry, so a request with new versions misses and replaces the old response
+    def __init__(self, path=None, max_entries=1000, ttls=None, persist_credentials=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.memory_only = () if persist_credentials else CACHE_MEMORY_ONLY
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        # Callers may share one cache across threads (mirror_crafties does)
+        self.lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = OrderedDict(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Warning: ignoring unreadable response cache {path}: {e}")
+
+    def endpoint(self, path):
+        return path.split("?")[0]
+
+    def cacheable(self, path):
+        return self.endpoint(path) in self.ttls
+
+    def _key(self, path, body):
+        body = {k: v for k, v in (body or {}).items() if k not in CACHE_VERSION_FIELDS}
+        return hashlib.sha1(f"{path} {json.dumps(body, sort_keys=True)}".encode()).hexdigest()
+
+    def _versions(self, body):
+        return [(body or {}).get(field) for field in CACHE_VERSION_FIELDS]
+
+    def get(self, path, body):
+        key = self._key(path, body)
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is None or entry["versions"] != self._versions(body)
+                    or time.time() - entry["time"] > self.ttls[self.endpoint(path)]):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["response"]
+
+    def put(self, path, body, response):
+        key = self._key(path, body)
+        with self.lock:
+            self.entries[key] = {"endpoint": self.endpoint(path), "time": time.time(),
+                                 "versions": self._versions(body), "response": response}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def invalidate(self, path=None):
+        # Drop every entry of one endpoint, or everything
+        with self.lock:
+            if path is None:
+                self.entries.clear()
+            else:
+                self.entries = OrderedDict((key, entry) for key, entry in self.entries.items()
+                                           if entry["endpoint"] != self.endpoint(path))
+            self.dirty = True
+
+    def save(self):
+        # Write the persistent entries to path if anything changed since the last save
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            entries = {key: entry for key, entry in self.entries.items()
+                       if entry["endpoint"] not in self.memory_only}
+            self.dirty = False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
 
 class StorypodAPI:
-    def __init__(self, access_token, device_id, client_type=None):
+    def __init__(self, access_token, device_id, client_type=None, pool_size=10, timeout=(5, 30),
+                 retries=3, backoff=0.5, cache=None):
         self.base_url = "https://api.storypod.com"
         self.access_token = access_token
         self.device_id = device_id
@@ -15,38 +129,120 @@ class StorypodAPI:
             "Content-Type": "application/json",
             "Accept": "*/*",
         }
+        # (connect, read) seconds, passed to every request
+        self.timeout = timeout
+        self.session = self._make_session(pool_size, retries, backoff)
+        # Writes (the OTA status report) must not be sent twice, so they never retry
+        self.write_session = self._make_session(1, 0, backoff)
+        # endpoint -> [count, total seconds, max seconds]; mirror_crafties calls in from worker threads
+        self.latency = {}
+        self.latency_lock = threading.Lock()
+        # Optional ResponseCache for the metadata endpoints
+        self.cache = cache
 
+    @classmethod
+    def from_logcat_index(cls, index_path, device_id=None, **kwargs):
+        # Credentials from a logcat_index.py database: the newest access token and device id in the device logs
+        index = LogcatIndex(index_path)
+        try:
+            access_token = index.latest_token()
+            device_id = device_id or index.device_id()
+        finally:
+            index.close()
+        if access_token is None or device_id is None:
+            raise ValueError(f"{index_path}: no access token / device id indexed yet")
+        return cls(access_token, device_id, **kwargs)
 
-    def extract_audioid(self, form_bytes, min_length=5):
-        
-        data = form_bytes
-        # Decode to ASCII, ignoring errors
-        decoded = data.decode('ascii', errors='ignore')
-    
-        # Find digit strings of at least `min_length`
-        matches = re.findall(r'\d{' + str(min_length) + r',}', decoded)
-    
-        # Convert to int to remove leading zeros and deduplicate
-        numbers = sorted({int(m) for m in matches if int(m) != 0})
-    
-        # Convert back to strings
-        result = [str(n) for n in numbers]
-    
-        #print(result)  # Optional: remove if you only want the return
-        return result
+    def _make_session(self, pool_size, retries, backoff):
+        # One keep-alive pool per host, retrying connection errors and 5xx with exponential backoff.
+        # POST is retried too, so this session is only for the read endpoints (most are POSTs)
+        retry_args = dict(total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504),
+                          raise_on_status=False)
+        try:
+            retry = Retry(allowed_methods=frozenset(["GET", "POST"]), **retry_args)
+        except TypeError:  # urllib3 < 1.26
+            retry = Retry(method_whitelist=frozenset(["GET", "POST"]), **retry_args)
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _endpoint(self, url):
+        # API calls by path; anything else (audio downloads) by host and directory, so the
+        # latency table doesn't grow with every file downloaded
+        url = url.split("?")[0]
+        if url.startswith(self.base_url):
+            return url[len(self.base_url):]
+        return url.split("://", 1)[-1].rsplit("/", 1)[0]
+
+    def _request(self, method, url, write=False, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        session = self.write_session if write else self.session
+        start = time.perf_counter()
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            # Time to response headers (body excluded for streamed downloads), retries included
+            elapsed = time.perf_counter() - start
+            with self.latency_lock:
+                stats = self.latency.setdefault(self._endpoint(url), [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+
+    def latency_summary(self):
+        with self.latency_lock:
+            latency = {endpoint: list(stats) for endpoint, stats in self.latency.items()}
+        return {endpoint: {"count": count, "avg": total / count, "max": worst, "total": total}
+                for endpoint, (count, total, worst) in latency.items()}
+
+    def print_latency(self):
+        for endpoint, stats in sorted(self.latency_summary().items()):
+            print(f"{endpoint:60} {stats['count']:5} calls  avg {stats['avg']*1000:7.1f} ms  "
+                  f"max {stats['max']*1000:7.1f} ms")
+
+    def close(self):
+        self.session.close()
+        self.write_session.close()
+        if self.cache is not None:
+            self.cache.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-        #usage extract_audio_ids("010000050020.form", min_length=5)
 
+    def extract_audioid(self, form_bytes, min_length=1):
+        # Audio ids of a .form blob in playlist order (see craftie_catalog.parse_form)
+        return [audio_id for audio_id in parse_form(form_bytes) if len(audio_id) >= min_length]
 
-    def _post(self, path, body, v="v2"):
+        #usage extract_audioid(open("010000050020.form", "rb").read())
+
+
+    def _cached(self, path, body, fetch, decode=lambda r: r.json()):
+        # decode(fetch()) on a cache miss; forced OTA checks always go to the network.
+        # Only 2xx responses the API marks as successful are cached, errors are retried next time
+        if self.cache is None or not self.cache.cacheable(path) or (body or {}).get("force"):
+            return decode(fetch())
+        response = self.cache.get(path, body)
+        if response is None:
+            r = fetch()
+            response = decode(r)
+            if r.ok and api_succeeded(response):
+                self.cache.put(path, body, response)
+        return response
+
+    def _post(self, path, body, v="v2", write=False):
         url = f"{self.base_url}/api/{v}/device/{path}"
-        response = requests.post(url, json=body, headers=self.headers)
-        return response.json()
+        return self._cached(path, body, lambda: self._request("POST", url, write, json=body, headers=self.headers))
 
     def _get(self, path, params=None, v="v1"):
         url = f"{self.base_url}/api/{v}/device/{path}"
-        response = requests.get(url, headers=self.headers, params=params)
-        return response.json()
+        return self._cached(path, params, lambda: self._request("GET", url, headers=self.headers, params=params))
 
     def get_mqtt_config(self, version="ver1.1.4"):
         return self._post("mqtt/get?languageCode=EN", {"version": version})
@@ -68,7 +264,7 @@ class StorypodAPI:
             "ota_bluetooth_status": str(bt_status),
             "ota_system_tone_status": str(tone_status)
         }
-        return self._post("update?languageCode=EN", body, v="v1")
+        return self._post("update?languageCode=EN", body, v="v1", write=True)
 
     def get_crafite_playlist(self, crafite_uuid, current_audio_id, en_version, firmware):
         body = {
@@ -104,8 +300,12 @@ class StorypodAPI:
             "language": language
         }
         url = f"{self.base_url}/api/v1/device/crafite/download/txt"
-        r = requests.get(url, params=params)
-        r.raise_for_status()
+
+        def decode(r):
+            r.raise_for_status()
+            return r.content.decode("latin-1")
+        content = self._cached("crafite/download/txt", params,
+                               lambda: self._request("GET", url, params=params), decode).encode("latin-1")
         
         # if filename is None:
             # filename = f"{crafite_uuid}.txt"
@@ -113,12 +313,41 @@ class StorypodAPI:
         # with open(filename, "wb") as f:
             # f.write(r.content)
             
-        return self.extract_audioid(r.content)
+        return self.extract_audioid(content)
+
+
+
+    def download_audio_resumable(self, full_url, destination, chunk_size=256 * 1024):
+        # Downloads into destination + ".part", continuing a previous partial download with a
+        # Range request, then renames it into place so destination is only ever complete.
+        # Returns the number of bytes received by this call, not counting a resumed part
+        part_path = destination + ".part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        response = self._request("GET", full_url, stream=True, headers=headers)
+        with response:
+            if response.status_code == 416 and offset:
+                # The part file is already complete
+                os.replace(part_path, destination)
+                return 0
+            response.raise_for_status()
 
+            # A server ignoring Range answers 200 with the whole file
+            mode = "ab" if offset and response.status_code == 206 else "wb"
+            received = 0
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        received += len(chunk)
 
+        os.replace(part_path, destination)
+        return received
 
     def direct_download_audio(self, full_url, destination="output.mp3"):
-        response = requests.get(full_url, stream=True)
+        response = self._request("GET", full_url, stream=True)
+        response.raise_for_status()
         with open(destination, "wb") as f:
             for chunk in response.iter_content(chunk_size=4096):
                 if chunk:
@@ -0,0 +1,34 @@
+from craftie_catalog import parse_form, parse_record
+
+
+def test_parse_form_json_keys():
+    form = b'{"uuid": "010000050020", "list": [{"audio_id": 26072}, {"audio_id": "2375"}]}'
+    assert parse_form(form) == ['26072', '2375']
+
+
+def test_parse_form_named_fields_in_order():
+    assert parse_form(b'count=2\naudio_id=26072\naudio_id=2375\n') == ['26072', '2375']
+
+
+def test_parse_form_one_id_per_line_skips_craftie_uuid():
+    assert parse_form(b'010000050020\n2375\n26072\n2375\n', '010000050020') == ['2375', '26072']
+
+
+def test_parse_record_key_value_fields():
+    assert parse_record(b'name=Bunny\nlanguage: EN\n') == [('name', 'Bunny'), ('language', 'EN')]
+
+
+def test_parse_form_keeps_first_value_of_unnamed_field():
+    assert parse_form(b'ids=2375,2901,2905') == ['2375', '2901', '2905']
+
+
+def test_parse_form_keeps_first_value_of_colon_field():
+    assert parse_form(b'audio:2375,2901,2905') == ['2375', '2901', '2905']
+
+
+def test_parse_form_splits_digits_on_high_bytes():
+    assert parse_form(b'\x01\x9f2375\x00\x00\x8a26072\x00') == ['2375', '26072']
+
+
+def test_parse_form_ignores_short_and_embedded_digit_runs():
+    assert parse_form(b'\x03\x7f7\xffA9c2\x00x86\x91v2.10\x002375\n') == ['2375']